@@ -0,0 +1,220 @@
+"""
+Encoded-image pass-through and resized derivatives.
+
+Imagen already returns an encoded image, so decoding it with PIL just to
+re-encode it as PNG costs a full decode plus a slow PNG encode on every
+request. ``ensure_format`` sniffs the bytes and only transcodes when the
+format really differs.
+
+Derivatives are smaller copies for previews: WebP and JPEG at a few widths.
+``DerivativeBuilder`` renders them on a thread pool after a generation and
+stores them in the image cache next to the original, so clients can fetch a
+small preview first.
+
+Settings come from the environment:
+    DERIVATIVE_WIDTHS      widths rendered ahead of time (default 256,512,1024)
+    DERIVATIVE_FORMATS     formats rendered ahead of time (default webp,jpeg)
+    DERIVATIVE_WORKERS     threads rendering derivatives (default 2; 0 = on demand only)
+"""
+
+import os
+import logging
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# format name -> (PIL format, MIME type, save options)
+FORMATS = {
+    'png': ('PNG', 'image/png', {}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True})
+}
+
+MAX_DERIVATIVE_WIDTH = 2048
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """
+    Identify an encoded image from its magic bytes.
+
+    Args:
+        data: Encoded image
+
+    Returns:
+        "png", "jpeg", "webp", or None if unrecognized
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def ensure_format(data: bytes, fmt: str = 'png') -> bytes:
+    """
+    Return the image encoded as ``fmt``, passing it through untouched if it already is.
+
+    Args:
+        data: Encoded image
+        fmt: Wanted format name from FORMATS
+
+    Returns:
+        Encoded image bytes
+    """
+    if sniff_format(data) == fmt:
+        return data
+
+    from PIL import Image
+    pil_format, _, options = FORMATS[fmt]
+    image = Image.open(BytesIO(data))
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, format=pil_format, **options)
+    return output.getvalue()
+
+
+def make_derivative(data: bytes, width: int, fmt: str) -> bytes:
+    """
+    Render a resized copy of an image.
+
+    Args:
+        data: Encoded original
+        width: Target width in pixels (never upscaled)
+        fmt: Format name from FORMATS
+
+    Returns:
+        Encoded derivative
+    """
+    from PIL import Image
+    pil_format, _, options = FORMATS[fmt]
+    image = Image.open(BytesIO(data))
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        # Decode at reduced scale where the codec supports it (JPEG), then resample
+        image.draft(image.mode, (width, height))
+        image = image.resize((width, height), Image.LANCZOS)
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, format=pil_format, **options)
+    return output.getvalue()
+
+
+def derivative_key(key: str, width: int, fmt: str) -> str:
+    """
+    Returns:
+        Cache key of a derivative of the image cached under ``key``
+    """
+    return f'{key}-w{width}-{fmt}'
+
+
+def parse_variant(width, fmt) -> Tuple[Optional[int], str]:
+    """
+    Validate a requested derivative.
+
+    Args:
+        width: Requested width (string or int), or None for the original size
+        fmt: Requested format name, or None for PNG
+
+    Returns:
+        Tuple of (width or None, format name)
+
+    Raises:
+        ValueError: If the width or format is not supported
+    """
+    fmt = (fmt or 'png').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}' (use one of {', '.join(FORMATS)})")
+    if width in (None, ''):
+        return None, fmt
+    width = int(width)
+    if not 0 < width <= MAX_DERIVATIVE_WIDTH:
+        raise ValueError(f"Width must be between 1 and {MAX_DERIVATIVE_WIDTH}")
+    return width, fmt
+
+
+class DerivativeBuilder:
+    """
+    Renders derivatives off the request path and caches them.
+    """
+
+    def __init__(self, cache, widths: List[int] = (256, 512, 1024), formats: List[str] = ('webp', 'jpeg'),
+                 max_workers: int = 2):
+        """
+        Args:
+            cache: ImageCache derivatives are stored in (None = no caching)
+            widths: Widths rendered ahead of time
+            formats: Formats rendered ahead of time
+            max_workers: Rendering threads (0 renders only on demand)
+        """
+        self.cache = cache
+        self.widths = list(widths)
+        self.formats = list(formats)
+        self._executor = (ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='derivatives')
+                          if max_workers > 0 else None)
+
+    @classmethod
+    def from_env(cls, cache) -> 'DerivativeBuilder':
+        """
+        Returns:
+            DerivativeBuilder configured from DERIVATIVE_* environment variables
+        """
+        widths = [int(w) for w in os.getenv('DERIVATIVE_WIDTHS', '256,512,1024').split(',') if w.strip()]
+        formats = [f.strip() for f in os.getenv('DERIVATIVE_FORMATS', 'webp,jpeg').split(',') if f.strip()]
+        return cls(cache, widths=widths, formats=formats,
+                   max_workers=int(os.getenv('DERIVATIVE_WORKERS', '2')))
+
+    def schedule(self, key: str, data: bytes):
+        """
+        Queue the configured derivatives of a freshly generated image.
+
+        Args:
+            key: Cache key of the original
+            data: Encoded original
+        """
+        if self._executor is None or self.cache is None:
+            return
+        self._executor.submit(self._render_all, key, data)
+
+    def _render_all(self, key: str, data: bytes):
+        for width in self.widths:
+            for fmt in self.formats:
+                try:
+                    self.get(key, data, width, fmt)
+                except Exception as e:
+                    logger.warning(f"Failed to render {fmt} derivative at {width}px for {key[:12]}: {e}")
+
+    def get(self, key: Optional[str], data: bytes, width: Optional[int], fmt: str) -> bytes:
+        """
+        Get a derivative, rendering and caching it if needed.
+
+        Args:
+            key: Cache key of the original (None if not cached)
+            data: Encoded original
+            width: Target width, or None for the original size
+            fmt: Format name from FORMATS
+
+        Returns:
+            Encoded derivative
+        """
+        if width is None:
+            return ensure_format(data, fmt)
+        if self.cache is None or key is None:
+            return make_derivative(data, width, fmt)
+        image, _ = self.cache.get_or_generate(derivative_key(key, width, fmt),
+                                              lambda: make_derivative(data, width, fmt))
+        return image
+
+    def get_stats(self) -> Dict:
+        return {
+            'widths': self.widths,
+            'formats': self.formats,
+            'background': self._executor is not None
+        }
@@ -1,23 +1,103 @@
 from google import genai
 from google.genai import types
-from PIL import Image
 import os
+import re
+import json
 from io import BytesIO
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file
 from flask_cors import CORS
 
+from image_cache import ImageCache, FakeImageClient, cache_key
+from derivatives import DerivativeBuilder, FORMATS, ensure_format, parse_variant
+from jobs import JobManager, JobLimitExceeded, DONE, FAILED, FINISHED
+
 app = Flask(__name__)
 CORS(app)
 
 api_key = os.getenv("GEMINI_API_KEY")
 base_url = "https://generativelanguage.googleapis.com/"
 
-client = genai.Client(
-    api_key=api_key,
-    http_options=types.HttpOptions(
-        base_url=base_url,
-    ),
-)
+MODEL = "imagen-3.0-generate-002"
+GENERATION_CONFIG = {"number_of_images": 1}
+
+if os.getenv("IMAGE_CLIENT") == "fake":
+    # Deterministic local images, for exercising the cache without API calls
+    client = FakeImageClient(delay_s=float(os.getenv("FAKE_IMAGE_DELAY_S", "0")))
+else:
+    client = genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            base_url=base_url,
+        ),
+    )
+
+# Shared by all gunicorn workers pointed at the same IMAGE_CACHE_DIR
+image_cache = ImageCache.from_env()
+derivatives = DerivativeBuilder.from_env(image_cache)
+
+
+class GenerationError(Exception):
+    pass
+
+
+def render_painting(prompt):
+    """
+    Generate a painting for a prompt and return it as PNG bytes.
+    """
+    response = client.models.generate_images(
+        model=MODEL,
+        prompt=prompt,
+        config=types.GenerateImagesConfig(**GENERATION_CONFIG)
+    )
+
+    if not (response and hasattr(response, "generated_images")):
+        raise GenerationError('Invalid response from the model')
+
+    # Imagen returns PNG already; only transcode if it ever sends something else
+    generated_image = response.generated_images[0]
+    return ensure_format(generated_image.image.image_bytes, 'png')
+
+
+def generate_cached(prompt):
+    """
+    Generate a painting, going through the image cache when it is enabled.
+
+    Returns:
+        Tuple of (PNG bytes, cache status)
+    """
+    if image_cache is None:
+        return render_painting(prompt), 'off'
+    key = cache_key(prompt, MODEL, GENERATION_CONFIG)
+    png_bytes, cache_status = image_cache.get_or_generate(key, lambda: render_painting(prompt))
+    if cache_status == 'miss':
+        # Previews are rendered in the background and cached next to the original
+        derivatives.schedule(key, png_bytes)
+    return png_bytes, cache_status
+
+
+jobs = JobManager.from_env(generate_cached)
+
+
+def image_response(prompt, png_bytes, cache_status):
+    """
+    Send a generated image, or the derivative asked for by ?width= and ?format=.
+    """
+    try:
+        width, fmt = parse_variant(request.args.get('width'), request.args.get('format'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    key = cache_key(prompt, MODEL, GENERATION_CONFIG) if image_cache is not None else None
+    data = derivatives.get(key, png_bytes, width, fmt)
+    response = send_file(
+        BytesIO(data),
+        mimetype=FORMATS[fmt][1],
+        as_attachment=False
+    )
+    response.headers['X-Cache'] = cache_status
+    if key is not None:
+        response.headers['X-Image-Key'] = key
+    return response
 
 @app.route('/generate-painting', methods=['POST'])
 def generate_painting():
@@ -27,30 +107,106 @@ def generate_painting():
     if not prompt:
         return {'error': 'No prompt provided'}, 400
 
-    response = client.models.generate_images(
-        model="imagen-3.0-generate-002",
-        prompt=prompt,
-        config=types.GenerateImagesConfig(
-            number_of_images=1,
-        )
-    )
+    try:
+        png_bytes, cache_status = generate_cached(prompt)
+    except GenerationError as e:
+        return {'error': str(e)}, 500
+    
+    return image_response(prompt, png_bytes, cache_status)
 
-    if not (response and hasattr(response, "generated_images")):
-        return {'error': 'Invalid response from the model'}, 500
+@app.route('/generate-painting/images/<key>', methods=['GET'])
+def cached_image(key):
+    # Fetch a cached painting (or a preview of it) by the X-Image-Key it was served with
+    if image_cache is None or not re.fullmatch(r'[0-9a-f]{64}', key):
+        return {'error': 'Unknown image'}, 404
+    png_bytes = image_cache.get(key)
+    if png_bytes is None:
+        return {'error': 'Unknown or evicted image'}, 404
 
-    generated_image = response.generated_images[0]
-    image = Image.open(BytesIO(generated_image.image.image_bytes))
-        
-    # Convert the image to bytes
-    img_byte_arr = BytesIO()
-    image.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
-    
-    return send_file(
-        img_byte_arr,
-        mimetype='image/png',
+    try:
+        width, fmt = parse_variant(request.args.get('width'), request.args.get('format'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    response = send_file(
+        BytesIO(derivatives.get(key, png_bytes, width, fmt)),
+        mimetype=FORMATS[fmt][1],
         as_attachment=False
     )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/generate-painting/jobs', methods=['POST'])
+def submit_job():
+    data = request.get_json(silent=True) or {}
+    prompt = data.get('prompt', '')
+    
+    if not prompt:
+        return {'error': 'No prompt provided'}, 400
+
+    # Per-client limits key on an explicit client ID, else the caller's address
+    client_id = request.headers.get('X-Client-Id') or request.remote_addr or 'anonymous'
+    try:
+        job = jobs.submit(client_id, prompt)
+    except JobLimitExceeded as e:
+        return {'error': str(e)}, 429
+
+    return {
+        **job.to_dict(),
+        'status_url': f'/generate-painting/jobs/{job.id}',
+        'events_url': f'/generate-painting/jobs/{job.id}/events',
+        'result_url': f'/generate-painting/jobs/{job.id}/result'
+    }, 202
+
+@app.route('/generate-painting/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {'error': 'Unknown or expired job'}, 404
+    return job.to_dict()
+
+@app.route('/generate-painting/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {'error': 'Unknown or expired job'}, 404
+
+    def stream():
+        # Server-sent events: one event per status change, comments as keep-alives
+        status = None
+        while True:
+            new_status = jobs.wait_for_change(job, status, timeout=15)
+            if new_status == status:
+                yield ': keep-alive\n\n'
+                continue
+            status = new_status
+            yield f'event: status\ndata: {json.dumps(job.to_dict())}\n\n'
+            if status in FINISHED:
+                return
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/generate-painting/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {'error': 'Unknown or expired job'}, 404
+    if job.status == FAILED:
+        return {'error': job.error}, 500
+    if job.status != DONE:
+        return job.to_dict(), 202
+    return image_response(job.prompt, job.result, job.cache_status)
+
+@app.route('/generate-painting/jobs', methods=['GET'])
+def job_stats():
+    return jobs.get_stats()
+
+@app.route('/generate-painting/cache', methods=['GET'])
+def cache_stats():
+    if image_cache is None:
+        return {'enabled': False}
+    return {'enabled': True, **image_cache.get_stats(), 'derivatives': derivatives.get_stats()}
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5051)
@@ -0,0 +1,321 @@
+"""
+Prompt-keyed on-disk cache for generated paintings.
+
+Image generation is the slowest and most expensive call in the stack, and
+the same prompt is often requested again moments later. Images are stored
+content-addressed by a hash of (normalized prompt, model, config) in a
+size-bounded directory evicted in least-recently-used order.
+
+The cache lives entirely on the filesystem, so gunicorn workers sharing a
+directory share its entries. Concurrent requests for the same prompt are
+coalesced into one generation by an fcntl lock on a lock file per key, so
+unrelated prompts never wait on each other. Each caller opens the lock file
+itself, so the lock serializes threads as well as worker processes.
+Eviction deletes an entry's lock file only while holding its lock, and a
+waiter that finds its lock file deleted from under it locks the new one.
+
+Settings come from the environment:
+    IMAGE_CACHE_DIR        cache directory (empty = caching off)
+    IMAGE_CACHE_MAX_MB     size bound in megabytes (default 512)
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOCK_DIR = '.locks'
+DATA_SUFFIX = '.img'
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalize a prompt so trivially different spellings share an entry.
+
+    Args:
+        prompt: Prompt as sent by the client
+
+    Returns:
+        Prompt with surrounding whitespace stripped and inner runs collapsed
+    """
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def cache_key(prompt: str, model: str, config: Optional[Dict] = None) -> str:
+    """
+    Content address of a generation request.
+
+    Args:
+        prompt: Generation prompt
+        model: Model name
+        config: Generation settings that affect the image
+
+    Returns:
+        Hex SHA-256 of the normalized request
+    """
+    payload = json.dumps({'prompt': normalize_prompt(prompt), 'model': model, 'config': config or {}},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ImageCache:
+    """
+    Size-bounded LRU of generated images, shared through a directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            directory: Directory entries are stored in
+            max_bytes: Total size of entries kept before evicting
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, LOCK_DIR), exist_ok=True)
+        self._stats_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'errors': 0}
+
+    @classmethod
+    def from_env(cls) -> Optional['ImageCache']:
+        """
+        Returns:
+            ImageCache configured from IMAGE_CACHE_* variables, or None when disabled
+        """
+        directory = os.getenv('IMAGE_CACHE_DIR', '')
+        if not directory:
+            return None
+        return cls(directory, max_bytes=int(float(os.getenv('IMAGE_CACHE_MAX_MB', '512')) * 1024 * 1024))
+
+    def _path(self, key: str, suffix: str = DATA_SUFFIX) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.directory, LOCK_DIR, key)
+
+    @contextmanager
+    def _key_lock(self, key: str):
+        """
+        Hold the exclusive lock for one key.
+        """
+        path = self._lock_path(key)
+        while True:
+            lock_file = open(path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Eviction may have deleted this lock file while we waited; lock the live one instead
+                try:
+                    held = os.fstat(lock_file.fileno())
+                    current = os.stat(path)
+                    if (held.st_dev, held.st_ino) == (current.st_dev, current.st_ino):
+                        break
+                except FileNotFoundError:
+                    pass
+            except BaseException:
+                lock_file.close()
+                raise
+            lock_file.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _remove_lock(self, key: str):
+        """
+        Delete a key's lock file unless someone holds or waits on its lock.
+        """
+        path = self._lock_path(key)
+        try:
+            lock_file = open(path, 'r')
+        except FileNotFoundError:
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Read an entry, marking it recently used.
+
+        Args:
+            key: Cache key from ``cache_key``
+
+        Returns:
+            Image bytes, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # Access time is tracked in mtime; atime is often disabled (noatime)
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes):
+        """
+        Store an entry and evict old ones if the cache is over its bound.
+
+        Args:
+            key: Cache key from ``cache_key``
+            data: Image bytes
+        """
+        tmp_path = self._path(key, f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        # Rename so other workers never read a partial image
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def get_or_generate(self, key: str, generate: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """
+        Return a cached image, generating it once if missing.
+
+        Callers racing on the same key (threads or processes) wait for the
+        first one's generation instead of starting their own.
+
+        Args:
+            key: Cache key from ``cache_key``
+            generate: Produces the image bytes on a miss
+
+        Returns:
+            Tuple of (image bytes, "hit" | "coalesced" | "miss")
+        """
+        data = self.get(key)
+        if data is not None:
+            self._count('hits')
+            return data, 'hit'
+
+        with self._key_lock(key):
+            # Whoever held the lock before us may have generated it
+            data = self.get(key)
+            if data is not None:
+                self._count('coalesced')
+                return data, 'coalesced'
+
+            self._count('misses')
+            data = generate()
+            try:
+                self.put(key, data)
+            except OSError as e:
+                self._count('errors')
+                logger.warning(f"Failed to cache image {key[:12]}: {e}")
+            return data, 'miss'
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits its bound.
+
+        An evicted entry's lock file is deleted too unless its lock is in
+        use, in which case the next eviction of that key removes it.
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(DATA_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.name))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+                self._count('evictions')
+            except FileNotFoundError:
+                pass
+            self._remove_lock(name[:-len(DATA_SUFFIX)])
+            total -= size
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about this worker's cache use and the shared directory.
+
+        Returns:
+            Dictionary with cache statistics
+        """
+        entries = 0
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(DATA_SUFFIX):
+                    entries += 1
+                    total += entry.stat().st_size
+        with self._stats_lock:
+            return {
+                **self.stats,
+                'entries': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'directory': self.directory
+            }
+
+
+class FakeImageClient:
+    """
+    Stand-in for ``genai.Client`` that renders a deterministic image per prompt.
+
+    Lets the cache and handlers be exercised without an API key or cost:
+    ``client.models.generate_images(model=..., prompt=..., config=...)``
+    returns an object shaped like the real response.
+    """
+
+    class _Response:
+        def __init__(self, image_bytes: bytes):
+            image = type('Image', (), {'image_bytes': image_bytes})()
+            self.generated_images = [type('GeneratedImage', (), {'image': image})()]
+
+    def __init__(self, delay_s: float = 0.0):
+        """
+        Args:
+            delay_s: Simulated generation latency
+        """
+        self.delay_s = delay_s
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.models = self
+
+    def generate_images(self, model: str, prompt: str, config=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay_s)
+
+        from io import BytesIO
+        from PIL import Image
+        seed = hashlib.sha256(f'{model}:{prompt}'.encode('utf-8')).digest()
+        image = Image.new('RGB', (64, 64), tuple(seed[:3]))
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        return self._Response(buffer.getvalue())
@@ -0,0 +1,235 @@
+"""
+In-process asynchronous generation jobs.
+
+A synchronous POST /generate-painting holds a worker thread for the whole
+Imagen call, so a few slow generations starve every other request. Jobs
+decouple the two: submitting returns a job ID at once, a bounded thread
+pool runs the generations, and clients poll (or stream) the job status
+and fetch the image when it is ready.
+
+Jobs live in the memory of the process that accepted them, so run the app
+as one gunicorn worker with threads (``gunicorn -w 1 --threads 8``) or
+route a client's requests to the same worker.
+
+Settings come from the environment:
+    JOB_WORKERS            generations running at once (default 2)
+    JOB_MAX_PER_CLIENT     unfinished jobs allowed per client (default 4)
+    JOB_MAX_PENDING        unfinished jobs allowed in total (default 64)
+    JOB_TTL_S              seconds finished jobs are kept (default 600)
+"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+
+class JobLimitExceeded(Exception):
+    """
+    Raised when a client (or the whole process) has too many unfinished jobs.
+    """
+
+
+class Job:
+    """
+    One generation request and its outcome.
+    """
+
+    def __init__(self, client_id: str, prompt: str):
+        self.id = uuid.uuid4().hex
+        self.client_id = client_id
+        self.prompt = prompt
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.cache_status = None
+        self.error = None
+
+    def to_dict(self) -> Dict:
+        info = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at
+        }
+        if self.started_at is not None:
+            info['queued_ms'] = round((self.started_at - self.created_at) * 1000, 1)
+        if self.finished_at is not None:
+            info['run_ms'] = round((self.finished_at - self.started_at) * 1000, 1)
+        if self.cache_status is not None:
+            info['cache'] = self.cache_status
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+
+class JobManager:
+    """
+    Bounded executor for generation jobs with per-client limits.
+    """
+
+    def __init__(self, generate: Callable[[str], Tuple[bytes, str]], max_workers: int = 2,
+                 max_per_client: int = 4, max_pending: int = 64, ttl_s: float = 600.0):
+        """
+        Args:
+            generate: Turns a prompt into (image bytes, cache status)
+            max_workers: Generations running at once
+            max_per_client: Unfinished jobs allowed per client
+            max_pending: Unfinished jobs allowed in total
+            ttl_s: Seconds finished jobs (and their images) are kept
+        """
+        self.generate = generate
+        self.max_workers = max_workers
+        self.max_per_client = max_per_client
+        self.max_pending = max_pending
+        self.ttl_s = ttl_s
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='generation')
+        self._jobs = {}
+        self._pending_by_client = defaultdict(int)
+        self._pending = 0
+        self._changed = threading.Condition()
+        self.stats = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0}
+
+    @classmethod
+    def from_env(cls, generate: Callable[[str], Tuple[bytes, str]]) -> 'JobManager':
+        """
+        Returns:
+            JobManager configured from JOB_* environment variables
+        """
+        return cls(
+            generate,
+            max_workers=int(os.getenv('JOB_WORKERS', '2')),
+            max_per_client=int(os.getenv('JOB_MAX_PER_CLIENT', '4')),
+            max_pending=int(os.getenv('JOB_MAX_PENDING', '64')),
+            ttl_s=float(os.getenv('JOB_TTL_S', '600'))
+        )
+
+    def _expire(self):
+        # Caller holds self._changed; run on every submit, poll and stats call
+        # so finished images are released even when nothing new is submitted
+        cutoff = time.time() - self.ttl_s
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, client_id: str, prompt: str) -> Job:
+        """
+        Queue a generation.
+
+        Args:
+            client_id: Identifies the caller for per-client limits
+            prompt: Generation prompt
+
+        Returns:
+            The queued job
+
+        Raises:
+            JobLimitExceeded: If the client or the process has too many unfinished jobs
+        """
+        with self._changed:
+            self._expire()
+            if self._pending_by_client[client_id] >= self.max_per_client:
+                self.stats['rejected'] += 1
+                raise JobLimitExceeded(f"Client already has {self.max_per_client} unfinished jobs")
+            if self._pending >= self.max_pending:
+                self.stats['rejected'] += 1
+                raise JobLimitExceeded("Generation queue is full")
+
+            job = Job(client_id, prompt)
+            self._jobs[job.id] = job
+            self._pending_by_client[client_id] += 1
+            self._pending += 1
+            self.stats['submitted'] += 1
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job):
+        with self._changed:
+            job.status = RUNNING
+            job.started_at = time.time()
+            self._changed.notify_all()
+
+        try:
+            result, cache_status = self.generate(job.prompt)
+            error = None
+        except Exception as e:
+            logger.error(f"Generation job {job.id} failed: {e}")
+            result, cache_status, error = None, None, str(e)
+
+        with self._changed:
+            job.result = result
+            job.cache_status = cache_status
+            job.error = error
+            job.status = FAILED if error is not None else DONE
+            job.finished_at = time.time()
+            self.stats[job.status] += 1
+            self._pending -= 1
+            self._pending_by_client[job.client_id] -= 1
+            if self._pending_by_client[job.client_id] <= 0:
+                del self._pending_by_client[job.client_id]
+            self._changed.notify_all()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Returns:
+            The job, or None if unknown or expired
+        """
+        with self._changed:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def wait_for_change(self, job: Job, last_status: Optional[str], timeout: float) -> str:
+        """
+        Block until the job's status differs from ``last_status``.
+
+        Args:
+            job: Job to watch
+            last_status: Status the caller has already seen
+            timeout: Maximum seconds to wait
+
+        Returns:
+            The job's status on return (unchanged if the wait timed out)
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: job.status != last_status, timeout=timeout)
+            return job.status
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about queued, running and finished jobs.
+
+        Returns:
+            Dictionary with job statistics
+        """
+        with self._changed:
+            self._expire()
+            by_status = defaultdict(int)
+            for job in self._jobs.values():
+                by_status[job.status] += 1
+            return {
+                **self.stats,
+                'jobs': dict(by_status),
+                'pending': self._pending,
+                'clients_pending': len(self._pending_by_client),
+                'max_workers': self.max_workers,
+                'max_per_client': self.max_per_client,
+                'max_pending': self.max_pending
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
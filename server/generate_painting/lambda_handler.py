@@ -1,26 +1,125 @@
+import time
+
+_MODULE_START = time.perf_counter()
+
 import json
 import base64
 import os
-from io import BytesIO
-from google import genai
-from google.genai import types
-from PIL import Image
+import threading
 
-# Initialize the client outside the handler for reuse across invocations
+from image_cache import ImageCache, FakeImageClient, cache_key
+from derivatives import DerivativeBuilder, FORMATS, ensure_format, parse_variant
+from object_store import ImageStore
+
+# Only cheap setup happens at import; the genai client (and its imports) is
+# built on first use so cold starts that fail validation never pay for it
 api_key = os.getenv("GEMINI_API_KEY")
 base_url = "https://generativelanguage.googleapis.com/"
 
-client = genai.Client(
-    api_key=api_key,
-    http_options=types.HttpOptions(
-        base_url=base_url,
-    ),
-)
+MODEL = "imagen-3.0-generate-002"
+GENERATION_CONFIG = {"number_of_images": 1}
+
+# "inline" returns base64 image bodies, "reference" uploads to IMAGE_BUCKET and returns a URL
+RESPONSE_MODE = os.getenv("RESPONSE_MODE", "inline")
+# Inline bodies larger than this fall back to a reference (Lambda caps sync responses at 6 MB)
+INLINE_MAX_BYTES = int(os.getenv("INLINE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+_client = None
+_types = None
+_client_lock = threading.Lock()
+
+# Point IMAGE_CACHE_DIR at /tmp (or an EFS mount to share across containers)
+image_cache = ImageCache.from_env()
+# A frozen Lambda container can't finish background work, so derivatives render on demand
+derivatives = DerivativeBuilder(image_cache, max_workers=0)
+image_store = ImageStore.from_env()
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS'
+}
+
+INIT_MS = (time.perf_counter() - _MODULE_START) * 1000
+_cold = True
+
+
+class GenerationError(Exception):
+    pass
+
+
+def get_client():
+    """
+    Build the generation client on first use and reuse it across invocations.
+    """
+    global _client, _types
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if os.getenv("IMAGE_CLIENT") == "fake":
+                    _client = FakeImageClient(delay_s=float(os.getenv("FAKE_IMAGE_DELAY_S", "0")))
+                else:
+                    from google import genai
+                    from google.genai import types
+                    _types = types
+                    _client = genai.Client(
+                        api_key=api_key,
+                        http_options=types.HttpOptions(
+                            base_url=base_url,
+                        ),
+                    )
+    return _client
+
+
+def render_painting(prompt, timings):
+    """
+    Generate a painting for a prompt and return it as PNG bytes.
+    """
+    start = time.perf_counter()
+    client = get_client()
+    timings['client'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    response = client.models.generate_images(
+        model=MODEL,
+        prompt=prompt,
+        config=_types.GenerateImagesConfig(**GENERATION_CONFIG) if _types else dict(GENERATION_CONFIG)
+    )
+    timings['generate'] = (time.perf_counter() - start) * 1000
+
+    if not (response and hasattr(response, "generated_images")):
+        raise GenerationError('Invalid response from the model')
+
+    # Imagen returns PNG already; only transcode if it ever sends something else
+    generated_image = response.generated_images[0]
+    return ensure_format(generated_image.image.image_bytes, 'png')
+
+
+def json_response(status_code, payload, timings=None):
+    headers = {'Content-Type': 'application/json', **CORS_HEADERS}
+    if timings:
+        headers['Server-Timing'] = server_timing(timings)
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': json.dumps(payload)
+    }
+
+
+def server_timing(timings):
+    return ', '.join(f'{name};dur={ms:.1f}' for name, ms in timings.items())
+
 
 def lambda_handler(event, context):
     """
     AWS Lambda handler for image generation using Google's Imagen API
     """
+    global _cold
+    handler_start = time.perf_counter()
+    cold, _cold = _cold, False
+    # Module import time is only part of this invocation on a cold start
+    timings = {'init': INIT_MS} if cold else {}
+
     try:
         # Parse the request body
         if 'body' in event:
@@ -28,95 +127,94 @@ def lambda_handler(event, context):
                 body = base64.b64decode(event['body']).decode('utf-8')
             else:
                 body = event['body']
-            
+
             if isinstance(body, str):
                 data = json.loads(body)
             else:
                 data = body
         else:
             data = event
-        
+
         # Extract prompt from request
         prompt = data.get('prompt', '')
-        
+
         if not prompt:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
-                },
-                'body': json.dumps({'error': 'No prompt provided'})
-            }
-
-        # Generate image using Imagen API
-        response = client.models.generate_images(
-            model="imagen-3.0-generate-002",
-            prompt=prompt,
-            config=types.GenerateImagesConfig(
-                number_of_images=1,
-            )
-        )
-
-        if not (response and hasattr(response, "generated_images")):
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS'
-                },
-                'body': json.dumps({'error': 'Invalid response from the model'})
-            }
-
-        # Process the generated image
-        generated_image = response.generated_images[0]
-        image = Image.open(BytesIO(generated_image.image.image_bytes))
-        
-        # Convert image to base64 for HTTP response
-        img_byte_arr = BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        
+            return json_response(400, {'error': 'No prompt provided'})
+
+        # Optional preview: "width" and "format" ("webp", "jpeg" or "png")
+        try:
+            width, fmt = parse_variant(data.get('width'), data.get('format'))
+        except ValueError as e:
+            return json_response(400, {'error': str(e)})
+
+        response_mode = data.get('response', RESPONSE_MODE)
+        if response_mode not in ('inline', 'reference'):
+            return json_response(400, {'error': "response must be 'inline' or 'reference'"})
+        if response_mode == 'reference' and image_store is None:
+            return json_response(400, {'error': 'Reference responses need IMAGE_BUCKET to be configured'})
+
+        # Generate image using Imagen API, or reuse a cached image for the same prompt
+        try:
+            key = None
+            if image_cache is None:
+                png_bytes, cache_status = render_painting(prompt, timings), 'off'
+            else:
+                key = cache_key(prompt, MODEL, GENERATION_CONFIG)
+                png_bytes, cache_status = image_cache.get_or_generate(
+                    key, lambda: render_painting(prompt, timings))
+            start = time.perf_counter()
+            image_bytes = derivatives.get(key, png_bytes, width, fmt)
+            timings['encode'] = (time.perf_counter() - start) * 1000
+        except GenerationError as e:
+            return json_response(500, {'error': str(e)})
+
+        content_type = FORMATS[fmt][1]
+        if response_mode == 'inline' and len(image_bytes) > INLINE_MAX_BYTES and image_store is not None:
+            # Too big for a synchronous Lambda response once base64-encoded
+            response_mode = 'reference'
+
+        if response_mode == 'reference':
+            start = time.perf_counter()
+            reference = image_store.put(image_bytes, content_type)
+            timings['upload'] = (time.perf_counter() - start) * 1000
+            timings['handler'] = (time.perf_counter() - handler_start) * 1000
+            log_invocation(cold, response_mode, cache_status, len(image_bytes), timings)
+            response = json_response(200, {**reference, 'cache': cache_status}, timings)
+            response['headers']['X-Cache'] = cache_status
+            return response
+
         # Encode image as base64 for API Gateway response
-        image_base64 = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-        
+        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        timings['handler'] = (time.perf_counter() - handler_start) * 1000
+        log_invocation(cold, response_mode, cache_status, len(image_bytes), timings)
+
         return {
             'statusCode': 200,
             'headers': {
-                'Content-Type': 'image/png',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS'
+                'Content-Type': content_type,
+                'X-Cache': cache_status,
+                'Server-Timing': server_timing(timings),
+                **CORS_HEADERS
             },
             'isBase64Encoded': True,
             'body': image_base64
         }
-        
+
     except json.JSONDecodeError:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS'
-            },
-            'body': json.dumps({'error': 'Invalid JSON in request body'})
-        }
-        
+        return json_response(400, {'error': 'Invalid JSON in request body'})
+
     except Exception as e:
         print(f"Error generating image: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS'
-            },
-            'body': json.dumps({'error': f'Internal server error: {str(e)}'})
-        }
+        return json_response(500, {'error': f'Internal server error: {str(e)}'})
+
+
+def log_invocation(cold, response_mode, cache_status, image_bytes, timings):
+    # One JSON line per invocation, easy to query with CloudWatch Logs Insights
+    print(json.dumps({
+        'event': 'generate_painting',
+        'cold_start': cold,
+        'response_mode': response_mode,
+        'cache': cache_status,
+        'image_bytes': image_bytes,
+        'timings_ms': {name: round(ms, 1) for name, ms in timings.items()}
+    }))
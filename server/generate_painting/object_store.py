@@ -0,0 +1,110 @@
+"""
+Object storage for generated images returned by reference.
+
+Returning an image inline from Lambda means base64-encoding it into the
+response body (a third larger, and capped by the API Gateway / Lambda
+payload limits). Instead the handler can upload the image once and return
+a short-lived presigned URL.
+
+Objects are content-addressed, so repeated prompts reuse the same object.
+Any S3-compatible endpoint works, including a local moto server:
+
+    moto_server -p 5000
+    IMAGE_BUCKET=paintings S3_ENDPOINT_URL=http://localhost:5000 \\
+        AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test AWS_DEFAULT_REGION=us-east-1 ...
+
+Settings come from the environment:
+    IMAGE_BUCKET           bucket name (empty = reference mode unavailable)
+    IMAGE_PREFIX           key prefix (default "paintings/")
+    S3_ENDPOINT_URL        custom endpoint (moto, MinIO); default AWS
+    IMAGE_URL_TTL_S        lifetime of presigned URLs (default 3600)
+"""
+
+import os
+import hashlib
+import threading
+from typing import Dict, Optional
+
+EXTENSIONS = {'image/png': 'png', 'image/webp': 'webp', 'image/jpeg': 'jpg'}
+
+
+class ImageStore:
+    """
+    Uploads images to an S3 bucket and hands out presigned URLs.
+    """
+
+    def __init__(self, bucket: str, prefix: str = 'paintings/', endpoint_url: Optional[str] = None,
+                 url_ttl_s: int = 3600):
+        """
+        Args:
+            bucket: Bucket images are written to
+            prefix: Key prefix for images
+            endpoint_url: Custom S3 endpoint, e.g. a moto server
+            url_ttl_s: Lifetime of presigned URLs in seconds
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.url_ttl_s = url_ttl_s
+        self._s3 = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional['ImageStore']:
+        """
+        Returns:
+            ImageStore configured from the environment, or None if no bucket is set
+        """
+        bucket = os.getenv('IMAGE_BUCKET', '')
+        if not bucket:
+            return None
+        return cls(bucket, prefix=os.getenv('IMAGE_PREFIX', 'paintings/'),
+                   endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,
+                   url_ttl_s=int(os.getenv('IMAGE_URL_TTL_S', '3600')))
+
+    @property
+    def s3(self):
+        # boto3 takes a noticeable share of a cold start; only pay for it when used
+        if self._s3 is None:
+            with self._lock:
+                if self._s3 is None:
+                    import boto3
+                    self._s3 = boto3.client('s3', endpoint_url=self.endpoint_url)
+        return self._s3
+
+    def _exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put(self, data: bytes, content_type: str) -> Dict:
+        """
+        Upload an image (once per distinct content) and presign a URL for it.
+
+        Args:
+            data: Encoded image
+            content_type: MIME type of the image
+
+        Returns:
+            Dictionary with url, bucket, key, content_type, bytes and expires_in
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        key = f"{self.prefix}{digest}.{EXTENSIONS.get(content_type, 'bin')}"
+        if not self._exists(key):
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type,
+                               CacheControl='public, max-age=31536000, immutable')
+        url = self.s3.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                             ExpiresIn=self.url_ttl_s)
+        return {
+            'url': url,
+            'bucket': self.bucket,
+            'key': key,
+            'content_type': content_type,
+            'bytes': len(data),
+            'expires_in': self.url_ttl_s
+        }
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the recommendation engine.
+
+Builds synthetic catalogs of random unit 1536-d vectors in a local ChromaDB
+PersistentClient (reused between runs when already built), then drives
+ChromaService and ChromaRecommendationService with liked- and excluded-list
+sizes drawn from heavy-tailed distributions. For the recommend, diverse,
+batch and end-to-end service paths it reports latency percentiles,
+throughput, memory and recall@k against exact (brute-force) search, and
+writes everything to a JSON file so runs can be compared across commits.
+
+Usage:
+    python benchmark.py --sizes 10000,100000 --queries 200
+    python benchmark.py --sizes 10000 --compare benchmark_results/<previous>.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import resource
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+import numpy as np
+
+from chroma_service import ChromaService
+from chroma_recommendation_service import ChromaRecommendationService
+from painting_index import EMBEDDING_DIM
+from metrics import get_rss_bytes
+
+logger = logging.getLogger('benchmark')
+
+PATHS = ['recommend', 'diverse', 'batch', 'service']
+
+
+def git_commit() -> Optional[str]:
+    """
+    Returns:
+        Current git commit hash, or None outside a git checkout
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def painting_id(row: int) -> str:
+    return f"bench{row:07d}"
+
+
+def random_unit_vectors(rng: np.random.Generator, count: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, EMBEDDING_DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def build_catalog(data_dir: str, size: int, seed: int, batch_size: int = 5000) -> Dict:
+    """
+    Create (or reuse) a synthetic catalog in a local PersistentClient.
+
+    Args:
+        data_dir: Directory holding benchmark catalogs
+        size: Number of paintings
+        seed: Random seed for the vectors
+        batch_size: Paintings added per ``collection.add`` call
+
+    Returns:
+        Dictionary with the catalog path and build timings
+    """
+    path = os.path.join(data_dir, f"catalog-{size}-seed{seed}")
+    service = ChromaService(persist_directory=path)
+
+    if service.collection is not None and service.collection.count() == size:
+        logger.info(f"Reusing catalog of {size} paintings at {path}")
+        return {'path': path, 'reused': True, 'build_s': None}
+
+    if service.collection is not None:
+        service.client.delete_collection(service.collection_name)
+    service.create_collection()
+
+    logger.info(f"Building catalog of {size} paintings at {path}")
+    rng = np.random.default_rng(seed)
+    start_time = time.time()
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        ids = [painting_id(row) for row in range(start, start + count)]
+        service.collection.add(
+            ids=ids,
+            embeddings=random_unit_vectors(rng, count),
+            metadatas=[{'mongodb_id': pid} for pid in ids]
+        )
+    build_s = time.time() - start_time
+    logger.info(f"Built catalog in {build_s:.1f}s")
+
+    return {'path': path, 'reused': False, 'build_s': round(build_s, 2)}
+
+
+def generate_workload(rng: np.random.Generator, ids: List[str], queries: int,
+                      liked_median: float, excluded_median: float) -> List[Dict]:
+    """
+    Draw per-user liked and excluded lists.
+
+    Sizes are log-normal (most users have a handful of likes and a few dozen
+    views; a long tail has hundreds or thousands).
+
+    Args:
+        rng: Random generator
+        ids: Catalog painting IDs
+        queries: Number of simulated users
+        liked_median: Median number of liked paintings
+        excluded_median: Median number of viewed (excluded) paintings
+
+    Returns:
+        List of dictionaries with ``liked`` and ``excluded`` ID lists
+    """
+    workload = []
+    cap = len(ids) // 4
+    for _ in range(queries):
+        n_liked = int(np.clip(rng.lognormal(np.log(liked_median), 1.0), 1, min(500, cap)))
+        n_excluded = int(np.clip(rng.lognormal(np.log(excluded_median), 1.2), 0, min(5000, cap)))
+        rows = rng.choice(len(ids), size=n_liked + n_excluded, replace=False)
+        workload.append({
+            'liked': [ids[row] for row in rows[:n_liked]],
+            'excluded': [ids[row] for row in rows[n_liked:]]
+        })
+    return workload
+
+
+def exact_top_k(vectors: np.ndarray, id_to_row: Dict[str, int], queries: np.ndarray,
+                exclusions: List[List[str]], k: int, chunk_size: int = 50000) -> List[List[int]]:
+    """
+    Brute-force cosine top-k for a set of query vectors, honouring exclusions.
+
+    Makes one pass over the catalog in chunks, keeping the best ``k`` plus
+    the largest exclusion list candidates per query.
+
+    Args:
+        vectors: Catalog embeddings (unit length)
+        id_to_row: Painting ID to row number
+        queries: Query vectors, one per row
+        exclusions: Painting IDs excluded for each query
+        k: Number of results per query
+        chunk_size: Catalog rows scored per matrix product
+
+    Returns:
+        Row numbers of the exact top-k for each query, best first
+    """
+    keep = k + max((len(excluded) for excluded in exclusions), default=0)
+    queries = np.asarray(queries, dtype=np.float32)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+
+    for start in range(0, len(vectors), chunk_size):
+        scores = queries @ vectors[start:start + chunk_size].T
+        rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        scores = np.hstack([best_scores, scores])
+        rows = np.hstack([best_rows, rows])
+        if scores.shape[1] > keep:
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            scores = np.take_along_axis(scores, top, axis=1)
+            rows = np.take_along_axis(rows, top, axis=1)
+        best_scores, best_rows = scores, rows
+
+    results = []
+    for i, excluded in enumerate(exclusions):
+        excluded_rows = {id_to_row[pid] for pid in excluded if pid in id_to_row}
+        order = np.argsort(-best_scores[i])
+        results.append([int(row) for row in best_rows[i][order] if row not in excluded_rows][:k])
+    return results
+
+
+def recall(returned_ids: List[str], exact_rows: List[int], id_to_row: Dict[str, int]) -> Optional[float]:
+    if not exact_rows:
+        return None
+    returned_rows = {id_to_row.get(pid) for pid in returned_ids}
+    return len(returned_rows.intersection(exact_rows)) / len(exact_rows)
+
+
+def summarize(latencies_ms: List[float], wall_s: float, recalls: List[Optional[float]]) -> Dict:
+    latencies = np.asarray(latencies_ms)
+    recalls = [r for r in recalls if r is not None]
+    return {
+        'queries': len(latencies_ms),
+        'latency_ms': {
+            'mean': round(float(latencies.mean()), 3),
+            'p50': round(float(np.percentile(latencies, 50)), 3),
+            'p95': round(float(np.percentile(latencies, 95)), 3),
+            'p99': round(float(np.percentile(latencies, 99)), 3),
+            'max': round(float(latencies.max()), 3)
+        },
+        'throughput_qps': round(len(latencies_ms) / wall_s, 2) if wall_s > 0 else None,
+        'recall_at_k': round(float(np.mean(recalls)), 4) if recalls else None
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_recommend(service: ChromaService, workload: List[Dict], k: int) -> Dict:
+    index = service.index
+    queries, exclusions, returned, latencies = [], [], [], []
+
+    wall_start = time.perf_counter()
+    for user in workload:
+        recs, ms = timed(service.get_recommendations_for_user, user['liked'], user['excluded'], k)
+        latencies.append(ms)
+        returned.append([rec['_id'] for rec in recs])
+    wall_s = time.perf_counter() - wall_start
+
+    for user in workload:
+        queries.append(service.aggregate_user_preferences(user['liked'], 'centroid'))
+        exclusions.append(user['liked'] + user['excluded'])
+    exact = exact_top_k(index.vectors, index.id_to_row, queries, exclusions, k)
+
+    recalls = [recall(ids, rows, index.id_to_row) for ids, rows in zip(returned, exact)]
+    return summarize(latencies, wall_s, recalls)
+
+
+def bench_diverse(service: ChromaService, workload: List[Dict], k: int) -> Dict:
+    index = service.index
+    returned, latencies = [], []
+
+    wall_start = time.perf_counter()
+    for user in workload:
+        recs, ms = timed(service.get_diverse_recommendations, user['liked'], user['excluded'], k)
+        latencies.append(ms)
+        returned.append([rec['_id'] for rec in recs])
+    wall_s = time.perf_counter() - wall_start
+
+    # Exact reference: the same centroid + weighted_average merge, with brute-force search
+    half = max(1, k // 2)
+    queries, exclusions = [], []
+    for user in workload:
+        exclusions.extend([user['liked'] + user['excluded']] * 2)
+        queries.append(service.aggregate_user_preferences(user['liked'], 'centroid'))
+        queries.append(service.aggregate_user_preferences(user['liked'], 'weighted_average'))
+    exact = exact_top_k(index.vectors, index.id_to_row, queries, exclusions, half)
+
+    recalls = []
+    for i, ids in enumerate(returned):
+        rows = list(dict.fromkeys(exact[2 * i] + exact[2 * i + 1]))[:k]
+        recalls.append(recall(ids, rows, index.id_to_row))
+    return summarize(latencies, wall_s, recalls)
+
+
+def bench_batch(service: ChromaService, workload: List[Dict], k: int, batch_size: int) -> Dict:
+    index = service.index
+    latencies, recalls = [], []
+
+    batches = []
+    wall_start = time.perf_counter()
+    for start in range(0, len(workload), batch_size):
+        users = workload[start:start + batch_size]
+        queries = [service.aggregate_user_preferences(user['liked'], 'centroid') for user in users]
+        excluded = {pid for user in users for pid in user['liked'] + user['excluded']}
+
+        results, ms = timed(service.get_similar_paintings_batch, queries, k, excluded)
+        latencies.append(ms)
+        batches.append((queries, list(excluded), results))
+    wall_s = time.perf_counter() - wall_start
+
+    for queries, excluded, results in batches:
+        exact = exact_top_k(index.vectors, index.id_to_row, queries, [excluded] * len(queries), k)
+        for recs, rows in zip(results, exact):
+            recalls.append(recall([rec['_id'] for rec in recs], rows, index.id_to_row))
+
+    summary = summarize(latencies, wall_s, recalls)
+    summary['batch_size'] = batch_size
+    summary['throughput_qps'] = round(len(workload) / wall_s, 2) if wall_s > 0 else None
+    return summary
+
+
+def bench_service(rec_service: ChromaRecommendationService, workload: List[Dict], k: int,
+                  concurrency: int) -> Dict:
+    def run(user):
+        response, ms = timed(rec_service.get_recommendations, user['liked'], user['excluded'], k)
+        return ms, 'error' in response
+
+    wall_start = time.perf_counter()
+    results = [run(user) for user in workload]
+    wall_s = time.perf_counter() - wall_start
+    summary = summarize([ms for ms, _ in results], wall_s, [])
+    summary['errors'] = sum(1 for _, error in results if error)
+
+    if concurrency > 1:
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            concurrent_results = list(executor.map(run, workload))
+        wall_s = time.perf_counter() - wall_start
+        summary['concurrent'] = summarize([ms for ms, _ in concurrent_results], wall_s, [])
+        summary['concurrent']['threads'] = concurrency
+    return summary
+
+
+def run_catalog(size: int, args) -> Dict:
+    rss_start = get_rss_bytes()
+    catalog = build_catalog(args.data_dir, size, args.seed)
+
+    start_time = time.time()
+    service = ChromaService(persist_directory=catalog['path'])
+    if not service.load_index():
+        raise RuntimeError(f"Could not load index for catalog at {catalog['path']}")
+    service.warm_up()
+    catalog['index_load_s'] = round(time.time() - start_time, 2)
+    catalog['size'] = size
+    catalog['rss_after_index_bytes'] = get_rss_bytes()
+
+    rng = np.random.default_rng(args.seed + size)
+    workload = generate_workload(rng, service.index.ids, args.queries,
+                                 args.liked_median, args.excluded_median)
+    catalog['workload'] = {
+        'queries': len(workload),
+        'liked_p50': int(np.median([len(user['liked']) for user in workload])),
+        'liked_max': max(len(user['liked']) for user in workload),
+        'excluded_p50': int(np.median([len(user['excluded']) for user in workload])),
+        'excluded_max': max(len(user['excluded']) for user in workload)
+    }
+
+    results = {}
+    for path in args.paths:
+        logger.info(f"[{size}] benchmarking {path}")
+        if path == 'recommend':
+            results[path] = bench_recommend(service, workload, args.k)
+        elif path == 'diverse':
+            results[path] = bench_diverse(service, workload, args.k)
+        elif path == 'batch':
+            results[path] = bench_batch(service, workload, args.k, args.batch_size)
+        elif path == 'service':
+            rec_service = ChromaRecommendationService(chroma_dir=catalog['path'])
+            results[path] = bench_service(rec_service, workload, args.k, args.concurrency)
+            rec_service.shutdown()
+        logger.info(f"[{size}] {path}: {results[path]['latency_ms']}")
+
+    catalog['paths'] = results
+    catalog['rss_end_bytes'] = get_rss_bytes()
+    catalog['rss_growth_bytes'] = catalog['rss_end_bytes'] - rss_start
+    return catalog
+
+
+def compare(current: Dict, baseline_path: str):
+    """
+    Print p50/p95 latency and recall changes against a previous run.
+
+    Args:
+        current: Results of this run
+        baseline_path: JSON file written by a previous run
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    baseline_catalogs = {catalog['size']: catalog for catalog in baseline['catalogs']}
+    print(f"Compared with {baseline['meta'].get('commit')} ({baseline_path})")
+    for catalog in current['catalogs']:
+        previous = baseline_catalogs.get(catalog['size'])
+        if not previous:
+            continue
+        for path, result in catalog['paths'].items():
+            before = previous['paths'].get(path)
+            if not before:
+                continue
+            line = [f"{catalog['size']:>8} {path:<10}"]
+            for stat in ('p50', 'p95'):
+                old, new = before['latency_ms'][stat], result['latency_ms'][stat]
+                change = (new - old) / old * 100 if old else 0.0
+                line.append(f"{stat} {old:8.2f} -> {new:8.2f}ms ({change:+.1f}%)")
+            if result.get('recall_at_k') is not None and before.get('recall_at_k') is not None:
+                line.append(f"recall {before['recall_at_k']:.4f} -> {result['recall_at_k']:.4f}")
+            print('  '.join(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommendation engine benchmark")
+    parser.add_argument('--sizes', default='10000,100000',
+                       help='Comma-separated catalog sizes, e.g. 10000,100000,1000000')
+    parser.add_argument('--data-dir', default='./benchmark_data',
+                       help='Directory for synthetic catalogs (reused between runs)')
+    parser.add_argument('--output-dir', default='./benchmark_results',
+                       help='Directory JSON results are written to')
+    parser.add_argument('--paths', default=','.join(PATHS),
+                       help=f'Comma-separated paths to benchmark ({",".join(PATHS)})')
+    parser.add_argument('--queries', type=int, default=200, help='Simulated users per catalog')
+    parser.add_argument('--k', type=int, default=10, help='Recommendations per query')
+    parser.add_argument('--batch-size', type=int, default=16, help='Queries per batch call')
+    parser.add_argument('--concurrency', type=int, default=4,
+                       help='Threads for the concurrent service run (1 to skip)')
+    parser.add_argument('--liked-median', type=float, default=8, help='Median liked-list size')
+    parser.add_argument('--excluded-median', type=float, default=50, help='Median excluded-list size')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    args = parser.parse_args()
+
+    args.paths = [path for path in args.paths.split(',') if path]
+    unknown = set(args.paths) - set(PATHS)
+    if unknown:
+        parser.error(f"Unknown paths: {', '.join(sorted(unknown))}")
+
+    # Keep the services quiet; their per-request INFO logging would dominate timings
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    # Benchmarks always run against a local PersistentClient
+    os.environ.pop('CHROMA_API_KEY', None)
+
+    import chromadb
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'chromadb': chromadb.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key != 'compare'}
+        },
+        'catalogs': []
+    }
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        results['catalogs'].append(run_catalog(size, args))
+
+    # ru_maxrss is KiB on Linux
+    results['meta']['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    commit = (results['meta']['commit'] or 'nogit')[:10]
+    output_path = os.path.join(args.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Portable catalog bundles: export a paintings collection to a compact,
+versioned, checksummed directory and restore it elsewhere.
+
+Deploying a catalog otherwise means shipping a whole ``chroma_db``
+directory or re-running ``add_paintings`` row by row from embeddings.json.
+A bundle holds:
+
+    manifest.json    format version, counts, dtype, HNSW config, catalog
+                     version stamp and a SHA-256 per file
+    ids.npy          painting IDs, in row order
+    vectors.npy      embedding matrix (float32, or float16 at half the size)
+    metadata.jsonl   one metadata object per row
+    hnsw/            optional copy of the collection's HNSW segment files
+
+Vectors are written and read as memory-mapped .npy files, so export and
+restore stream without holding the catalog in memory twice. Restoring
+creates the collection with the bundle's HNSW settings and inserts the
+rows in large batches; the recommendation service can also take its
+in-memory index straight from a bundle (``--bundle``), skipping the slow
+read-back from ChromaDB at startup.
+
+ChromaDB offers no supported way to attach a prebuilt HNSW graph to a
+collection, so ``hnsw/`` is carried for inspection and same-version
+offline restores only; ``import`` rebuilds the graph from the vectors.
+
+Usage:
+    python catalog_bundle.py export --chroma-dir ./chroma_db --out ./bundle --dtype float16
+    python catalog_bundle.py verify --bundle ./bundle
+    python catalog_bundle.py import --bundle ./bundle --chroma-dir ./new_chroma_db
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import argparse
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+from painting_index import PaintingIndex, EMBEDDING_DIM
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 'painting-catalog-bundle'
+BUNDLE_VERSION = 1
+MANIFEST = 'manifest.json'
+DTYPES = ('float32', 'float16')
+
+
+class BundleError(Exception):
+    """
+    Raised when a bundle is missing, corrupt or from an unsupported version.
+    """
+
+
+def _sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hnsw_segment_dir(persist_directory: str, collection_name: str) -> Optional[str]:
+    # Local PersistentClient layout: <persist>/<vector segment id>/ holds the HNSW files
+    db_path = os.path.join(persist_directory, 'chroma.sqlite3')
+    if not os.path.exists(db_path):
+        return None
+    with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as db:
+        row = db.execute(
+            "SELECT s.id FROM segments s JOIN collections c ON s.collection = c.id "
+            "WHERE c.name = ? AND s.scope = 'VECTOR'", (collection_name,)
+        ).fetchone()
+    if row is None:
+        return None
+    segment_dir = os.path.join(persist_directory, row[0])
+    return segment_dir if os.path.isdir(segment_dir) else None
+
+
+def export_bundle(service, out_dir: str, dtype: str = 'float32', include_hnsw: bool = False,
+                  batch_size: int = 5000) -> Dict:
+    """
+    Write a service's collection to a bundle directory.
+
+    Args:
+        service: ChromaService with an open collection
+        out_dir: Bundle directory (created; must not already hold a bundle)
+        dtype: Vector precision, "float32" or "float16"
+        include_hnsw: Also copy the HNSW segment files (local, unsharded collections)
+        batch_size: Rows read per ``collection.get`` call
+
+    Returns:
+        The bundle manifest
+
+    Raises:
+        BundleError: If the collection is unavailable or the target holds a bundle
+    """
+    if dtype not in DTYPES:
+        raise BundleError(f"dtype must be one of {DTYPES}")
+    if service.collection is None:
+        raise BundleError("Collection not initialized")
+    if os.path.exists(os.path.join(out_dir, MANIFEST)):
+        raise BundleError(f"{out_dir} already contains a bundle")
+    os.makedirs(out_dir, exist_ok=True)
+
+    start_time = time.time()
+    count = service.collection.count()
+    vectors = np.lib.format.open_memmap(os.path.join(out_dir, 'vectors.npy'), mode='w+',
+                                        dtype=dtype, shape=(count, EMBEDDING_DIM))
+    ids = []
+    with open(os.path.join(out_dir, 'metadata.jsonl'), 'w') as metadata_file:
+        while len(ids) < count:
+            results = service.collection.get(include=['embeddings', 'metadatas'],
+                                              limit=batch_size, offset=len(ids))
+            batch_ids = results.get('ids') or []
+            if not batch_ids:
+                break
+            if len(ids) + len(batch_ids) > count:
+                raise BundleError("Collection grew during export")
+            vectors[len(ids):len(ids) + len(batch_ids)] = np.asarray(results['embeddings'], dtype=np.float32)
+            for metadata in results.get('metadatas') or [{}] * len(batch_ids):
+                metadata_file.write(json.dumps(metadata or {}, separators=(',', ':')) + '\n')
+            ids.extend(batch_ids)
+    vectors.flush()
+    del vectors
+    if len(ids) != count:
+        raise BundleError(f"Read {len(ids)} of {count} paintings; collection changed during export")
+    np.save(os.path.join(out_dir, 'ids.npy'), np.array(ids, dtype=str))
+
+    files = ['ids.npy', 'vectors.npy', 'metadata.jsonl']
+    hnsw_included = False
+    if include_hnsw:
+        segment_dir = (_hnsw_segment_dir(service.persist_directory, service.collection_name)
+                       if service.num_shards == 1 else None)
+        if segment_dir is None:
+            logger.warning("HNSW files not found (remote or sharded collection?); exporting vectors only")
+        else:
+            shutil.copytree(segment_dir, os.path.join(out_dir, 'hnsw'))
+            files.extend(os.path.join('hnsw', name) for name in sorted(os.listdir(os.path.join(out_dir, 'hnsw'))))
+            hnsw_included = True
+
+    try:
+        import chromadb
+        chroma_version = chromadb.__version__
+    except Exception:
+        chroma_version = None
+
+    # Stamp the vectors as written: float16 rounding changes the sampled
+    # embeddings, and a collection restored from this bundle holds the rounded ones
+    from chroma_service import catalog_sample_offsets, catalog_stamp
+    written = np.load(os.path.join(out_dir, 'vectors.npy'), mmap_mode='r')
+    stamp = catalog_stamp(service.collection_name, service.num_shards, count,
+                          [(ids[offset], written[offset]) for offset in catalog_sample_offsets(count)])
+    del written
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'format_version': BUNDLE_VERSION,
+        'created_at': time.time(),
+        'collection_name': service.collection_name,
+        'count': count,
+        'dim': EMBEDDING_DIM,
+        'dtype': dtype,
+        'catalog_version': stamp,
+        'hnsw_config': service.get_hnsw_config(),
+        'hnsw_included': hnsw_included,
+        'chromadb_version': chroma_version,
+        'files': {
+            name: {'sha256': _sha256(os.path.join(out_dir, name)),
+                   'bytes': os.path.getsize(os.path.join(out_dir, name))}
+            for name in files
+        }
+    }
+    # Manifest last: a bundle without one is incomplete
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(f"Exported {count} paintings ({dtype}) to {out_dir} in {time.time() - start_time:.1f}s")
+    return manifest
+
+
+def read_manifest(bundle_dir: str, verify: bool = True) -> Dict:
+    """
+    Read and optionally verify a bundle's manifest and checksums.
+
+    Args:
+        bundle_dir: Bundle directory
+        verify: Check every file against its SHA-256
+
+    Returns:
+        The bundle manifest
+
+    Raises:
+        BundleError: If the bundle is incomplete, corrupt or unsupported
+    """
+    try:
+        with open(os.path.join(bundle_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BundleError(f"No readable manifest in {bundle_dir}: {e}")
+
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise BundleError(f"{bundle_dir} is not a catalog bundle")
+    if manifest.get('format_version', 0) > BUNDLE_VERSION:
+        raise BundleError(f"Bundle format version {manifest['format_version']} is newer than supported "
+                          f"({BUNDLE_VERSION})")
+    if manifest.get('dim') != EMBEDDING_DIM:
+        raise BundleError(f"Bundle vectors are {manifest.get('dim')}-dim, expected {EMBEDDING_DIM}")
+
+    for name, info in manifest.get('files', {}).items():
+        path = os.path.join(bundle_dir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != info['bytes']:
+            raise BundleError(f"Bundle file {name} is missing or truncated")
+        if verify and _sha256(path) != info['sha256']:
+            raise BundleError(f"Bundle file {name} failed its checksum")
+    return manifest
+
+
+def load_bundle_arrays(bundle_dir: str, verify: bool = True) -> Tuple[Dict, list, np.ndarray]:
+    """
+    Open a bundle's IDs and vectors.
+
+    float32 vectors stay memory-mapped; float16 vectors are widened to
+    float32 in one bulk conversion.
+
+    Args:
+        bundle_dir: Bundle directory
+        verify: Check file checksums first
+
+    Returns:
+        Tuple of (manifest, painting IDs, vectors)
+    """
+    manifest = read_manifest(bundle_dir, verify=verify)
+    ids = np.load(os.path.join(bundle_dir, 'ids.npy')).tolist()
+    vectors = np.load(os.path.join(bundle_dir, 'vectors.npy'), mmap_mode='r')
+    if vectors.shape != (manifest['count'], manifest['dim']) or len(ids) != manifest['count']:
+        raise BundleError("Bundle arrays don't match the manifest")
+    if vectors.dtype != np.float32:
+        vectors = vectors.astype(np.float32)
+    return manifest, ids, vectors
+
+
+def load_bundle_index(bundle_dir: str, verify: bool = True) -> Tuple[Dict, PaintingIndex]:
+    """
+    Build an in-memory painting index directly from a bundle.
+
+    Args:
+        bundle_dir: Bundle directory
+        verify: Check file checksums first
+
+    Returns:
+        Tuple of (manifest, PaintingIndex)
+    """
+    start_time = time.time()
+    manifest, ids, vectors = load_bundle_arrays(bundle_dir, verify=verify)
+    index = PaintingIndex(ids, vectors)
+    logger.info(f"Loaded index of {len(index)} paintings from bundle in {time.time() - start_time:.2f}s")
+    return manifest, index
+
+
+def import_bundle(service, bundle_dir: str, batch_size: int = 5000, verify: bool = True) -> Dict:
+    """
+    Restore a bundle into a new collection.
+
+    Args:
+        service: ChromaService whose collection does not exist yet
+        bundle_dir: Bundle directory
+        batch_size: Rows inserted per ``collection.add`` call
+        verify: Check file checksums first
+
+    Returns:
+        The bundle manifest
+
+    Raises:
+        BundleError: If the bundle is invalid or the collection can't be created
+    """
+    start_time = time.time()
+    manifest, ids, vectors = load_bundle_arrays(bundle_dir, verify=verify)
+    if service.collection is not None:
+        raise BundleError(f"Collection '{service.collection_name}' already exists")
+
+    build_config = {key: value for key, value in (manifest.get('hnsw_config') or {}).items() if value is not None}
+    if not service.create_collection(build_config):
+        raise BundleError("Failed to create collection")
+
+    with open(os.path.join(bundle_dir, 'metadata.jsonl')) as metadata_file:
+        for start in range(0, len(ids), batch_size):
+            end = min(start + batch_size, len(ids))
+            metadatas = [json.loads(next(metadata_file)) or None for _ in range(start, end)]
+            service.collection.add(ids=ids[start:end], embeddings=np.ascontiguousarray(vectors[start:end]),
+                                   metadatas=metadatas if any(metadatas) else None)
+            logger.info(f"Imported {end}/{len(ids)} paintings")
+
+    service.index = PaintingIndex(ids, vectors)
+    logger.info(f"Imported bundle of {len(ids)} paintings in {time.time() - start_time:.1f}s")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, verify and import catalog bundles")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Write a collection to a bundle')
+    export_parser.add_argument('--chroma-dir', default='./chroma_db', help='ChromaDB data directory')
+    export_parser.add_argument('--collection', default='paintings', help='Collection name')
+    export_parser.add_argument('--out', required=True, help='Bundle directory to create')
+    export_parser.add_argument('--dtype', choices=DTYPES, default='float32', help='Vector precision')
+    export_parser.add_argument('--with-hnsw', action='store_true', help='Also copy the HNSW segment files')
+
+    verify_parser = commands.add_parser('verify', help='Check a bundle against its manifest')
+    verify_parser.add_argument('--bundle', required=True, help='Bundle directory')
+
+    import_parser = commands.add_parser('import', help='Restore a bundle into a new collection')
+    import_parser.add_argument('--bundle', required=True, help='Bundle directory')
+    import_parser.add_argument('--chroma-dir', default='./chroma_db', help='ChromaDB data directory')
+    import_parser.add_argument('--collection', help="Collection name (defaults to the bundle's)")
+    import_parser.add_argument('--batch-size', type=int, default=5000, help='Rows per insert')
+    import_parser.add_argument('--replace', action='store_true', help='Drop an existing collection first')
+    import_parser.add_argument('--skip-verify', action='store_true', help="Don't check checksums")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'verify':
+        manifest = read_manifest(args.bundle, verify=True)
+        print(json.dumps({key: value for key, value in manifest.items() if key != 'files'}, indent=2))
+        return
+
+    # Imported here so verify works without ChromaDB installed
+    from chroma_service import ChromaService
+
+    if args.command == 'export':
+        service = ChromaService(collection_name=args.collection, persist_directory=args.chroma_dir)
+        export_bundle(service, args.out, dtype=args.dtype, include_hnsw=args.with_hnsw)
+        return
+
+    manifest = read_manifest(args.bundle, verify=False)
+    name = args.collection or manifest['collection_name']
+    service = ChromaService(collection_name=name, persist_directory=args.chroma_dir)
+    if service.collection is not None:
+        if not args.replace:
+            raise SystemExit(f"Collection '{name}' already exists; pass --replace to overwrite it")
+        service.client.delete_collection(name)
+        service.collection = None
+    import_bundle(service, args.bundle, batch_size=args.batch_size, verify=not args.skip_verify)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Chaos proxy for exercising the remote ChromaDB access path locally.
+
+Forwards HTTP requests to a Chroma server (e.g. ``chroma run --path
+./chroma_db``) while injecting latency, 503 errors and hung requests, so the
+timeouts, retries, hedging and embedding cache in cloud_client.py can be
+tested without Chroma Cloud.
+
+Usage:
+    chroma run --path ./chroma_db --port 8000
+    python chaos_proxy.py --port 8001 --upstream http://localhost:8000 \\
+        --latency-ms 50 --jitter-ms 200 --error-rate 0.1 --hang-rate 0.02
+    CHROMA_HOST=localhost CHROMA_PORT=8001 CHROMA_HEDGE_MS=150 \\
+        python chroma_recommendation_service.py
+"""
+
+import time
+import random
+import logging
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('chaos_proxy')
+
+# Hop-by-hop headers are not forwarded
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+               'proxy-authorization', 'proxy-authenticate', 'host', 'content-length'}
+
+
+class ChaosProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+    stats = {'requests': 0, 'errors': 0, 'hangs': 0}
+    stats_lock = threading.Lock()
+    _local = threading.local()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _upstream(self) -> http.client.HTTPConnection:
+        # One keep-alive connection to the upstream per handler thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            target = urlsplit(self.config.upstream)
+            connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+            self._local.connection = connection
+        return connection
+
+    def _handle(self):
+        config = self.config
+        self._count('requests')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+
+        delay_ms = config.latency_ms + random.uniform(0, config.jitter_ms)
+        time.sleep(delay_ms / 1000)
+
+        roll = random.random()
+        if roll < config.hang_rate:
+            # Simulate a request that never gets an answer within the client timeout
+            self._count('hangs')
+            time.sleep(config.hang_s)
+        elif roll < config.hang_rate + config.error_rate:
+            self._count('errors')
+            payload = b'{"error":"chaos proxy injected failure"}'
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        headers = {key: value for key, value in self.headers.items() if key.lower() not in HOP_HEADERS}
+        try:
+            connection = self._upstream()
+            connection.request(self.command, self.path, body=body or None, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            self._local.connection = None
+            self.send_error(502, 'Upstream unavailable')
+            return
+
+        self.send_response(response.status)
+        for key, value in response.getheaders():
+            if key.lower() not in HOP_HEADERS:
+                self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = _handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency/failure-injecting proxy for a Chroma server")
+    parser.add_argument('--port', type=int, default=8001, help='Port to listen on')
+    parser.add_argument('--upstream', default='http://localhost:8000', help='Chroma server URL')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Fixed added latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Extra uniform random latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction answered with 503')
+    parser.add_argument('--hang-rate', type=float, default=0, help='Fraction held for --hang-s')
+    parser.add_argument('--hang-s', type=float, default=30, help='How long hung requests are held')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible runs')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    ChaosProxyHandler.config = args
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), ChaosProxyHandler)
+    server.daemon_threads = True
+    logger.info(f"Chaos proxy on :{args.port} -> {args.upstream} (latency {args.latency_ms}+{args.jitter_ms}ms, "
+                f"errors {args.error_rate:.0%}, hangs {args.hang_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Proxy stats: {ChaosProxyHandler.stats}")
+
+
+if __name__ == "__main__":
+    main()
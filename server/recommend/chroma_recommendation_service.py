@@ -7,10 +7,27 @@ Uses vector embeddings to find similar paintings based on user preferences.
 import json
 import sys
 import signal
+import queue
+import threading
 import time
 import logging
 import os
+import tempfile
 from typing import List, Dict, Optional
+
+
+def _preload_chromadb():
+    """Import chromadb in the background while the rest of startup runs."""
+    try:
+        import chromadb  # noqa: F401
+    except Exception:
+        # Surfaced with a proper error when the client is opened
+        pass
+
+
+_chromadb_preload = threading.Thread(target=_preload_chromadb, name='chromadb-preload', daemon=True)
+_chromadb_preload.start()
+
 from dotenv import load_dotenv
 
 # Load environment variables from server/.env
@@ -21,25 +38,139 @@ load_dotenv(env_path)
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from chroma_service import ChromaService
+from wire_protocol import JsonLinesCodec, available_protocols, get_codec
+from user_state import SeenStore
+from prefetch_queue import PrefetchQueues
+from cursor_cache import CursorCache
+from deadline import Deadline, DeadlineExceeded
+from metrics import MetricsRegistry, HealthMonitor
+from tracing import Trace, RequestProfiler
+from warm_cache import WarmCacheStore
+from memory_budget import MemoryBudget
+import catalog_bundle
+from structured_logging import setup_logging, log_context
+import structured_logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rough size of one queued or paged recommendation dict, for memory accounting
+RECOMMENDATION_BYTES = 512
+
+# Cheap actions answered on the reader thread instead of waiting in the work queue
+INLINE_ACTIONS = {'mark_seen', 'stats', 'metrics', 'profile', 'reload', 'ingest', 'set_protocol', 'log_level'}
+
+# Every action the service handles; anything else is labelled "other" in metrics
+ACTIONS = INLINE_ACTIONS | {'recommend', 'diverse', 'next', 'page'}
+
 class ChromaRecommendationService:
     """
     ChromaDB recommendation service that communicates with Node.js via stdin/stdout.
     """
     
-    def __init__(self, chroma_dir: str = "./chroma_db"):
+    def __init__(self, chroma_dir: str = "./chroma_db", max_users: int = 10000,
+                 user_state_path: Optional[str] = None, persist_interval: float = 60.0,
+                 prefetch_depth: int = 20, page_pool_size: int = 100,
+                 cursor_ttl: float = 600.0, num_workers: int = 1,
+                 max_queue_depth: int = 32, profile_dir: str = './profiles',
+                 num_shards: int = 1, shard_by: str = 'hash',
+                 cache_dir: Optional[str] = None, snapshot_interval: float = 300.0,
+                 bundle_dir: Optional[str] = None, memory_budget_mb: float = 0,
+                 spill_dir: Optional[str] = None):
         """
         Initialize the ChromaDB recommendation service.
         
         Args:
             chroma_dir: Directory containing ChromaDB data
+            max_users: Maximum number of per-user seen sets kept in memory
+            user_state_path: Optional file to persist per-user seen sets to
+            persist_interval: Seconds between background saves of user state
+            prefetch_depth: Number of upcoming recommendations queued per user
+            page_pool_size: Number of candidates ranked per paginated
+                recommend/diverse request and kept for paging
+            cursor_ttl: Seconds a page cursor stays valid after its last use
+            num_workers: Number of threads running recommendation requests
+            max_queue_depth: Queued requests beyond which new work is rejected
+            profile_dir: Directory the ``profile`` action writes profiles to
+            num_shards: Number of collections the catalog is partitioned across
+            shard_by: Partitioning strategy in sharded mode ("hash" or "movement")
+            cache_dir: Optional directory for warm-cache snapshots (index,
+                prefetch queues, cursor pools) restored at startup
+            snapshot_interval: Seconds between background cache snapshots
+            bundle_dir: Optional catalog bundle to take the in-memory index
+                from when it matches the collection (see catalog_bundle.py)
+            memory_budget_mb: Memory budget in MiB; near it caches are dropped
+                and the index is quantized, then memory-mapped (0 to only
+                report memory use)
+            spill_dir: Directory for the memory-mapped index file (defaults
+                to cache_dir, then the system temp directory)
         """
         self.chroma_dir = chroma_dir
+        self.num_shards = num_shards
+        self.shard_by = shard_by
+        self.warm_cache = WarmCacheStore(cache_dir) if cache_dir else None
+        self.snapshot_interval = snapshot_interval
+        self.bundle_dir = bundle_dir
+        self.spill_dir = spill_dir or cache_dir or tempfile.gettempdir()
+        # Cheapest index representation the budget has forced so far:
+        # "float32", "float16" or "mmap"; reloaded and ingested-into indexes are converted to it
+        self.index_mode = 'float32'
+        self.restored = {}
         self.chroma_service = None
+        self.seen_store = None
+        self.max_users = max_users
+        self.user_state_path = user_state_path
+        self.persist_interval = persist_interval
+        self.prefetch = PrefetchQueues(
+            self._fill_prefetch_queue,
+            depth=prefetch_depth,
+            low_water=max(1, prefetch_depth // 4),
+            max_users=max_users
+        )
+        self.page_pool_size = page_pool_size
+        self.cursors = CursorCache(ttl_seconds=cursor_ttl)
+        
+        # Bounded work queue with deadline-aware load shedding
+        self.num_workers = num_workers
+        self.max_queue_depth = max_queue_depth
+        self._requests = queue.Queue()
+        self.deadline_drops = 0
+        self.overload_rejections = 0
+        
+        # Metrics and a background-refreshed health check for cheap stats
+        self.metrics = MetricsRegistry(actions=ACTIONS)
+        self.health = HealthMonitor(self._check_health)
+        self._register_metrics()
+        self.profiler = RequestProfiler(output_dir=profile_dir)
+        self.memory = MemoryBudget(
+            int(memory_budget_mb * 2**20),
+            self._memory_usage,
+            [('caches', self._release_caches),
+             ('quantize', self._quantize_index),
+             ('mmap', self._spill_index)]
+        )
+        self.startup_phases = {}
+        self.startup_time_ms = None
+        self._process_start = time.time()
+        self._write_lock = threading.Lock()
+        self._ready_sent = False
+        
+        # Start in JSON lines; the client may negotiate msgpack after "ready"
+        self.codec = JsonLinesCodec()
+        self._protocol_negotiated = False
+        self._input = sys.stdin.buffer
+        self._output = sys.stdout.buffer
+        
+        # Double buffering: requests read the active service while a reload
+        # builds its replacement; the swap is a single reference assignment.
+        self.generation = 0
+        self._reload_lock = threading.RLock()
+        self._reload_thread = None
+        self._last_reload = None
+        self._ingest_thread = None
+        self._last_ingest = None
+        
         self._initialize_service()
     
     def _initialize_service(self) -> bool:
@@ -49,23 +180,215 @@ class ChromaRecommendationService:
         Returns:
             bool: True if initialization successful
         """
+        chroma_service = self._build_service(self.chroma_dir, phases=self.startup_phases)
+        self.startup_time_ms = round((time.time() - self._process_start) * 1000, 2)
+        
+        if chroma_service is None:
+            return False
+        
+        self.chroma_service = chroma_service
+        self.seen_store = SeenStore(
+            chroma_service.index,
+            max_users=self.max_users,
+            persist_path=self.user_state_path
+        )
+        if self.user_state_path:
+            threading.Thread(target=self._persist_loop, name='user-state-persist', daemon=True).start()
+        
+        if self.warm_cache is not None:
+            self._restore_caches(chroma_service.catalog_stamp)
+            threading.Thread(target=self._snapshot_loop, name='warm-cache-snapshot', daemon=True).start()
+        
+        if self.memory.limit_bytes:
+            self.memory.check()
+            self.memory.start()
+        return True
+    
+    def _restore_caches(self, version: Optional[str]):
+        """
+        Reload prefetch queues and cursor pools saved from the same catalog version.
+        
+        Args:
+            version: Catalog version stamp of the active service
+        """
+        if not version:
+            return
+        prefetch = self.warm_cache.load_state('prefetch', version)
+        if prefetch:
+            self.restored['prefetch_users'] = self.prefetch.restore(prefetch)
+        cursors = self.warm_cache.load_state('cursors', version)
+        if cursors:
+            self.restored['cursors'] = self.cursors.restore(cursors)
+        if self.restored:
+            logger.info(f"Restored warm caches: {self.restored}")
+    
+    def _memory_usage(self) -> Dict:
+        """
+        Estimate memory held per component, for the memory budget.
+        
+        Returns:
+            Dictionary of component name to bytes
+        """
+        chroma_service = self.chroma_service
+        usage = chroma_service.get_memory_usage() if chroma_service else {}
+        usage['user_state'] = self.seen_store.get_stats()['bitmap_bytes'] if self.seen_store else 0
+        usage['prefetch'] = self.prefetch.get_stats()['queued_recommendations'] * RECOMMENDATION_BYTES
+        usage['cursors'] = self.cursors.get_stats()['items'] * RECOMMENDATION_BYTES
+        return usage
+    
+    def _release_caches(self) -> bool:
+        """
+        Drop the embedding cache, prefetch queues and cursor pools.
+        
+        Returns:
+            bool: True if any of them held entries
+        """
+        released = False
+        chroma_service = self.chroma_service
+        if chroma_service is not None and chroma_service.embedding_cache.clear():
+            released = True
+        if self.prefetch.get_stats()['users']:
+            self.prefetch.invalidate()
+            released = True
+        if self.cursors.get_stats()['cursors']:
+            self.cursors.clear()
+            released = True
+        return released
+    
+    def _publish_index(self, chroma_service: ChromaService, index):
+        # Same ids as before, so the seen store only swaps its reference
+        chroma_service.index = index
+        if self.seen_store is not None and chroma_service is self.chroma_service:
+            self.seen_store.remap(index)
+    
+    def _convert_index(self, chroma_service: ChromaService, mode: str) -> bool:
+        """
+        Switch a service's in-memory index to a cheaper representation.
+        
+        Args:
+            chroma_service: Service whose index to convert
+            mode: "float16" to quantize, "mmap" to memory-map from spill_dir
+            
+        Returns:
+            bool: True if the index was converted
+        """
+        # Under the writer lock so a concurrent ingest isn't overwritten
+        with chroma_service.write_lock:
+            index = chroma_service.index
+            # A mapped index is already off the heap; quantizing would load it back in
+            if index is None or index.mapped or (mode == 'float16' and str(index.vectors.dtype) == 'float16'):
+                return False
+            
+            start_time = time.time()
+            if mode == 'float16':
+                converted = index.quantized()
+            else:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                converted = index.spilled(os.path.join(self.spill_dir, f'index_vectors_{os.getpid()}.npy'))
+            self._publish_index(chroma_service, converted)
+        logger.info(f"Converted in-memory index to {mode} in {time.time() - start_time:.2f}s")
+        return True
+    
+    @staticmethod
+    def _live_index_mode(chroma_service: ChromaService) -> Optional[str]:
+        # What the index actually holds, which lags index_mode while an ingest runs
+        index = chroma_service.index
+        if index is None:
+            return None
+        return 'mmap' if index.mapped else str(index.vectors.dtype)
+    
+    def _quantize_index(self) -> bool:
+        chroma_service = self.chroma_service
+        if chroma_service is None or not self._convert_index(chroma_service, 'float16'):
+            return False
+        self.index_mode = 'float16'
+        return True
+    
+    def _spill_index(self) -> bool:
+        chroma_service = self.chroma_service
+        if chroma_service is None or not self._convert_index(chroma_service, 'mmap'):
+            return False
+        self.index_mode = 'mmap'
+        return True
+    
+    def snapshot_caches(self) -> bool:
+        """
+        Write prefetch queues and cursor pools to the warm-cache directory.
+        
+        Returns:
+            bool: True if saved (or caching is disabled), False on error
+        """
+        chroma_service = self.chroma_service
+        if self.warm_cache is None or chroma_service is None or not chroma_service.catalog_stamp:
+            return True
+        version = chroma_service.catalog_stamp
+        return (self.warm_cache.save_state('prefetch', self.prefetch.export(), version) and
+                self.warm_cache.save_state('cursors', self.cursors.export(), version))
+    
+    def _snapshot_loop(self):
+        """
+        Periodically snapshot warm caches to disk.
+        """
+        while True:
+            time.sleep(self.snapshot_interval)
+            self.snapshot_caches()
+    
+    def _persist_loop(self):
+        """
+        Periodically save per-user state to disk.
+        """
+        while True:
+            time.sleep(self.persist_interval)
+            self.seen_store.save()
+    
+    def shutdown(self):
+        """
+        Flush state that should survive a restart.
+        """
+        if self.seen_store is not None:
+            self.seen_store.save()
+        self.snapshot_caches()
+    
+    def _build_service(self, chroma_dir: str, fresh_client: bool = False,
+                       phases: Optional[Dict] = None) -> Optional[ChromaService]:
+        """
+        Open a ChromaDB service, load its in-memory index and verify it's ready.
+        
+        Args:
+            chroma_dir: Directory containing ChromaDB data
+            fresh_client: Reopen the persisted data instead of reusing a cached client
+            phases: Optional dictionary filled with per-phase durations in ms
+                ("import", "client_open", "catalog_version", "index_load", "warm_up")
+            
+        Returns:
+            Ready ChromaService or None if initialization failed
+        """
+        if phases is None:
+            phases = {}
+        
+        def mark(phase: str, phase_start: float) -> float:
+            now = time.time()
+            phases[phase] = round((now - phase_start) * 1000, 2)
+            return now
+        
         try:
             start_time = time.time()
             
-            # Initialize ChromaDB service
-            self.chroma_service = ChromaService(persist_directory=self.chroma_dir)
+            # Wait for the background import started at module load
+            _chromadb_preload.join()
+            import chromadb  # noqa: F401
+            phase_start = mark('import', start_time)
             
-            # Health check
-            if not self.chroma_service.health_check():
-                logger.error("ChromaDB health check failed")
-                return False
+            # Initialize ChromaDB service (opens the client and collection)
+            chroma_service = ChromaService(persist_directory=chroma_dir, fresh_client=fresh_client,
+                                           num_shards=self.num_shards, shard_by=self.shard_by)
             
-            # Get collection stats
-            stats = self.chroma_service.get_collection_stats()
+            # Get collection stats (fails if the client or collection didn't open)
+            stats = chroma_service.get_collection_stats()
             
             if 'error' in stats:
                 logger.error(f"ChromaDB collection error: {stats['error']}")
-                return False
+                return None
             
             total_paintings = stats.get('total_paintings', 0)
             
@@ -73,19 +396,448 @@ class ChromaRecommendationService:
                 logger.warning("ChromaDB collection is empty - migration may be needed")
             else:
                 logger.info(f"ChromaDB ready with {total_paintings} paintings")
+            phase_start = mark('client_open', phase_start)
+            
+            # Load embeddings into memory, from a catalog bundle or the warm-cache
+            # snapshot when the catalog hasn't changed since it was written
+            if self.warm_cache is not None or self.bundle_dir:
+                chroma_service.catalog_stamp = chroma_service.catalog_version()
+                phase_start = mark('catalog_version', phase_start)
+            
+            if self.bundle_dir and chroma_service.catalog_stamp:
+                chroma_service.index = self._load_bundle_index(chroma_service.catalog_stamp)
+            
+            if chroma_service.index is None and self.warm_cache is not None and chroma_service.catalog_stamp:
+                chroma_service.index = self.warm_cache.load_index(chroma_service.catalog_stamp)
+            
+            if chroma_service.index is None:
+                if not chroma_service.load_index():
+                    logger.error("Failed to load in-memory painting index")
+                    return None
+                if self.warm_cache is not None and chroma_service.catalog_stamp:
+                    threading.Thread(
+                        target=self.warm_cache.save_index,
+                        args=(chroma_service.index, chroma_service.catalog_stamp),
+                        name='warm-cache-index',
+                        daemon=True
+                    ).start()
+            phase_start = mark('index_load', phase_start)
+            
+            # Prime the vector index so the first user doesn't pay for loading it
+            if total_paintings > 0 and not chroma_service.warm_up():
+                logger.warning("ChromaDB warm-up query failed, first request may be slow")
+            mark('warm_up', phase_start)
             
             load_time = time.time() - start_time
-            logger.info(f"ChromaDB service initialized in {load_time:.2f}s")
+            logger.info(f"ChromaDB service initialized in {load_time:.2f}s (phases ms: {phases})")
             
-            return True
+            return chroma_service
             
         except Exception as e:
             logger.error(f"Failed to initialize ChromaDB service: {e}")
-            return False
+            return None
+    
+    def _load_bundle_index(self, catalog_stamp: str):
+        """
+        Take the in-memory index from the configured bundle if it matches the catalog.
+        
+        Args:
+            catalog_stamp: Version stamp of the open collection
+            
+        Returns:
+            PaintingIndex, or None if the bundle is missing, invalid or stale
+        """
+        try:
+            # Checksums were verified at export/import; a size check is enough here
+            manifest = catalog_bundle.read_manifest(self.bundle_dir, verify=False)
+            if manifest.get('catalog_version') != catalog_stamp:
+                logger.warning(f"Catalog bundle {self.bundle_dir} has version {manifest.get('catalog_version')}, "
+                               f"collection has {catalog_stamp}; loading the index from ChromaDB instead")
+                return None
+            _, index = catalog_bundle.load_bundle_index(self.bundle_dir, verify=False)
+            return index
+        except Exception as e:
+            logger.warning(f"Failed to load index from bundle {self.bundle_dir}: {e}")
+            return None
+    
+    def reload_index(self, chroma_dir: Optional[str] = None) -> Dict:
+        """
+        Rebuild the ChromaDB service and in-memory index in the background.
+        
+        The new service is swapped in only once it is fully loaded; requests
+        already running keep using the service they started with. Refused
+        while an ingest is running, since batches it adds after the new
+        service loaded would land in the one being replaced.
+        
+        Args:
+            chroma_dir: Directory to load from (defaults to the current one)
+            
+        Returns:
+            Dictionary with reload status
+        """
+        with self._reload_lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return {
+                    'status': 'in_progress',
+                    'generation': self.generation
+                }
+            if self._ingest_thread is not None and self._ingest_thread.is_alive():
+                return {
+                    'error': 'Ingest in progress, reload after it finishes',
+                    'status': 'ingesting',
+                    'generation': self.generation,
+                    'last_ingest': self._last_ingest
+                }
+            
+            self._reload_thread = threading.Thread(
+                target=self._reload_worker,
+                args=(chroma_dir or self.chroma_dir,),
+                name='chroma-reload',
+                daemon=True
+            )
+            self._reload_thread.start()
+        
+        return {
+            'status': 'reloading',
+            'generation': self.generation,
+            'chroma_directory': chroma_dir or self.chroma_dir
+        }
+    
+    def _reload_worker(self, chroma_dir: str):
+        """
+        Build a replacement service and publish it if it loads successfully.
+        
+        Args:
+            chroma_dir: Directory to load from
+        """
+        start_time = time.time()
+        logger.info(f"Reloading ChromaDB index from {chroma_dir}...")
+        
+        chroma_service = self._build_service(chroma_dir, fresh_client=True)
+        reload_time = time.time() - start_time
+        
+        if chroma_service is None:
+            logger.error(f"ChromaDB reload failed after {reload_time:.2f}s, keeping generation {self.generation}")
+            self._last_reload = {
+                'status': 'failed',
+                'duration_ms': round(reload_time * 1000, 2),
+                'finished_at': time.time()
+            }
+            return
+        
+        # Keep the cheaper index representation the memory budget forced
+        if self.index_mode != 'float32':
+            self._convert_index(chroma_service, 'float16')
+        if self.index_mode == 'mmap':
+            self._convert_index(chroma_service, 'mmap')
+        
+        # Re-key user state onto the new rows, then swap atomically; the old
+        # service is released once in-flight requests finish
+        if self.seen_store is not None:
+            self.seen_store.remap(chroma_service.index)
+        else:
+            self.seen_store = SeenStore(
+                chroma_service.index,
+                max_users=self.max_users,
+                persist_path=self.user_state_path
+            )
+        self.chroma_service = chroma_service
+        self.chroma_dir = chroma_dir
+        self.generation += 1
+        
+        # Queued and paged recommendations came from the old catalog
+        self.prefetch.invalidate()
+        self.cursors.clear()
+        
+        # A service that failed to start becomes ready once a reload succeeds
+        if not self._ready_sent:
+            self._send_ready()
+        
+        self._last_reload = {
+            'status': 'succeeded',
+            'duration_ms': round(reload_time * 1000, 2),
+            'finished_at': time.time()
+        }
+        logger.info(f"ChromaDB index reloaded in {reload_time:.2f}s (generation {self.generation})")
+    
+    def ingest(self, path: str, batch_size: int = 500) -> Dict:
+        """
+        Add paintings from an embeddings file in the background.
+        
+        Queries keep running against the current catalog snapshot; each
+        batch is published as it is added (see ChromaService.add_paintings).
+        Refused while a reload is running, which would replace the service
+        the batches are added to.
+        
+        Args:
+            path: JSON list of paintings with embeddings, as written by
+                generate_embeddings.py
+            batch_size: Paintings added and published per batch
+            
+        Returns:
+            Dictionary with ingest status
+        """
+        if not self.chroma_service:
+            return {'error': 'Service not initialized'}
+        if not path or not os.path.exists(path):
+            return {'error': f'Embeddings file not found: {path}'}
+        
+        with self._reload_lock:
+            if self._ingest_thread is not None and self._ingest_thread.is_alive():
+                return {'status': 'in_progress', 'last_ingest': self._last_ingest}
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return {
+                    'error': 'Reload in progress, ingest after it finishes',
+                    'status': 'reloading',
+                    'generation': self.generation
+                }
+            
+            self._ingest_thread = threading.Thread(
+                target=self._ingest_worker,
+                args=(path, max(1, int(batch_size))),
+                name='chroma-ingest',
+                daemon=True
+            )
+            self._ingest_thread.start()
+        
+        return {'status': 'ingesting', 'path': path}
+    
+    def _ingest_worker(self, path: str, batch_size: int):
+        """
+        Add an embeddings file batch by batch to the active service.
+        
+        Args:
+            path: Embeddings file
+            batch_size: Paintings per batch
+        """
+        start_time = time.time()
+        chroma_service = self.chroma_service
+        added = failed = 0
+        self._last_ingest = {'status': 'running', 'path': path, 'added': 0, 'started_at': start_time}
+        try:
+            with open(path) as f:
+                paintings = json.load(f)
+            
+            for offset in range(0, len(paintings), batch_size):
+                batch = paintings[offset:offset + batch_size]
+                if chroma_service.add_paintings(batch):
+                    added += len(batch)
+                else:
+                    failed += len(batch)
+                # Appended rows only extend the seen bitmaps, so this is cheap
+                if self.seen_store is not None and chroma_service is self.chroma_service:
+                    self.seen_store.remap(chroma_service.index)
+                self._last_ingest['added'] = added
+            status = 'succeeded' if not failed else 'partial'
+        except Exception as e:
+            logger.error(f"Ingest from {path} failed: {e}")
+            status = 'failed'
+        
+        # Appending copies a memory-mapped index back onto the heap; map it again
+        if self.index_mode == 'mmap' and chroma_service is self.chroma_service:
+            self._convert_index(chroma_service, 'mmap')
+        
+        duration = time.time() - start_time
+        self._last_ingest = {
+            'status': status,
+            'path': path,
+            'added': added,
+            'failed': failed,
+            'duration_ms': round(duration * 1000, 2),
+            'finished_at': time.time()
+        }
+        logger.info(f"Ingested {added} paintings from {path} in {duration:.2f}s ({failed} failed)")
+    
+    def _resolve_exclusions(self, user_id: Optional[str], exclude_ids: Optional[List[str]]):
+        """
+        Work out which paintings to exclude for a request.
+        
+        With a user ID the user's session seen set is used; an explicit
+        exclude list is merged into it first, which is how Node seeds a
+        session after a miss.
+        
+        Args:
+            user_id: ID of the user, or None for a stateless request
+            exclude_ids: List of painting IDs to exclude, or None
+            
+        Returns:
+            Tuple of (exclusions, error response or None)
+        """
+        if not user_id or self.seen_store is None:
+            return exclude_ids, None
+        
+        if exclude_ids is not None:
+            self.seen_store.mark_seen(user_id, exclude_ids)
+        
+        seen = self.seen_store.get_seen(user_id)
+        if seen is None:
+            return None, {
+                'error': 'Unknown user session',
+                'recommendations': [],
+                'source': 'session_miss'
+            }
+        return seen, None
+    
+    def mark_seen(self, user_id: str, painting_ids: List[str]) -> Dict:
+        """
+        Record paintings a user has viewed in their session seen set.
+        
+        Users without a session (new, evicted or lost in a restart) are not
+        created here: a session holding only these paintings would hide the
+        miss that makes Node seed it with the full viewed history.
+        
+        Args:
+            user_id: ID of the user
+            painting_ids: IDs of the viewed paintings
+            
+        Returns:
+            Dictionary with the user's seen count, or a session miss
+        """
+        if self.seen_store is None:
+            return {'error': 'ChromaDB service not initialized', 'source': 'error'}
+        
+        if not user_id:
+            return {'error': 'No user_id provided', 'source': 'error'}
+        
+        seen_count = self.seen_store.mark_seen(user_id, painting_ids or [], create=False)
+        if seen_count is None:
+            return {
+                'user_id': user_id,
+                'source': 'session_miss'
+            }
+        return {
+            'user_id': user_id,
+            'seen_count': seen_count
+        }
+    
+    def _fill_prefetch_queue(self, liked_painting_ids: List[str], exclude_ids, k: int) -> List[Dict]:
+        """
+        Compute recommendations for a prefetch queue on the active service.
+        
+        Args:
+            liked_painting_ids: List of painting IDs the user has liked
+            exclude_ids: Painting IDs to exclude
+            k: Number of recommendations to compute
+            
+        Returns:
+            List of recommended paintings with similarity scores
+        """
+        chroma_service = self.chroma_service
+        if not chroma_service:
+            return []
+        
+        return chroma_service.get_recommendations_for_user(
+            liked_painting_ids=liked_painting_ids,
+            exclude_ids=exclude_ids,
+            k=k,
+            aggregation_method="centroid"
+        )
+    
+    def _format_recommendations(self, recommendations: List[Dict],
+                                trace: Optional[Trace] = None) -> List[Dict]:
+        """
+        Format recommendations for Node.js compatibility.
+        
+        Args:
+            recommendations: Recommendations from ChromaService
+            trace: Optional request trace for stage timings
+            
+        Returns:
+            List of recommendation dictionaries
+        """
+        trace = trace or Trace()
+        with trace.stage('format'):
+            formatted_recommendations = []
+            for rec in recommendations:
+                formatted_rec = {
+                    '_id': rec['_id'],
+                    'mongodb_id': rec.get('mongodb_id', rec['_id']),
+                    'similarity_score': rec['similarity_score'],
+                    'distance': rec.get('distance', 1.0 - rec['similarity_score'])
+                }
+                formatted_recommendations.append(formatted_rec)
+            return formatted_recommendations
+    
+    def get_next_recommendations(self, liked_painting_ids: List[str], user_id: Optional[str],
+                                 exclude_ids: Optional[List[str]] = None,
+                                 count: int = 1, queue_only: bool = False) -> Optional[Dict]:
+        """
+        Pop the next recommendations from the user's prefetched queue.
+        
+        Returned paintings are marked as seen so they aren't queued again.
+        
+        Args:
+            liked_painting_ids: List of painting IDs the user has liked
+            user_id: ID of the user
+            exclude_ids: Optional painting IDs to seed the user's session with
+            count: Number of recommendations to return
+            queue_only: Only serve what is already queued, without blocking;
+                returns None if the queue can't serve the request
+            
+        Returns:
+            Dictionary with recommendations and metadata
+        """
+        try:
+            start_time = time.time()
+            
+            if not self.chroma_service:
+                return {
+                    'error': 'ChromaDB service not initialized',
+                    'recommendations': [],
+                    'source': 'error'
+                }
+            
+            if not user_id:
+                return {
+                    'error': 'No user_id provided',
+                    'recommendations': [],
+                    'source': 'error'
+                }
+            
+            if not liked_painting_ids:
+                return {
+                    'error': 'No liked paintings provided',
+                    'recommendations': [],
+                    'source': 'error'
+                }
+            
+            seen, error_response = self._resolve_exclusions(user_id, exclude_ids)
+            if error_response:
+                return error_response
+            
+            if queue_only:
+                recommendations = self.prefetch.try_pop(user_id, liked_painting_ids, seen, count)
+                if recommendations is None:
+                    return None
+                queue_hit = True
+            else:
+                recommendations, queue_hit = self.prefetch.pop(user_id, liked_painting_ids, seen, count)
+            self.seen_store.mark_seen(user_id, [rec['_id'] for rec in recommendations], create=False)
+            
+            inference_time = time.time() - start_time
+            
+            return {
+                'recommendations': self._format_recommendations(recommendations),
+                'source': 'chromadb_prefetch',
+                'queue_hit': queue_hit,
+                'processing_time_ms': round(inference_time * 1000, 2),
+                'user_liked_count': len(liked_painting_ids),
+                'aggregation_method': 'centroid'
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting next recommendations: {e}")
+            return {
+                'error': str(e),
+                'recommendations': [],
+                'source': 'error'
+            }
     
     def get_recommendations(self, liked_painting_ids: List[str], 
                           exclude_ids: Optional[List[str]] = None,
-                          count: int = 10) -> Dict:
+                          count: int = 10, user_id: Optional[str] = None,
+                          deadline: Optional[Deadline] = None,
+                          trace: Optional[Trace] = None, paginate: bool = False) -> Dict:
         """
         Get recommendations based on liked paintings.
         
@@ -93,14 +845,25 @@ class ChromaRecommendationService:
             liked_painting_ids: List of painting IDs the user has liked
             exclude_ids: List of painting IDs to exclude (viewed paintings)
             count: Number of recommendations to return
+            user_id: Optional user ID whose session seen set is excluded
+            deadline: Optional request deadline, checked between stages
+            trace: Optional request trace for stage timings and counts
+            paginate: Rank a pool of ``page_pool_size`` candidates and return
+                a cursor for the pages after the first
             
         Returns:
             Dictionary with recommendations and metadata
+            
+        Raises:
+            DeadlineExceeded: If the deadline passes between stages
         """
         try:
             start_time = time.time()
             
-            if not self.chroma_service:
+            # Pin the active service so a concurrent reload can't swap it mid-request
+            chroma_service = self.chroma_service
+            
+            if not chroma_service:
                 return {
                     'error': 'ChromaDB service not initialized',
                     'recommendations': [],
@@ -114,29 +877,35 @@ class ChromaRecommendationService:
                     'source': 'error'
                 }
             
-            # Get recommendations using ChromaDB
-            recommendations = self.chroma_service.get_recommendations_for_user(
+            exclude_ids, error_response = self._resolve_exclusions(user_id, exclude_ids)
+            if error_response:
+                return error_response
+            
+            # When paging, rank a pool once; pages after the first are served from the cursor cache
+            recommendations = chroma_service.get_recommendations_for_user(
                 liked_painting_ids=liked_painting_ids,
                 exclude_ids=exclude_ids,
-                k=count,
-                aggregation_method="centroid"
+                k=max(count, self.page_pool_size) if paginate else count,
+                aggregation_method="centroid",
+                deadline=deadline,
+                trace=trace
             )
             
             # Format recommendations for Node.js compatibility
-            formatted_recommendations = []
-            for rec in recommendations:
-                formatted_rec = {
-                    '_id': rec['_id'],
-                    'mongodb_id': rec.get('mongodb_id', rec['_id']),
-                    'similarity_score': rec['similarity_score'],
-                    'distance': rec.get('distance', 1.0 - rec['similarity_score'])
-                }
-                formatted_recommendations.append(formatted_rec)
+            formatted_recommendations = self._format_recommendations(recommendations[:count], trace)
+            cursor = None
+            if paginate:
+                cursor = self.cursors.create(
+                    self._format_recommendations(recommendations[count:], trace),
+                    {'source': 'chromadb', 'aggregation_method': 'centroid'},
+                    owner=user_id
+                )
             
             inference_time = time.time() - start_time
             
             result = {
                 'recommendations': formatted_recommendations,
+                'cursor': cursor,
                 'source': 'chromadb',
                 'processing_time_ms': round(inference_time * 1000, 2),
                 'user_liked_count': len(liked_painting_ids),
@@ -147,6 +916,8 @@ class ChromaRecommendationService:
             logger.info(f"Generated {len(formatted_recommendations)} recommendations in {inference_time:.3f}s")
             return result
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error generating recommendations: {e}")
             return {
@@ -157,7 +928,9 @@ class ChromaRecommendationService:
     
     def get_diverse_recommendations(self, liked_painting_ids: List[str],
                                   exclude_ids: Optional[List[str]] = None,
-                                  count: int = 10) -> Dict:
+                                  count: int = 10, user_id: Optional[str] = None,
+                                  deadline: Optional[Deadline] = None,
+                                  trace: Optional[Trace] = None, paginate: bool = False) -> Dict:
         """
         Get diverse recommendations for users with varied tastes.
         
@@ -165,41 +938,70 @@ class ChromaRecommendationService:
             liked_painting_ids: List of painting IDs the user has liked
             exclude_ids: List of painting IDs to exclude
             count: Number of recommendations to return
+            user_id: Optional user ID whose session seen set is excluded
+            deadline: Optional request deadline, checked between stages
+            trace: Optional request trace for stage timings and counts
+            paginate: Rank a pool of ``page_pool_size`` candidates and return
+                a cursor for the pages after the first
             
         Returns:
             Dictionary with diverse recommendations and metadata
+            
+        Raises:
+            DeadlineExceeded: If the deadline passes between stages
         """
         try:
             start_time = time.time()
             
-            if not self.chroma_service:
+            # Pin the active service so a concurrent reload can't swap it mid-request
+            chroma_service = self.chroma_service
+            
+            if not chroma_service:
                 return {
                     'error': 'ChromaDB service not initialized',
                     'recommendations': [],
                     'source': 'error'
                 }
             
-            # Get diverse recommendations
-            recommendations = self.chroma_service.get_diverse_recommendations(
+            exclude_ids, error_response = self._resolve_exclusions(user_id, exclude_ids)
+            if error_response:
+                return error_response
+            
+            # Get diverse recommendations, ranking a pool for later pages when paging
+            recommendations = chroma_service.get_diverse_recommendations(
                 liked_painting_ids=liked_painting_ids,
                 exclude_ids=exclude_ids,
-                k=count
+                k=max(count, self.page_pool_size) if paginate else count,
+                deadline=deadline,
+                trace=trace
             )
             
             # Format recommendations
-            formatted_recommendations = []
-            for rec in recommendations:
-                formatted_rec = {
-                    '_id': rec['_id'],
-                    'mongodb_id': rec.get('mongodb_id', rec['_id']),
-                    'similarity_score': rec['similarity_score']
-                }
-                formatted_recommendations.append(formatted_rec)
+            trace = trace or Trace()
+            with trace.stage('format'):
+                formatted_recommendations = []
+                for rec in recommendations:
+                    formatted_rec = {
+                        '_id': rec['_id'],
+                        'mongodb_id': rec.get('mongodb_id', rec['_id']),
+                        'similarity_score': rec['similarity_score']
+                    }
+                    formatted_recommendations.append(formatted_rec)
+            
+            cursor = None
+            if paginate:
+                cursor = self.cursors.create(
+                    formatted_recommendations[count:],
+                    {'source': 'chromadb_diverse', 'aggregation_method': 'diverse'},
+                    owner=user_id
+                )
+            formatted_recommendations = formatted_recommendations[:count]
             
             inference_time = time.time() - start_time
             
             result = {
                 'recommendations': formatted_recommendations,
+                'cursor': cursor,
                 'source': 'chromadb_diverse',
                 'processing_time_ms': round(inference_time * 1000, 2),
                 'user_liked_count': len(liked_painting_ids),
@@ -209,6 +1011,8 @@ class ChromaRecommendationService:
             logger.info(f"Generated {len(formatted_recommendations)} diverse recommendations in {inference_time:.3f}s")
             return result
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error generating diverse recommendations: {e}")
             return {
@@ -217,26 +1021,204 @@ class ChromaRecommendationService:
                 'source': 'error'
             }
     
+    def get_page(self, cursor: str, count: int = 10, user_id: Optional[str] = None) -> Dict:
+        """
+        Continue a recommend or diverse result from its cursor.
+        
+        Args:
+            cursor: Cursor returned by a previous recommend/diverse/page response
+            count: Number of recommendations to return
+            user_id: Optional user ID; must match the user the cursor was
+                created for, and paintings seen since are skipped
+            
+        Returns:
+            Dictionary with the next page and the cursor to continue from
+            (None when exhausted)
+        """
+        try:
+            start_time = time.time()
+            
+            if not cursor:
+                return {
+                    'error': 'No cursor provided',
+                    'recommendations': [],
+                    'source': 'error'
+                }
+            
+            seen = None
+            if user_id and self.seen_store is not None:
+                seen = self.seen_store.get_seen(user_id)
+            
+            page, metadata, has_more = self.cursors.next_page(cursor, count, seen, user_id=user_id)
+            if page is None:
+                return {
+                    'error': 'Cursor expired or unknown',
+                    'recommendations': [],
+                    'source': 'cursor_expired'
+                }
+            
+            inference_time = time.time() - start_time
+            
+            result = {
+                'recommendations': page,
+                'cursor': cursor if has_more else None,
+                'processing_time_ms': round(inference_time * 1000, 2)
+            }
+            result.update(metadata)
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error getting recommendation page: {e}")
+            return {
+                'error': str(e),
+                'recommendations': [],
+                'source': 'error'
+            }
+    
+    def set_log_level(self, level: Optional[str] = None, sample_rate: Optional[float] = None) -> Dict:
+        """
+        Change the log level and request log sample rate without a restart.
+        
+        Args:
+            level: New level name (DEBUG, INFO, WARNING, ERROR), or None to keep it
+            sample_rate: Fraction of requests whose info logs are kept, or None to keep it
+            
+        Returns:
+            Current logging settings, or an error response
+        """
+        try:
+            settings = structured_logging.configure(level, sample_rate)
+        except (TypeError, ValueError) as e:
+            return {'error': str(e), 'recommendations': [], 'source': 'error'}
+        logger.warning(f"Logging changed: level={settings['level']} sample_rate={settings['sample_rate']}")
+        return {'logging': settings}
+    
+    def control_profiler(self, command: str, top_n: Optional[int] = None) -> Dict:
+        """
+        Switch the request profiler on or off, or write out its profiles.
+        
+        Args:
+            command: "start", "stop", "dump" (write the slowest requests to
+                disk) or "status"
+            top_n: Number of slowest requests to keep (for "start")
+            
+        Returns:
+            Dictionary with profiler state, plus the written files for "dump"
+        """
+        try:
+            if command == 'start':
+                self.profiler.start(top_n)
+            elif command == 'stop':
+                self.profiler.stop()
+            elif command == 'dump':
+                return {'profiles': self.profiler.dump(), **self.profiler.get_stats()}
+            elif command != 'status':
+                return {'error': f'Unknown profile command: {command}'}
+            return self.profiler.get_stats()
+        
+        except Exception as e:
+            logger.error(f"Profiler command {command} failed: {e}")
+            return {'error': str(e)}
+    
+    def _check_health(self) -> Dict:
+        """
+        Run the (relatively expensive) ChromaDB health check and collection stats.
+        
+        Returns:
+            Dictionary with health status and collection stats
+        """
+        chroma_service = self.chroma_service
+        if not chroma_service:
+            return {'healthy': False, 'error': 'Service not initialized'}
+        
+        return {
+            'healthy': chroma_service.health_check(),
+            'chroma_stats': chroma_service.get_collection_stats()
+        }
+    
+    def _register_metrics(self):
+        """
+        Expose drop and rejection counts as counters, and queue depth,
+        cache hit rates and state sizes as gauges.
+        """
+        def hit_rate(stats: Dict) -> Optional[float]:
+            total = stats['hits'] + stats['misses']
+            return round(stats['hits'] / total, 4) if total else None
+        
+        self.metrics.register_counter('deadline_drops', lambda: self.deadline_drops)
+        self.metrics.register_counter('overload_rejections', lambda: self.overload_rejections)
+        self.metrics.register_counter('memory_pressure_events', lambda: self.memory.pressure_events)
+        self.metrics.register_gauge('queue_depth', self._requests.qsize)
+        self.metrics.register_gauge('prefetch_hit_rate', lambda: hit_rate(self.prefetch.get_stats()))
+        self.metrics.register_gauge('cursor_hit_rate', lambda: hit_rate(self.cursors.get_stats()))
+        self.metrics.register_gauge(
+            'session_users', lambda: self.seen_store.get_stats()['users'] if self.seen_store else 0
+        )
+        self.metrics.register_gauge(
+            'index_paintings',
+            lambda: len(self.chroma_service.index) if self.chroma_service and self.chroma_service.index else 0
+        )
+    
+    def get_metrics(self, output_format: str = 'prometheus') -> Dict:
+        """
+        Export metrics.
+        
+        Args:
+            output_format: "prometheus" for exposition text, "json" for a snapshot
+            
+        Returns:
+            Dictionary with the metrics
+        """
+        if output_format == 'json':
+            return self.metrics.snapshot()
+        return {
+            'format': 'prometheus',
+            'text': self.metrics.to_prometheus()
+        }
+    
     def get_service_stats(self) -> Dict:
         """
         Get service statistics and health information.
         
+        Cheap to call: health and collection stats come from the cached
+        background check instead of querying ChromaDB.
+        
         Returns:
             Dictionary with service stats
         """
         try:
-            if not self.chroma_service:
+            chroma_service = self.chroma_service
+            if not chroma_service:
                 return {'error': 'Service not initialized'}
             
-            # Get ChromaDB stats
-            chroma_stats = self.chroma_service.get_collection_stats()
+            health = self.health.get_status()
             
             # Add service-level stats
             stats = {
                 'service': 'chromadb_recommendation',
-                'status': 'healthy' if self.chroma_service.health_check() else 'unhealthy',
-                'chroma_stats': chroma_stats,
-                'chroma_directory': self.chroma_dir
+                'status': {True: 'healthy', False: 'unhealthy'}.get(health.get('healthy'), 'unknown'),
+                'health_age_s': health.get('age_s'),
+                'chroma_stats': health.get('chroma_stats'),
+                'index': chroma_service.index.get_stats() if chroma_service.index is not None else None,
+                'metrics': self.metrics.snapshot(),
+                'chroma_directory': self.chroma_dir,
+                'user_state': self.seen_store.get_stats() if self.seen_store else None,
+                'prefetch': self.prefetch.get_stats(),
+                'cursors': self.cursors.get_stats(),
+                'profiler': self.profiler.get_stats(),
+                'logging': structured_logging.get_stats(),
+                'memory': {**self.memory.get_stats(), 'index_mode': self._live_index_mode(chroma_service),
+                           'target_index_mode': self.index_mode},
+                'warm_cache': {**self.warm_cache.get_stats(), 'restored': self.restored} if self.warm_cache else None,
+                'queue_depth': self._requests.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'deadline_drops': self.deadline_drops,
+                'overload_rejections': self.overload_rejections,
+                'generation': self.generation,
+                'reloading': self._reload_thread is not None and self._reload_thread.is_alive(),
+                'last_reload': self._last_reload,
+                'last_ingest': self._last_ingest,
+                'snapshot_version': chroma_service.snapshot().version
             }
             
             return stats
@@ -245,56 +1227,308 @@ class ChromaRecommendationService:
             logger.error(f"Error getting service stats: {e}")
             return {'error': str(e)}
     
+    def _send(self, message: Dict):
+        """
+        Write one message to stdout using the negotiated codec.
+        
+        Args:
+            message: Response or protocol message to send
+        """
+        with self._write_lock:
+            self.codec.write_message(self._output, message)
+    
+    def set_protocol(self, protocol: str, request_id=None) -> Optional[Dict]:
+        """
+        Switch the wire protocol for all following messages.
+        
+        The acknowledgement is written in the old protocol, everything after
+        it in the new one. Only allowed as the first request: once the
+        protocol is negotiated or other traffic has flowed, switching would
+        desynchronize the reader on the Node.js side.
+        
+        Args:
+            protocol: Protocol name ("json" or "msgpack")
+            request_id: ID of the set_protocol request, echoed in the ack
+            
+        Returns:
+            Error response if the protocol is unavailable, None once switched
+        """
+        if self._protocol_negotiated:
+            return {
+                'error': f'Protocol already negotiated as {self.codec.name}',
+                'source': 'error'
+            }
+        
+        codec = get_codec(protocol)
+        if codec is None:
+            return {
+                'error': f'Unsupported protocol: {protocol}',
+                'protocols': available_protocols(),
+                'source': 'error'
+            }
+        
+        ack = {'protocol': codec.name}
+        if request_id is not None:
+            ack['request_id'] = request_id
+        
+        with self._write_lock:
+            self.codec.write_message(self._output, ack)
+            self.codec = codec
+            self._protocol_negotiated = True
+        
+        logger.info(f"Switched wire protocol to {codec.name}")
+        return None
+    
+    def _send_ready(self):
+        """
+        Tell Node.js the service can serve requests.
+        """
+        chroma_service = self.chroma_service
+        index = chroma_service.index if chroma_service else None
+        
+        self._send({
+            'type': 'ready',
+            'startup_ms': self.startup_time_ms,
+            'time_to_ready_ms': round((time.time() - self._process_start) * 1000, 2),
+            'phases': self.startup_phases,
+            'total_paintings': len(index) if index is not None else 0,
+            'generation': self.generation,
+            'protocols': available_protocols()
+        })
+        self._ready_sent = True
+    
+    def _process_request(self, request: Dict, deadline: Deadline,
+                         trace: Optional[Trace] = None) -> Optional[Dict]:
+        """
+        Run one request and build its response.
+        
+        Args:
+            request: Decoded request
+            deadline: Deadline of the request
+            trace: Optional request trace for stage timings and counts
+            
+        Returns:
+            Response dictionary, or None if the response was already sent
+        """
+        # Extract request parameters
+        action = request.get('action', 'recommend')
+        liked_paintings = request.get('liked_paintings', [])
+        exclude_paintings = request.get('exclude_paintings')
+        count = request.get('count', 10)
+        user_id = request.get('user_id')
+        
+        # Process request based on action
+        if action == 'recommend':
+            return self.get_recommendations(
+                liked_painting_ids=liked_paintings,
+                exclude_ids=exclude_paintings,
+                count=count,
+                user_id=user_id,
+                deadline=deadline,
+                trace=trace,
+                paginate=bool(request.get('paginate'))
+            )
+        elif action == 'diverse':
+            return self.get_diverse_recommendations(
+                liked_painting_ids=liked_paintings,
+                exclude_ids=exclude_paintings,
+                count=count,
+                user_id=user_id,
+                deadline=deadline,
+                trace=trace,
+                paginate=bool(request.get('paginate'))
+            )
+        elif action == 'next':
+            return self.get_next_recommendations(
+                liked_painting_ids=liked_paintings,
+                user_id=user_id,
+                exclude_ids=exclude_paintings,
+                count=request.get('count', 1)
+            )
+        elif action == 'page':
+            return self.get_page(request.get('cursor'), count=count, user_id=user_id)
+        elif action == 'mark_seen':
+            return self.mark_seen(user_id, request.get('painting_ids', []))
+        elif action == 'stats':
+            return self.get_service_stats()
+        elif action == 'metrics':
+            return self.get_metrics(request.get('format', 'prometheus'))
+        elif action == 'profile':
+            return self.control_profiler(request.get('command', 'status'), request.get('top_n'))
+        elif action == 'reload':
+            return self.reload_index(chroma_dir=request.get('chroma_dir'))
+        elif action == 'ingest':
+            return self.ingest(request.get('path'), batch_size=request.get('batch_size', 500))
+        elif action == 'set_protocol':
+            return self.set_protocol(request.get('protocol', 'json'), request.get('request_id'))
+        elif action == 'log_level':
+            return self.set_log_level(request.get('level'), request.get('sample_rate'))
+        else:
+            return {
+                'error': f'Unknown action: {action}',
+                'recommendations': [],
+                'source': 'error'
+            }
+    
+    def _respond(self, request: Dict, response: Dict):
+        """
+        Send a response, echoing the request's ``request_id``.
+        
+        Args:
+            request: Request being answered
+            response: Response to send
+        """
+        if isinstance(request, dict) and 'request_id' in request:
+            response['request_id'] = request['request_id']
+        self._send(response)
+    
+    def _handle_request(self, request: Dict):
+        """
+        Run a request and send its response, dropping it if its deadline passed.
+        
+        Args:
+            request: Decoded request
+        """
+        deadline = Deadline.from_request(request)
+        trace = Trace.from_request(request)
+        action = request.get('action', 'recommend')
+        # Tag this request's log records and decide once whether its info logs are kept
+        with log_context(request_id=request.get('request_id'), action=action):
+            start_time = time.time()
+            try:
+                deadline.check('start')
+                with self.profiler.profile({'action': action, 'request_id': request.get('request_id')}):
+                    response = self._process_request(request, deadline, trace)
+                if response is None:
+                    return
+                if trace.enabled:
+                    response['trace'] = trace.to_dict()
+            
+            except DeadlineExceeded as e:
+                # Node.js has already given up on this request; answer cheaply
+                self.deadline_drops += 1
+                logger.warning(f"Dropped {request.get('action', 'recommend')} request: {e}")
+                response = {
+                    'error': 'Deadline exceeded',
+                    'stage': e.stage,
+                    'recommendations': [],
+                    'source': 'deadline_exceeded'
+                }
+            
+            except Exception as e:
+                logger.error(f"Service error: {e}")
+                response = {
+                    'error': str(e),
+                    'recommendations': [],
+                    'source': 'error'
+                }
+        
+            self.metrics.observe_request(action, (time.time() - start_time) * 1000, error='error' in response)
+            self._respond(request, response)
+    
+    def _try_next_inline(self, request: Dict) -> bool:
+        """
+        Answer a ``next`` request on the reader thread if its queue can serve it.
+        
+        Popping a ready queue is cheap, so it shouldn't wait behind full
+        recommend/diverse requests; any refill it triggers runs in the
+        background. Requests the queue can't serve, traced requests and ones
+        already past their deadline are left for the workers.
+        
+        Args:
+            request: Decoded ``next`` request
+            
+        Returns:
+            True if the request was answered
+        """
+        if request.get('trace') or Deadline.from_request(request).expired():
+            return False
+        with log_context(request_id=request.get('request_id'), action='next'):
+            start_time = time.time()
+            response = self.get_next_recommendations(
+                liked_painting_ids=request.get('liked_paintings', []),
+                user_id=request.get('user_id'),
+                exclude_ids=request.get('exclude_paintings'),
+                count=request.get('count', 1),
+                queue_only=True
+            )
+            if response is None:
+                return False
+            self.metrics.observe_request('next', (time.time() - start_time) * 1000, error='error' in response)
+            self._respond(request, response)
+        return True
+    
+    def _worker_loop(self):
+        """
+        Take queued requests and run them until a None sentinel arrives.
+        """
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            self._handle_request(request)
+    
     def run(self):
         """
         Main service loop - listens for JSON requests on stdin and responds on stdout.
+        
+        Writes a ``{"type": "ready"}`` message first when the service can
+        serve, or ``{"type": "startup_failed"}`` when it can't (a later
+        successful reload then sends ``ready``). Responses echo the request's
+        ``request_id`` so callers can match them to requests. A
+        ``set_protocol`` request switches both directions to another codec.
+        
+        Cheap control actions, and ``next`` requests the user's prefetched
+        queue can answer, are handled inline. Recommendation work is
+        queued for worker threads; when the queue is full new work is
+        rejected at once with an "overloaded" response, and requests whose
+        ``deadline_ms`` has passed are dropped.
         """
+        if self.chroma_service is not None:
+            self._send_ready()
+        else:
+            self._send({
+                'type': 'startup_failed',
+                'startup_ms': self.startup_time_ms,
+                'phases': self.startup_phases
+            })
+        
+        self.health.start()
+        
+        workers = [
+            threading.Thread(target=self._worker_loop, name=f'request-worker-{i}', daemon=True)
+            for i in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        
         logger.info("ChromaDB recommendation service ready. Waiting for requests...")
         
         while True:
+            request = None
             try:
-                # Read request from stdin
-                line = sys.stdin.readline()
-                if not line:  # EOF
+                # Read and decode the next request from stdin
+                request = self.codec.read_message(self._input)
+                if request is None:  # EOF
                     break
                 
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # Parse JSON request
-                request = json.loads(line)
-                
-                # Extract request parameters
                 action = request.get('action', 'recommend')
-                liked_paintings = request.get('liked_paintings', [])
-                exclude_paintings = request.get('exclude_paintings', [])
-                count = request.get('count', 10)
-                
-                # Process request based on action
-                if action == 'recommend':
-                    response = self.get_recommendations(
-                        liked_painting_ids=liked_paintings,
-                        exclude_ids=exclude_paintings,
-                        count=count
-                    )
-                elif action == 'diverse':
-                    response = self.get_diverse_recommendations(
-                        liked_painting_ids=liked_paintings,
-                        exclude_ids=exclude_paintings,
-                        count=count
-                    )
-                elif action == 'stats':
-                    response = self.get_service_stats()
-                else:
-                    response = {
-                        'error': f'Unknown action: {action}',
+                if action != 'set_protocol':
+                    self._protocol_negotiated = True
+                if action in INLINE_ACTIONS:
+                    self._handle_request(request)
+                elif action == 'next' and self._try_next_inline(request):
+                    continue
+                elif self._requests.qsize() >= self.max_queue_depth:
+                    self.overload_rejections += 1
+                    self._respond(request, {
+                        'error': 'Service overloaded',
+                        'queue_depth': self._requests.qsize(),
                         'recommendations': [],
-                        'source': 'error'
-                    }
-                
-                # Send JSON response to stdout
-                print(json.dumps(response), flush=True)
+                        'source': 'overloaded'
+                    })
+                else:
+                    self._requests.put(request)
                 
             except json.JSONDecodeError as e:
                 logger.error(f"Invalid JSON request: {e}")
@@ -303,7 +1537,7 @@ class ChromaRecommendationService:
                     'recommendations': [],
                     'source': 'error'
                 }
-                print(json.dumps(error_response), flush=True)
+                self._send(error_response)
                 
             except Exception as e:
                 logger.error(f"Service error: {e}")
@@ -312,7 +1546,15 @@ class ChromaRecommendationService:
                     'recommendations': [],
                     'source': 'error'
                 }
-                print(json.dumps(error_response), flush=True)
+                self._respond(request, error_response)
+        
+        # Let queued requests finish before exiting
+        for _ in workers:
+            self._requests.put(None)
+        for worker in workers:
+            worker.join()
+        
+        self.shutdown()
 
 
 def main():
@@ -324,19 +1566,83 @@ def main():
     parser = argparse.ArgumentParser(description="ChromaDB Recommendation Service")
     parser.add_argument('--chroma-dir', default='./chroma_db', 
                        help='ChromaDB data directory')
+    parser.add_argument('--max-users', type=int, default=int(os.getenv('CHROMA_MAX_USERS', '10000')),
+                       help='Maximum number of per-user seen sets kept in memory')
+    parser.add_argument('--user-state-path', default=os.getenv('CHROMA_USER_STATE_PATH'),
+                       help='File to persist per-user seen sets to (disabled if unset)')
+    parser.add_argument('--page-pool-size', type=int, default=int(os.getenv('CHROMA_PAGE_POOL_SIZE', '100')),
+                       help='Candidates ranked per paginated recommend/diverse request and kept for paging')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('CHROMA_WORKERS', '1')),
+                       help='Number of threads running recommendation requests')
+    parser.add_argument('--max-queue-depth', type=int, default=int(os.getenv('CHROMA_MAX_QUEUE_DEPTH', '32')),
+                       help='Queued requests beyond which new work is rejected as overloaded')
+    parser.add_argument('--prefetch-depth', type=int, default=int(os.getenv('CHROMA_PREFETCH_DEPTH', '20')),
+                       help='Number of upcoming recommendations queued per user')
+    parser.add_argument('--shards', type=int, default=int(os.getenv('CHROMA_SHARDS', '1')),
+                       help='Number of collections the catalog is partitioned across')
+    parser.add_argument('--shard-by', choices=['hash', 'movement'], default=os.getenv('CHROMA_SHARD_BY', 'hash'),
+                       help='How paintings are assigned to shards')
+    parser.add_argument('--cache-dir', default=os.getenv('CHROMA_CACHE_DIR'),
+                       help='Directory for warm-cache snapshots restored at startup (disabled if unset)')
+    parser.add_argument('--snapshot-interval', type=float,
+                       default=float(os.getenv('CHROMA_SNAPSHOT_INTERVAL', '300')),
+                       help='Seconds between warm-cache snapshots')
+    parser.add_argument('--profile-dir', default=os.getenv('CHROMA_PROFILE_DIR', './profiles'),
+                       help='Directory the profile action writes request profiles to')
+    parser.add_argument('--bundle', default=os.getenv('CHROMA_BUNDLE'),
+                       help='Catalog bundle to load the in-memory index from when it matches the collection')
+    parser.add_argument('--memory-budget-mb', type=float,
+                       default=float(os.getenv('CHROMA_MEMORY_BUDGET_MB', '0')),
+                       help='Memory budget in MiB; near it caches are dropped and the index is '
+                            'quantized, then memory-mapped (0 to only report memory use)')
+    parser.add_argument('--memory-spill-dir', default=os.getenv('CHROMA_MEMORY_SPILL_DIR'),
+                       help='Directory for the memory-mapped index file (default: cache dir, then temp dir)')
+    parser.add_argument('--log-level', default=os.getenv('CHROMA_LOG_LEVEL', 'INFO'),
+                       help='Log level (changeable at runtime with the log_level action)')
+    parser.add_argument('--log-sample-rate', type=float, default=float(os.getenv('CHROMA_LOG_SAMPLE_RATE', '0.01')),
+                       help='Fraction of requests whose info logs are kept (warnings and errors always are)')
+    parser.add_argument('--log-format', choices=['json', 'text'], default=os.getenv('CHROMA_LOG_FORMAT', 'json'),
+                       help='Log line format on stderr')
     
     args = parser.parse_args()
     
+    # Before anything else logs: move log I/O to a background thread
+    setup_logging(args.log_level, sample_rate=args.log_sample_rate, fmt=args.log_format)
+    
     # Initialize and run service
-    service = ChromaRecommendationService(chroma_dir=args.chroma_dir)
+    service = ChromaRecommendationService(
+        chroma_dir=args.chroma_dir,
+        max_users=args.max_users,
+        user_state_path=args.user_state_path,
+        prefetch_depth=args.prefetch_depth,
+        page_pool_size=args.page_pool_size,
+        num_workers=args.workers,
+        max_queue_depth=args.max_queue_depth,
+        profile_dir=args.profile_dir,
+        num_shards=args.shards,
+        shard_by=args.shard_by,
+        cache_dir=args.cache_dir,
+        snapshot_interval=args.snapshot_interval,
+        bundle_dir=args.bundle,
+        memory_budget_mb=args.memory_budget_mb,
+        spill_dir=args.memory_spill_dir
+    )
     
     def signal_handler(signum, frame):
         logger.info("Shutting down ChromaDB recommendation service...")
+        service.shutdown()
         sys.exit(0)
     
+    def reload_handler(signum, frame):
+        logger.info("Received SIGHUP, reloading ChromaDB index...")
+        result = service.reload_index()
+        if 'error' in result:
+            logger.warning(f"SIGHUP reload skipped: {result['error']}")
+    
     # Set up signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, reload_handler)
     
     # Run the service
     service.run()
@@ -4,22 +4,159 @@ ChromaDB Service for Painting Recommendations
 
 This service manages ChromaDB operations for vector similarity search
 of painting embeddings. Designed for memory-efficient operation on EC2 t3.micro.
+
+Reads and writes can run concurrently. The collection, in-memory index and
+alias maps are published together as an immutable CatalogSnapshot; each
+query takes the current snapshot once and uses it throughout, while writers
+(ingest, HNSW rebuilds) serialize on ``write_lock``, build the next version
+alongside and publish it with a single reference swap.
 """
 
 import os
 import sys
 import json
 import time
+import hashlib
 import logging
-from typing import List, Dict, Optional, Tuple
-import chromadb
-from chromadb.config import Settings
+import threading
+from typing import List, Dict, Optional, Tuple, Collection
 import numpy as np
 
+from painting_index import PaintingIndex, EMBEDDING_DIM
+from deadline import Deadline, DeadlineExceeded
+from tracing import Trace
+from sharded_collection import ShardedCollection, shard_collection_name
+from cloud_client import RemotePolicy, ResilientCollection, EmbeddingCache
+from colike import CoLikeMatrix
+import catalog_bundle
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# HNSW parameters fixed when the index is built; changing them needs a rebuild.
+# ef_search (and the other search-time parameters) can be changed in place.
+HNSW_BUILD_PARAMS = ('space', 'max_neighbors', 'ef_construction')
+
+class ExclusionUnion:
+    """
+    Union of several exclusion containers without copying them.
+    
+    Lets a caller pass a custom exclusion set (e.g. a per-user seen bitmap)
+    that is combined with the liked paintings at O(1) cost.
+    """
+    
+    def __init__(self, *containers: Collection[str]):
+        self.containers = containers
+    
+    def __contains__(self, painting_id: str) -> bool:
+        return any(painting_id in container for container in self.containers)
+    
+    def __len__(self) -> int:
+        return sum(len(container) for container in self.containers)
+
+
+def merge_exclusions(liked_painting_ids: List[str],
+                     exclude_ids: Optional[Collection[str]]) -> Collection[str]:
+    """
+    Combine liked paintings with an exclude list or container.
+    
+    Args:
+        liked_painting_ids: List of painting IDs the user has liked
+        exclude_ids: Painting IDs to exclude, as a list/set or any container
+            supporting ``in`` and ``len``
+        
+    Returns:
+        Container of all painting IDs to exclude
+    """
+    if exclude_ids is None or isinstance(exclude_ids, (list, tuple, set, frozenset)):
+        all_exclude_ids = set(liked_painting_ids)
+        if exclude_ids:
+            all_exclude_ids.update(exclude_ids)
+        return all_exclude_ids
+    
+    return ExclusionUnion(set(liked_painting_ids), exclude_ids)
+
+
+def catalog_sample_offsets(count: int, samples: int = 16) -> List[int]:
+    """
+    Row offsets sampled by the catalog version stamp.
+    
+    Args:
+        count: Number of paintings in the catalog
+        samples: Number of rows sampled
+        
+    Returns:
+        Sorted, evenly spaced offsets (empty for an empty catalog)
+    """
+    return sorted({(count - 1) * i // max(1, samples - 1) for i in range(samples)}) if count else []
+
+
+def catalog_stamp(collection_name: str, num_shards: int, count: int, rows) -> str:
+    """
+    Hash a catalog's identity and sampled rows into a version stamp.
+    
+    Shared by ChromaService.catalog_version and bundle export, so a bundle's
+    stamp is computed from the vectors exactly as the bundle stores them.
+    
+    Args:
+        collection_name: Name of the collection
+        num_shards: Number of shards the catalog is split across
+        count: Number of paintings
+        rows: (painting ID, embedding or None) at ``catalog_sample_offsets(count)``
+        
+    Returns:
+        16-character hex stamp
+    """
+    digest = hashlib.sha1('|'.join([collection_name, str(num_shards), str(count)]).encode('utf-8'))
+    for painting_id, embedding in rows:
+        digest.update(f'|{painting_id}'.encode('utf-8'))
+        if embedding is not None:
+            digest.update(np.asarray(embedding, dtype=np.float32).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the catalog that queries read from.
+    
+    Writers never modify a published snapshot; they publish a new one with
+    ``replace``, so a query sees one consistent collection, index and alias
+    map from start to finish.
+    """
+    
+    __slots__ = ('collection', 'index', 'aliases', 'alias_groups', 'version')
+    
+    def __init__(self, collection=None, index: Optional[PaintingIndex] = None,
+                 aliases: Optional[Dict[str, str]] = None,
+                 alias_groups: Optional[Dict[str, List[str]]] = None, version: int = 0):
+        self.collection = collection
+        self.index = index
+        self.aliases = aliases if aliases is not None else {}
+        self.alias_groups = alias_groups if alias_groups is not None else {}
+        self.version = version
+    
+    def replace(self, **changes) -> 'CatalogSnapshot':
+        """
+        Returns:
+            Next version of this snapshot with the given fields changed
+        """
+        fields = {name: getattr(self, name) for name in ('collection', 'index', 'aliases', 'alias_groups')}
+        fields.update(changes)
+        return CatalogSnapshot(**fields, version=self.version + 1)
+    
+    def canonical_id(self, painting_id: str) -> str:
+        return self.aliases.get(painting_id, painting_id)
+    
+    def is_excluded(self, painting_id: str, exclude_ids: Optional[Collection[str]]) -> bool:
+        # A canonical painting is excluded when any of its collapsed duplicates is
+        if not exclude_ids:
+            return False
+        if painting_id in exclude_ids:
+            return True
+        return any(alias in exclude_ids for alias in self.alias_groups.get(painting_id, ()))
+
+
 class ChromaService:
     """
     ChromaDB service for painting recommendation system.
@@ -28,19 +165,40 @@ class ChromaService:
     and graceful error handling for production deployment.
     """
     
-    def __init__(self, collection_name: str = "paintings", persist_directory: str = "./chroma_db"):
+    def __init__(self, collection_name: str = "paintings", persist_directory: str = "./chroma_db",
+                 fresh_client: bool = False, num_shards: int = 1, shard_by: str = 'hash'):
         """
         Initialize ChromaDB service with memory-optimized settings.
         
         Args:
             collection_name: Name of the ChromaDB collection
             persist_directory: Directory to persist ChromaDB data
+            fresh_client: Open a new local client instead of reusing one cached
+                for the same directory, so data written by another process is seen
+            num_shards: Number of collections the catalog is partitioned across
+                (1 for a single collection)
+            shard_by: Partitioning strategy in sharded mode ("hash" or "movement")
         """
         self.collection_name = collection_name
+        # Set by a rebuild in apply_hnsw_config to the renamed old collection
+        self.previous_collection_name = None
         self.persist_directory = persist_directory
+        self.fresh_client = fresh_client
+        self.num_shards = num_shards
+        self.shard_by = shard_by
+        self.remote_policy = None
+        self.embedding_cache = EmbeddingCache()
         self.client = None
-        self.collection = None
+        # Serializes writers; readers never take it
+        self.write_lock = threading.RLock()
+        self._snapshot = CatalogSnapshot()
+        self.catalog_stamp = None
+        self.colike = None
+        # Share of each recommendation list filled from co-liked paintings
+        self.colike_weight = float(os.getenv('COLIKE_WEIGHT', '0.3'))
         self._initialize_client()
+        self.load_aliases()
+        self.load_colike()
     
     def _initialize_client(self) -> bool:
         """
@@ -50,6 +208,10 @@ class ChromaService:
             bool: True if initialization successful, False otherwise
         """
         try:
+            # Imported here so callers can preload chromadb off the critical path
+            import chromadb
+            from chromadb.config import Settings
+            
             # Check if using Chroma Cloud
             chroma_api_key = os.getenv('CHROMA_API_KEY')
             
@@ -61,11 +223,30 @@ class ChromaService:
                     database='painting-recommender',
                     api_key=chroma_api_key
                 )
+                self.remote_policy = RemotePolicy.from_env()
+                self.remote_policy.apply_transport_timeout(self.client)
+            elif os.getenv('CHROMA_HOST'):
+                # Self-hosted Chroma server (or a local stand-in / chaos proxy for testing)
+                logger.info(f"Connecting to Chroma server at {os.getenv('CHROMA_HOST')}...")
+                self.client = chromadb.HttpClient(
+                    host=os.getenv('CHROMA_HOST'),
+                    port=int(os.getenv('CHROMA_PORT', '8000')),
+                    ssl=os.getenv('CHROMA_SSL', 'false').lower() == 'true',
+                    settings=Settings(anonymized_telemetry=False)
+                )
+                self.remote_policy = RemotePolicy.from_env()
+                self.remote_policy.apply_transport_timeout(self.client)
             else:
                 # Use local ChromaDB (existing behavior)
                 logger.info("Using local ChromaDB...")
                 os.makedirs(self.persist_directory, exist_ok=True)
                 
+                if self.fresh_client:
+                    # chromadb shares one system per path; drop the cached one so the
+                    # new client reopens the persisted data. Existing clients keep theirs.
+                    from chromadb.api.client import SharedSystemClient
+                    SharedSystemClient.clear_system_cache()
+                
                 self.client = chromadb.PersistentClient(
                     path=self.persist_directory,
                     settings=Settings(
@@ -76,8 +257,17 @@ class ChromaService:
             
             # Get or create collection
             try:
-                self.collection = self.client.get_collection(name=self.collection_name)
-                logger.info(f"Connected to existing collection '{self.collection_name}'")
+                if self.num_shards > 1:
+                    self.collection = ShardedCollection(
+                        self.collection_name,
+                        [self._open_collection(shard_collection_name(self.collection_name, shard))
+                         for shard in range(self.num_shards)],
+                        shard_by=self.shard_by
+                    )
+                else:
+                    self.collection = self._open_collection(self.collection_name)
+                logger.info(f"Connected to existing collection '{self.collection_name}'"
+                            f"{f' ({self.num_shards} shards)' if self.num_shards > 1 else ''}")
             except Exception:
                 # Collection doesn't exist, will be created during migration
                 logger.info(f"Collection '{self.collection_name}' not found, will be created during migration")
@@ -89,6 +279,179 @@ class ChromaService:
             logger.error(f"Failed to initialize ChromaDB client: {e}")
             return False
     
+    def snapshot(self) -> CatalogSnapshot:
+        """
+        Returns:
+            The current catalog snapshot; hold on to it for a whole query
+        """
+        return self._snapshot
+    
+    def _publish(self, **changes):
+        with self.write_lock:
+            self._snapshot = self._snapshot.replace(**changes)
+    
+    @property
+    def collection(self):
+        return self._snapshot.collection
+    
+    @collection.setter
+    def collection(self, collection):
+        self._publish(collection=collection)
+    
+    @property
+    def index(self) -> Optional[PaintingIndex]:
+        return self._snapshot.index
+    
+    @index.setter
+    def index(self, index: Optional[PaintingIndex]):
+        self._publish(index=index)
+    
+    @property
+    def aliases(self) -> Dict[str, str]:
+        return self._snapshot.aliases
+    
+    @property
+    def alias_groups(self) -> Dict[str, List[str]]:
+        return self._snapshot.alias_groups
+    
+    def _remote(self, collection):
+        # Route calls on remote collections through the timeout/retry policy
+        if self.remote_policy is None or collection is None:
+            return collection
+        return ResilientCollection(collection, self.remote_policy)
+    
+    def _open_collection(self, name: str):
+        """
+        Open an existing collection, wrapped for remote access if needed.
+        
+        Args:
+            name: Collection name
+            
+        Returns:
+            Collection
+        """
+        if self.remote_policy is not None:
+            return self._remote(self.remote_policy.call(self.client.get_collection, name=name))
+        return self.client.get_collection(name=name)
+    
+    def _aliases_path(self) -> str:
+        return os.getenv('CHROMA_ALIASES') or os.path.join(self.persist_directory, 'aliases.json')
+    
+    @staticmethod
+    def _alias_changes(aliases: Dict[str, str]) -> Dict:
+        groups = {}
+        for alias, canonical in aliases.items():
+            groups.setdefault(canonical, []).append(alias)
+        return {'aliases': aliases, 'alias_groups': groups}
+    
+    def _set_aliases(self, aliases: Dict[str, str]):
+        # Both maps are published in one snapshot so readers see a consistent pair
+        self._publish(**self._alias_changes(aliases))
+    
+    def load_aliases(self, path: Optional[str] = None) -> int:
+        """
+        Load the near-duplicate alias map written by dedupe.py.
+        
+        Args:
+            path: Alias map file (defaults to CHROMA_ALIASES or
+                <persist_directory>/aliases.json)
+            
+        Returns:
+            int: Number of aliases loaded
+        """
+        path = path or self._aliases_path()
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path) as f:
+                self._set_aliases({str(alias): str(canonical) for alias, canonical in json.load(f).items()})
+            logger.info(f"Loaded {len(self.aliases)} near-duplicate aliases from {path}")
+        except Exception as e:
+            logger.error(f"Failed to load aliases from {path}: {e}")
+        return len(self.aliases)
+    
+    def load_colike(self, directory: Optional[str] = None) -> bool:
+        """
+        Memory-map the co-like matrix written by colike.py.
+        
+        Args:
+            directory: Matrix directory (defaults to CHROMA_COLIKE_DIR or
+                <persist_directory>/colike)
+            
+        Returns:
+            bool: True if a matrix was loaded
+        """
+        directory = directory or os.getenv('CHROMA_COLIKE_DIR') or os.path.join(self.persist_directory, 'colike')
+        try:
+            colike = CoLikeMatrix.load(directory)
+            if colike is None:
+                return False
+            self.colike = colike
+            logger.info(f"Loaded co-like matrix for {len(colike)} paintings from {directory}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load co-like matrix from {directory}: {e}")
+            return False
+    
+    def get_colike_candidates(self, liked_painting_ids: List[str], k: int,
+                              exclude_ids: Optional[Collection[str]],
+                              user_embedding: List[float]) -> List[Dict]:
+        """
+        Paintings other users liked together with this user's likes.
+        
+        Candidates missing from the in-memory index (a co-like matrix built
+        against an older catalog) are dropped, so every result carries a
+        ``similarity_score`` like content results do.
+        
+        Args:
+            liked_painting_ids: List of painting IDs the user has liked, most recent first
+            k: Number of candidates to return
+            exclude_ids: Painting IDs to exclude
+            user_embedding: Aggregated user preference, used to give candidates
+                a similarity score comparable with content results
+            
+        Returns:
+            List of paintings shaped like get_similar_paintings results, with
+            ``source`` set to "colike"
+        """
+        snapshot = self._snapshot
+        index = snapshot.index
+        if self.colike is None or index is None or k <= 0:
+            return []
+        
+        liked = [snapshot.canonical_id(pid) for pid in liked_painting_ids]
+        candidates = self.colike.candidates(
+            liked, k, exclude=lambda pid: snapshot.is_excluded(snapshot.canonical_id(pid), exclude_ids)
+        )
+        
+        query = np.asarray(user_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        
+        paintings = []
+        for painting_id, score in candidates:
+            painting_id = snapshot.canonical_id(painting_id)
+            if painting_id not in index:
+                continue
+            vector = index.get_embedding(painting_id)
+            paintings.append({
+                '_id': painting_id,
+                'mongodb_id': painting_id,
+                'similarity_score': round(float(vector @ query) / max(float(np.linalg.norm(vector)), 1e-12), 4),
+                'colike_score': round(score, 4),
+                'source': 'colike'
+            })
+        return paintings
+    
+    def canonical_id(self, painting_id: str) -> str:
+        """
+        Returns:
+            ID of the painting kept for ``painting_id``'s near-duplicate group
+        """
+        return self._snapshot.canonical_id(painting_id)
+    
+    def _is_excluded(self, painting_id: str, exclude_ids: Optional[Collection[str]]) -> bool:
+        return self._snapshot.is_excluded(painting_id, exclude_ids)
+    
     def health_check(self) -> bool:
         """
         Check if ChromaDB service is healthy and responsive.
@@ -101,7 +464,10 @@ class ChromaService:
                 return False
             
             # Try to list collections as a health check
-            collections = self.client.list_collections()
+            if self.remote_policy is not None:
+                collections = self.remote_policy.call(self.client.list_collections)
+            else:
+                collections = self.client.list_collections()
             logger.debug(f"Health check passed. Collections: {[c.name for c in collections]}")
             return True
             
@@ -109,10 +475,100 @@ class ChromaService:
             logger.error(f"Health check failed: {e}")
             return False
     
-    def create_collection(self) -> bool:
+    def catalog_version(self, samples: int = 16) -> Optional[str]:
+        """
+        Get a cheap stamp identifying the current contents of the catalog.
+        
+        Hashes the painting count with the IDs and embeddings at evenly
+        spaced offsets, so paintings being added or removed change it, and so
+        does re-embedding a sampled painting in place. Re-embedding only
+        paintings between the samples isn't detected; warm caches built on
+        the old vectors then live until the count or a sampled row changes.
+        
+        Args:
+            samples: Number of rows sampled
+            
+        Returns:
+            Version stamp, or None if the collection is unavailable
+        """
+        try:
+            if not self.collection:
+                return None
+            
+            count = self.collection.count()
+            rows = []
+            for offset in catalog_sample_offsets(count, samples):
+                results = self.collection.get(limit=1, offset=offset, include=['embeddings'])
+                embeddings = results.get('embeddings')
+                for row, painting_id in enumerate(results.get('ids') or []):
+                    rows.append((painting_id, embeddings[row] if embeddings is not None else None))
+            
+            return catalog_stamp(self.collection_name, self.num_shards, count, rows)
+            
+        except Exception as e:
+            logger.error(f"Failed to compute catalog version: {e}")
+            return None
+    
+    def load_index(self) -> bool:
+        """
+        Load all painting ids and embeddings into an in-memory index.
+        
+        Embedding lookups are served from the index once it is loaded.
+        
+        Returns:
+            bool: True if index loaded successfully, False otherwise
+        """
+        try:
+            collection = self.collection
+            if not collection:
+                logger.error("Collection not initialized")
+                return False
+            
+            self.index = PaintingIndex.from_collection(collection)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to load painting index: {e}")
+            return False
+    
+    def warm_up(self) -> bool:
+        """
+        Run a throwaway query so the vector index is loaded before real traffic.
+        
+        Returns:
+            bool: True if the warm-up query succeeded, False otherwise
+        """
+        try:
+            if not self.collection:
+                logger.error("Collection not initialized")
+                return False
+            
+            if self.index is not None and len(self.index) > 0:
+                query_embedding = self.index.vectors[0].tolist()
+            else:
+                query_embedding = np.random.rand(1536).tolist()
+            
+            self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=1,
+                include=['distances']
+            )
+            return True
+            
+        except Exception as e:
+            logger.error(f"Warm-up query failed: {e}")
+            return False
+    
+    def create_collection(self, hnsw_config: Optional[Dict] = None,
+                          name: Optional[str] = None) -> bool:
         """
         Create the paintings collection with appropriate metadata.
         
+        Args:
+            hnsw_config: Optional HNSW settings (max_neighbors, ef_construction,
+                ef_search, ...); space is always cosine unless given
+            name: Collection name (defaults to this service's collection)
+            
         Returns:
             bool: True if collection created successfully, False otherwise
         """
@@ -121,23 +577,222 @@ class ChromaService:
                 logger.error("ChromaDB client not initialized")
                 return False
             
-            # Create collection with cosine similarity (default for text embeddings)
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}  # Optimized for text embeddings
-            )
-            
-            logger.info(f"Created collection '{self.collection_name}' successfully")
+            with self.write_lock:
+                self.collection = self._new_collection(hnsw_config, name)
             return True
             
         except Exception as e:
             logger.error(f"Failed to create collection: {e}")
             return False
     
+    def _new_collection(self, hnsw_config: Optional[Dict], name: Optional[str]):
+        """
+        Create a collection without publishing it to readers.
+        
+        Args:
+            hnsw_config: Optional HNSW settings
+            name: Collection name (defaults to this service's collection)
+            
+        Returns:
+            The new collection
+        """
+        # Create collection with cosine similarity (default for text embeddings)
+        configuration = {"hnsw": {"space": "cosine", **(hnsw_config or {})}}
+        if self.num_shards > 1:
+            base_name = name or self.collection_name
+            collection = ShardedCollection(
+                base_name,
+                [self._remote(self.client.create_collection(name=shard_collection_name(base_name, shard),
+                                                            configuration=configuration))
+                 for shard in range(self.num_shards)],
+                shard_by=self.shard_by
+            )
+        else:
+            collection = self._remote(self.client.create_collection(
+                name=name or self.collection_name,
+                configuration=configuration
+            ))
+        
+        logger.info(f"Created collection '{collection.name}' with HNSW config {hnsw_config or 'defaults'}")
+        return collection
+    
+    def get_hnsw_config(self) -> Dict:
+        """
+        Get the HNSW configuration of the collection.
+        
+        Returns:
+            Dictionary of HNSW settings (empty if unavailable)
+        """
+        try:
+            if not self.collection:
+                return {}
+            configuration = self.collection.configuration or {}
+            return dict(configuration.get('hnsw') or {})
+            
+        except Exception as e:
+            logger.error(f"Failed to read HNSW configuration: {e}")
+            return {}
+    
+    def apply_hnsw_config(self, hnsw_config: Dict, batch_size: int = 1000) -> bool:
+        """
+        Apply HNSW settings to the collection.
+        
+        Search-time settings such as ef_search are changed in place. If a
+        build-time setting (space, max_neighbors, ef_construction) differs,
+        the collection is rebuilt under a versioned name while queries keep
+        using the old one. Once the copy is complete the old collection is
+        renamed out of the way (to ``previous_collection_name``) and the new
+        one takes its name. Nothing is dropped: other processes keep querying
+        the old collection, which chromadb addresses by ID, until they reload
+        onto the new one. Delete the previous collection after that.
+        
+        Args:
+            hnsw_config: HNSW settings to apply
+            batch_size: Rows copied per batch when rebuilding
+            
+        Returns:
+            bool: True if applied successfully, False otherwise
+        """
+        try:
+            with self.write_lock:
+                return self._apply_hnsw_config(hnsw_config, batch_size)
+        except Exception as e:
+            logger.error(f"Failed to apply HNSW config: {e}")
+            return False
+    
+    def _apply_hnsw_config(self, hnsw_config: Dict, batch_size: int) -> bool:
+        if not self.collection:
+            logger.error("Collection not initialized")
+            return False
+        
+        current = self.get_hnsw_config()
+        rebuild = {key: value for key, value in hnsw_config.items()
+                   if key in HNSW_BUILD_PARAMS and current.get(key) != value}
+        
+        if not rebuild:
+            search_config = {key: value for key, value in hnsw_config.items()
+                             if key not in HNSW_BUILD_PARAMS}
+            if search_config:
+                self.collection.modify(configuration={"hnsw": search_config})
+            logger.info(f"Applied HNSW search config {search_config} to '{self.collection_name}'")
+            return True
+        
+        if self.num_shards > 1:
+            logger.error("Changing HNSW build settings of a sharded collection needs a re-import")
+            return False
+        
+        logger.info(f"Rebuilding '{self.collection_name}' for HNSW build config {rebuild}")
+        start_time = time.time()
+        old_collection = self.collection
+        version = time.strftime('%Y%m%d%H%M%S')
+        build_name = f"{self.collection_name}_v{version}"
+        previous_name = f"{self.collection_name}_previous_{version}"
+        
+        merged = {key: value for key, value in current.items() if key in HNSW_BUILD_PARAMS}
+        merged.update(hnsw_config)
+        # Readers stay on the old collection until the copy is complete
+        new_collection = self._new_collection(merged, build_name)
+        try:
+            copied = self.copy_from(old_collection, batch_size, target=new_collection)
+        except Exception:
+            self.client.delete_collection(build_name)
+            raise
+        
+        # Swap names; running services hold the old collection by ID and keep
+        # serving from it until they reload
+        self.collection = new_collection
+        old_collection.modify(name=previous_name)
+        new_collection.modify(name=self.collection_name)
+        self.collection = self._open_collection(self.collection_name)
+        self.previous_collection_name = previous_name
+        
+        logger.info(f"Rebuilt '{self.collection_name}' ({copied} paintings) in {time.time() - start_time:.1f}s; "
+                    f"previous collection kept as '{previous_name}'")
+        return True
+    
+    def copy_from(self, source, batch_size: int = 1000, target=None) -> int:
+        """
+        Copy every painting of another collection into this one.
+        
+        Used to rebuild with new HNSW settings and to split a single
+        collection into shards.
+        
+        Args:
+            source: Collection to read from
+            batch_size: Rows copied per batch
+            target: Collection to copy into (defaults to this service's)
+            
+        Returns:
+            Number of paintings copied
+        """
+        target = target if target is not None else self.collection
+        offset = 0
+        while True:
+            results = source.get(
+                include=['embeddings', 'metadatas'],
+                limit=batch_size,
+                offset=offset
+            )
+            batch_ids = results.get('ids') or []
+            if not batch_ids:
+                break
+            target.add(
+                ids=batch_ids,
+                embeddings=results['embeddings'],
+                metadatas=results['metadatas']
+            )
+            offset += len(batch_ids)
+            if len(batch_ids) < batch_size:
+                break
+        return offset
+    
+    def export_bundle(self, out_dir: str, dtype: str = 'float32', include_hnsw: bool = False) -> Optional[Dict]:
+        """
+        Export the collection as a portable catalog bundle (see catalog_bundle.py).
+        
+        Args:
+            out_dir: Bundle directory to create
+            dtype: Vector precision, "float32" or "float16"
+            include_hnsw: Also copy the HNSW segment files
+            
+        Returns:
+            Bundle manifest, or None on failure
+        """
+        try:
+            return catalog_bundle.export_bundle(self, out_dir, dtype=dtype, include_hnsw=include_hnsw)
+        except Exception as e:
+            logger.error(f"Failed to export bundle to {out_dir}: {e}")
+            return None
+    
+    def import_bundle(self, bundle_dir: str, batch_size: int = 5000, verify: bool = True) -> Optional[Dict]:
+        """
+        Create the collection from a catalog bundle and load its index.
+        
+        Args:
+            bundle_dir: Bundle directory
+            batch_size: Rows inserted per batch
+            verify: Check bundle checksums first
+            
+        Returns:
+            Bundle manifest, or None on failure
+        """
+        try:
+            with self.write_lock:
+                manifest = catalog_bundle.import_bundle(self, bundle_dir, batch_size=batch_size, verify=verify)
+                self.catalog_stamp = self.catalog_version()
+            return manifest
+        except Exception as e:
+            logger.error(f"Failed to import bundle from {bundle_dir}: {e}")
+            return None
+    
     def add_paintings(self, paintings_data: List[Dict]) -> bool:
         """
         Add paintings with embeddings to ChromaDB collection.
         
+        Safe to call while queries run: the new rows are published to the
+        in-memory index (copy-on-write) together with any new aliases, and
+        concurrent writers are serialized.
+        
         Args:
             paintings_data: List of painting dictionaries with embeddings and metadata
             
@@ -157,6 +812,7 @@ class ChromaService:
             ids = []
             embeddings = []
             metadatas = []
+            new_aliases = {}
             
             for painting in paintings_data:
                 # Use MongoDB ObjectId or custom ID as ChromaDB ID
@@ -177,15 +833,37 @@ class ChromaService:
                     'mongodb_id': painting_id
                 }
                 
+                # Art movement, used to place the painting when sharding by movement
+                if painting.get('style'):
+                    metadata['movement'] = str(painting['style'])
+                
                 metadatas.append(metadata)
+                
+                # Near-duplicates collapsed into this painting at ingest (dedupe.py)
+                for alias in painting.get('aliases') or ():
+                    new_aliases[str(alias)] = painting_id
             logger.info(f"Adding {len(ids)} paintings to collection")
             # Add to collection in batch
             if ids and embeddings and metadatas:
-                self.collection.add(
-                    ids=ids,
-                    embeddings=embeddings,
-                    metadatas=metadatas
-                )
+                with self.write_lock:
+                    self.collection.add(
+                        ids=ids,
+                        embeddings=embeddings,
+                        metadatas=metadatas
+                    )
+                    
+                    # Publish the new rows and aliases in one snapshot; queries
+                    # already running keep the one they started with
+                    changes = {}
+                    if self.index is not None:
+                        changes['index'] = self.index.extended(ids, np.asarray(embeddings, dtype=np.float32))
+                    if new_aliases:
+                        aliases = {**self.aliases, **new_aliases}
+                        self._save_aliases(aliases)
+                        changes.update(self._alias_changes(aliases))
+                    self._publish(**changes)
+                    if self.catalog_stamp:
+                        self.catalog_stamp = self.catalog_version()
                 
                 logger.info(f"Added {len(ids)} paintings to collection")
                 return True
@@ -198,22 +876,27 @@ class ChromaService:
             return False
     
     def get_similar_paintings(self, user_embedding: List[float], k: int = 5, 
-                            exclude_ids: Optional[List[str]] = None,
-                            min_similarity: float = 0.0) -> List[Dict]:
+                            exclude_ids: Optional[Collection[str]] = None,
+                            min_similarity: float = 0.0,
+                            trace: Optional[Trace] = None) -> List[Dict]:
         """
         Find similar paintings based on user preference embedding.
         
         Args:
             user_embedding: Aggregated user preference vector
             k: Number of similar paintings to return (default: 5)
-            exclude_ids: List of painting IDs to exclude from results
+            exclude_ids: Painting IDs to exclude from results (any container supporting ``in``)
             min_similarity: Minimum similarity threshold (0.0 to 1.0)
+            trace: Optional request trace for stage timings and counts
             
         Returns:
             List of similar paintings with metadata and similarity scores
         """
+        trace = trace or Trace()
+        snapshot = self._snapshot
+        collection = snapshot.collection
         try:
-            if not self.collection:
+            if not collection:
                 logger.error("Collection not initialized")
                 return []
             
@@ -227,65 +910,76 @@ class ChromaService:
                 query_size += len(exclude_ids)
             
             # Query ChromaDB for similar vectors
-            results = self.collection.query(
-                query_embeddings=[user_embedding],
-                n_results=query_size,
-                include=['metadatas', 'distances']
-            )
+            with trace.stage('chroma_query'):
+                results = collection.query(
+                    query_embeddings=[user_embedding],
+                    n_results=query_size,
+                    include=['metadatas', 'distances']
+                )
             
             similar_paintings = []
+            seen_groups = set()
+            counts = {'scanned': 0, 'excluded': 0}
             
-            if results and results['ids'] and results['ids'][0]:
-                for i, painting_id in enumerate(results['ids'][0]):
+            def collect(query_results: Dict, threshold: float):
+                if not (query_results and query_results['ids'] and query_results['ids'][0]):
+                    return
+                for i, painting_id in enumerate(query_results['ids'][0]):
+                    # Stop when we have enough results
+                    if len(similar_paintings) >= k:
+                        break
+                    counts['scanned'] += 1
                     # Skip excluded paintings
-                    if exclude_ids and painting_id in exclude_ids:
+                    if snapshot.is_excluded(painting_id, exclude_ids):
+                        counts['excluded'] += 1
+                        continue
+                    
+                    # Never return two members of the same near-duplicate group
+                    group = snapshot.canonical_id(painting_id)
+                    if group in seen_groups:
                         continue
                     
                     # Convert distance to similarity score (cosine distance -> cosine similarity)
-                    distance = results['distances'][0][i]
+                    distance = query_results['distances'][0][i]
                     similarity_score = 1.0 - distance  # For cosine distance
                     
                     # Apply minimum similarity threshold
-                    if similarity_score < min_similarity:
+                    if similarity_score < threshold:
                         continue
                     
                     # Get metadata
-                    metadata = results['metadatas'][0][i] if results['metadatas'] else {}
+                    metadata = query_results['metadatas'][0][i] if query_results['metadatas'] else {}
                     
-                    painting = {
+                    similar_paintings.append({
                         '_id': painting_id,
                         'similarity_score': round(similarity_score, 4),
                         'mongodb_id': metadata.get('mongodb_id', painting_id),
                         'distance': round(distance, 4)
-                    }
-                    
-                    similar_paintings.append(painting)
-                    
-                    # Stop when we have enough results
-                    if len(similar_paintings) >= k:
-                        break
+                    })
+                    seen_groups.add(group)
+            
+            filter_start = time.perf_counter()
+            collect(results, min_similarity)
             
             # Sort by similarity score (highest first)
             similar_paintings.sort(key=lambda x: x['similarity_score'], reverse=True)
             
-            # Fallback: If no valid results, perform a random query
+            trace.add_time('exclusion_filter', (time.perf_counter() - filter_start) * 1000)
+            if trace.enabled:
+                trace.count('candidates_requested', query_size)
+                trace.count('candidates_scanned', counts['scanned'])
+                trace.count('candidates_excluded', counts['excluded'])
+            
+            # Fallback: If no valid results, perform a random query, filtered the same way
             if not similar_paintings:
                 logger.warning("No valid recommendations found. Performing a random query as fallback.")
-                random_results = self.collection.query(
-                    query_embeddings=[np.random.rand(1536).tolist()],  # Random embedding
-                    n_results=k,
-                    include=['metadatas', 'distances']
-                )
-                if random_results and random_results['ids'] and random_results['ids'][0]:
-                    for i, painting_id in enumerate(random_results['ids'][0]):
-                        metadata = random_results['metadatas'][0][i] if random_results['metadatas'] else {}
-                        distance = random_results['distances'][0][i]
-                        similar_paintings.append({
-                            '_id': painting_id,
-                            'similarity_score': round(1.0 - distance, 4),
-                            'mongodb_id': metadata.get('mongodb_id', painting_id),
-                            'distance': round(distance, 4)
-                        })
+                with trace.stage('fallback_query'):
+                    random_results = collection.query(
+                        query_embeddings=[np.random.rand(1536).tolist()],  # Random embedding
+                        n_results=query_size,
+                        include=['metadatas', 'distances']
+                    )
+                collect(random_results, float('-inf'))
             
             logger.info(f"Found {len(similar_paintings)} similar paintings (min_similarity: {min_similarity})")
             return similar_paintings[:k]
@@ -295,7 +989,7 @@ class ChromaService:
             return []
     
     def get_similar_paintings_batch(self, user_embeddings: List[List[float]], k: int = 10,
-                                  exclude_ids: Optional[List[str]] = None) -> List[List[Dict]]:
+                                  exclude_ids: Optional[Collection[str]] = None) -> List[List[Dict]]:
         """
         Batch similarity search for multiple user preference vectors.
         
@@ -307,8 +1001,10 @@ class ChromaService:
         Returns:
             List of recommendation lists, one per input embedding
         """
+        snapshot = self._snapshot
+        collection = snapshot.collection
         try:
-            if not self.collection:
+            if not collection:
                 logger.error("Collection not initialized")
                 return []
             
@@ -327,7 +1023,7 @@ class ChromaService:
             if exclude_ids:
                 query_size += len(exclude_ids)
             
-            results = self.collection.query(
+            results = collection.query(
                 query_embeddings=user_embeddings,
                 n_results=query_size,
                 include=['metadatas', 'distances']
@@ -338,11 +1034,13 @@ class ChromaService:
             if results and results['ids']:
                 for query_idx in range(len(user_embeddings)):
                     similar_paintings = []
+                    seen_groups = set()
                     
                     if query_idx < len(results['ids']) and results['ids'][query_idx]:
                         for i, painting_id in enumerate(results['ids'][query_idx]):
-                            # Skip excluded paintings
-                            if exclude_ids and painting_id in exclude_ids:
+                            # Skip excluded paintings and repeats of a near-duplicate group
+                            group = snapshot.canonical_id(painting_id)
+                            if snapshot.is_excluded(painting_id, exclude_ids) or group in seen_groups:
                                 continue
                             
                             if len(similar_paintings) >= k:
@@ -362,6 +1060,7 @@ class ChromaService:
                             }
                             
                             similar_paintings.append(painting)
+                            seen_groups.add(group)
                     
                     all_recommendations.append(similar_paintings)
             
@@ -372,6 +1071,17 @@ class ChromaService:
             logger.error(f"Failed to perform batch similarity search: {e}")
             return []
     
+    def _save_aliases(self, aliases: Dict[str, str]):
+        path = self._aliases_path()
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(aliases, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to save aliases to {path}: {e}")
+    
     def get_painting_embedding(self, painting_id: str) -> Optional[List[float]]:
         """
         Get embedding for a specific painting by searching for mongodb_id.
@@ -382,15 +1092,26 @@ class ChromaService:
         Returns:
             Embedding vector or None if not found
         """
+        snapshot = self._snapshot
+        collection, index = snapshot.collection, snapshot.index
+        painting_id = snapshot.canonical_id(painting_id)
         try:
-            if not self.collection:
+            if index is not None and painting_id in index:
+                return index.get_embedding(painting_id).tolist()
+            
+            # Embeddings never change, so a cached copy saves a (possibly remote) lookup
+            cached = self.embedding_cache.get(painting_id)
+            if cached is not None:
+                return cached.tolist()
+            
+            if not collection:
                 logger.error("Collection not initialized")
                 return None
             
             # Use get method to retrieve painting by ID directly
             # First try to get by direct ID (if the painting was stored with this ID)
             try:
-                results = self.collection.get(
+                results = collection.get(
                     ids=[painting_id],
                     include=['embeddings']
                 )
@@ -401,16 +1122,13 @@ class ChromaService:
                     results['embeddings'][0] is not None):
                     # ChromaDB returns numpy arrays, convert to list
                     embedding = results['embeddings'][0]  # First embedding
-                    if hasattr(embedding, 'tolist'):
-                        return embedding.tolist()
-                    else:
-                        return list(embedding)
+                    return self.embedding_cache.put(painting_id, embedding).tolist()
             except Exception:
                 # If direct ID lookup fails, try metadata search
                 pass
             
             # Fallback: use where clause without query_texts to avoid embedding generation
-            results = self.collection.get(
+            results = collection.get(
                 where={"mongodb_id": painting_id},
                 include=['embeddings']
             )
@@ -421,10 +1139,7 @@ class ChromaService:
                 results['embeddings'][0] is not None):
                 # ChromaDB returns numpy arrays, convert to list
                 embedding = results['embeddings'][0]  # First embedding
-                if hasattr(embedding, 'tolist'):
-                    return embedding.tolist()
-                else:
-                    return list(embedding)
+                return self.embedding_cache.put(painting_id, embedding).tolist()
             
             logger.warning(f"Painting with mongodb_id {painting_id} not found in collection")
             return None
@@ -433,34 +1148,88 @@ class ChromaService:
             logger.error(f"Failed to get painting embedding for mongodb_id {painting_id}: {e}")
             return None
     
+    def _get_embeddings(self, painting_ids: List[str], trace: Optional[Trace] = None) -> List:
+        """
+        Get embeddings for several paintings, skipping ones that are not found.
+        
+        Args:
+            painting_ids: List of painting IDs, in the order wanted
+            trace: Optional request trace for stage timings and counts
+            
+        Returns:
+            List of embedding vectors in input order
+        """
+        trace = trace or Trace()
+        snapshot = self._snapshot
+        collection, index = snapshot.collection, snapshot.index
+        if snapshot.aliases:
+            # Likes recorded against a collapsed duplicate use the kept painting's embedding
+            painting_ids = [snapshot.canonical_id(pid) for pid in painting_ids]
+        with trace.stage('embedding_fetch'):
+            trace.count('ids_fetched', len(painting_ids))
+            if index is not None and all(pid in index for pid in painting_ids):
+                trace.count('index_hits', len(painting_ids))
+                return list(index.get_embeddings(painting_ids))
+            
+            # Serve what we can locally, then fetch the rest in one batched get
+            found = {}
+            if index is not None:
+                found.update((pid, index.get_embedding(pid)) for pid in painting_ids if pid in index)
+            found.update(self.embedding_cache.get_many([pid for pid in painting_ids if pid not in found]))
+            missing = [pid for pid in dict.fromkeys(painting_ids) if pid not in found]
+            trace.count('remote_fetches', len(missing))
+            
+            if missing and collection:
+                try:
+                    results = collection.get(ids=missing, include=['embeddings'])
+                    if results and results.get('embeddings') is not None:
+                        for pid, embedding in zip(results['ids'], results['embeddings']):
+                            if embedding is not None:
+                                found[pid] = self.embedding_cache.put(pid, embedding)
+                except Exception as e:
+                    logger.warning(f"Batched embedding lookup failed, falling back to per-id: {e}")
+            
+            embeddings = []
+            for painting_id in painting_ids:
+                embedding = found.get(painting_id)
+                if embedding is None:
+                    # Not stored under its own ID; try the mongodb_id metadata lookup
+                    embedding = self.get_painting_embedding(painting_id)
+                    if embedding:
+                        found[painting_id] = embedding
+                if embedding is not None and len(embedding) > 0:
+                    embeddings.append(embedding)
+            return embeddings
+    
     def aggregate_user_preferences(self, liked_painting_ids: List[str], 
-                                 method: str = "centroid") -> Optional[List[float]]:
+                                 method: str = "centroid",
+                                 trace: Optional[Trace] = None) -> Optional[List[float]]:
         """
         Aggregate user preferences from liked paintings.
         
         Args:
             liked_painting_ids: List of painting IDs the user has liked
             method: Aggregation method ("centroid", "weighted_average", "recent_focus")
+            trace: Optional request trace for stage timings and counts
             
         Returns:
             Aggregated preference vector or None if failed
         """
+        trace = trace or Trace()
         try:
             if not liked_painting_ids:
                 logger.warning("No liked paintings provided for aggregation")
                 return None
             
             # Get embeddings for liked paintings
-            embeddings = []
-            for painting_id in liked_painting_ids:
-                embedding = self.get_painting_embedding(painting_id)
-                if embedding:
-                    embeddings.append(embedding)
+            embeddings = self._get_embeddings(liked_painting_ids, trace)
             
             if not embeddings:
                 logger.warning("No valid embeddings found for liked paintings")
                 return None
             
+            aggregate_start = time.perf_counter()
+            
             # Convert to numpy for easier computation
             embeddings_array = np.array(embeddings)
             
@@ -497,6 +1266,8 @@ class ChromaService:
             if norm > 0:
                 user_preference = user_preference / norm
             
+            trace.add_time('aggregate', (time.perf_counter() - aggregate_start) * 1000)
+            
             logger.info(f"Aggregated user preferences from {len(embeddings)} paintings using {method}")
             return user_preference.tolist()
             
@@ -505,8 +1276,10 @@ class ChromaService:
             return None
     
     def get_recommendations_for_user(self, liked_painting_ids: List[str], 
-                                   exclude_ids: Optional[List[str]] = None,
-                                   k: int = 10, aggregation_method: str = "centroid") -> List[Dict]:
+                                   exclude_ids: Optional[Collection[str]] = None,
+                                   k: int = 10, aggregation_method: str = "centroid",
+                                   deadline: Optional[Deadline] = None,
+                                   trace: Optional[Trace] = None) -> List[Dict]:
         """
         One-shot method to get recommendations for a user based on their liked paintings.
         
@@ -515,44 +1288,99 @@ class ChromaService:
             exclude_ids: List of painting IDs to exclude (viewed paintings)
             k: Number of recommendations to return
             aggregation_method: Method to aggregate user preferences ("centroid" or "weighted_average")
+            deadline: Optional request deadline, checked between stages
+            trace: Optional request trace for stage timings and counts
             
         Returns:
             List of recommended paintings with similarity scores
+            
+        Raises:
+            DeadlineExceeded: If the deadline passes between stages
         """
+        deadline = deadline or Deadline()
         try:
             if not liked_painting_ids:
                 logger.warning("No liked paintings provided for recommendations")
                 return []
             
             # Aggregate user preferences from liked paintings
-            user_preference = self.aggregate_user_preferences(liked_painting_ids, aggregation_method)
+            deadline.check('aggregate')
+            user_preference = self.aggregate_user_preferences(liked_painting_ids, aggregation_method, trace)
             
             if not user_preference:
                 logger.warning("Could not aggregate user preferences")
                 return []
             
             # Combine liked paintings with exclude list to avoid recommending already liked paintings
-            all_exclude_ids = set(liked_painting_ids)
-            if exclude_ids:
-                all_exclude_ids.update(exclude_ids)
+            all_exclude_ids = merge_exclusions(liked_painting_ids, exclude_ids)
             
             # Get similar paintings
+            deadline.check('search')
             recommendations = self.get_similar_paintings(
                 user_preference, 
                 k=k, 
-                exclude_ids=list(all_exclude_ids)
+                exclude_ids=all_exclude_ids,
+                trace=trace
             )
             
+            if self.colike is not None and self.colike_weight > 0:
+                recommendations = self._blend_colike(recommendations, liked_painting_ids, all_exclude_ids,
+                                                     user_preference, k, trace)
+            
             logger.info(f"Generated {len(recommendations)} recommendations for user with {len(liked_painting_ids)} liked paintings")
             return recommendations
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Failed to get recommendations for user: {e}")
             return []
     
+    def _blend_colike(self, recommendations: List[Dict], liked_painting_ids: List[str],
+                      exclude_ids: Collection[str], user_preference: List[float], k: int,
+                      trace: Optional[Trace] = None) -> List[Dict]:
+        # Give every stride-th position to a co-liked painting, up to the co-like share of the
+        # list, so they're spread through it; then top up from whichever source has results
+        trace = trace or Trace()
+        with trace.stage('colike_candidates'):
+            collaborative = self.get_colike_candidates(liked_painting_ids, k, exclude_ids, user_preference)
+        slots = min(len(collaborative), int(round(k * self.colike_weight)))
+        if trace.enabled:
+            trace.count('colike_candidates', len(collaborative))
+        
+        stride = max(1, int(round(1 / self.colike_weight)))
+        
+        blended = []
+        seen = set()
+        content = iter(recommendations)
+        colike = iter(collaborative)
+        
+        def take(paintings) -> Optional[Dict]:
+            for painting in paintings:
+                group = self.canonical_id(painting['_id'])
+                if group not in seen:
+                    seen.add(group)
+                    return painting
+            return None
+        
+        used = 0
+        while len(blended) < k:
+            colike_slot = used < slots and (len(blended) + 1) % stride == 0
+            painting = take(colike) if colike_slot else take(content)
+            if painting is not None and colike_slot:
+                used += 1
+            elif painting is None:
+                painting = take(content) if colike_slot else take(colike)
+                if painting is None:
+                    break
+            blended.append(painting)
+        return blended
+    
     def get_diverse_recommendations(self, liked_painting_ids: List[str],
-                                  exclude_ids: Optional[List[str]] = None,
-                                  k: int = 10, diversity_factor: float = 0.3) -> List[Dict]:
+                                  exclude_ids: Optional[Collection[str]] = None,
+                                  k: int = 10, diversity_factor: float = 0.3,
+                                  deadline: Optional[Deadline] = None,
+                                  trace: Optional[Trace] = None) -> List[Dict]:
         """
         Get diverse recommendations by clustering user preferences and sampling from different clusters.
         
@@ -561,9 +1389,14 @@ class ChromaService:
             exclude_ids: List of painting IDs to exclude
             k: Number of recommendations to return
             diversity_factor: Factor controlling diversity (0.0 = most similar, 1.0 = most diverse)
+            deadline: Optional request deadline, checked between stages
+            trace: Optional request trace for stage timings and counts
             
         Returns:
             List of diverse recommended paintings
+            
+        Raises:
+            DeadlineExceeded: If the deadline passes between stages
         """
         try:
             if not liked_painting_ids:
@@ -571,30 +1404,28 @@ class ChromaService:
             
             if len(liked_painting_ids) < 3:
                 # Not enough data for clustering, use regular recommendations
-                return self.get_recommendations_for_user(liked_painting_ids, exclude_ids, k)
+                return self.get_recommendations_for_user(liked_painting_ids, exclude_ids, k,
+                                                     deadline=deadline, trace=trace)
             
             # Get embeddings for liked paintings
-            liked_embeddings = []
-            for painting_id in liked_painting_ids:
-                embedding = self.get_painting_embedding(painting_id)
-                if embedding:
-                    liked_embeddings.append(embedding)
+            liked_embeddings = self._get_embeddings(liked_painting_ids, trace)
             
             if len(liked_embeddings) < 2:
-                return self.get_recommendations_for_user(liked_painting_ids, exclude_ids, k)
+                return self.get_recommendations_for_user(liked_painting_ids, exclude_ids, k,
+                                                     deadline=deadline, trace=trace)
             
             # Simple diversity approach: get recommendations from different preference vectors
             recommendations = []
             
             # Method 1: Centroid of all likes
             centroid_recs = self.get_recommendations_for_user(
-                liked_painting_ids, exclude_ids, k//2, "centroid"
+                liked_painting_ids, exclude_ids, k//2, "centroid", deadline=deadline, trace=trace
             )
             recommendations.extend(centroid_recs)
             
             # Method 2: Weighted average (recent likes)
             weighted_recs = self.get_recommendations_for_user(
-                liked_painting_ids, exclude_ids, k//2, "weighted_average"
+                liked_painting_ids, exclude_ids, k//2, "weighted_average", deadline=deadline, trace=trace
             )
             
             # Add weighted recommendations that aren't already in the list
@@ -610,9 +1441,38 @@ class ChromaService:
             logger.info(f"Generated {len(recommendations)} diverse recommendations")
             return recommendations[:k]
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Failed to get diverse recommendations: {e}")
-            return self.get_recommendations_for_user(liked_painting_ids, exclude_ids, k)
+            return self.get_recommendations_for_user(liked_painting_ids, exclude_ids, k,
+                                                     deadline=deadline, trace=trace)
+    
+    def get_memory_usage(self) -> Dict:
+        """
+        Estimate the memory held by this service, per component.
+        
+        The HNSW graph lives inside chromadb, so its size is estimated from
+        the painting count and ``max_neighbors`` (hnswlib stores each vector
+        plus two links per neighbour on the base layer); it is 0 for remote
+        clients.
+        
+        Returns:
+            Dictionary of component name to bytes
+        """
+        index_bytes = self.index.memory_bytes() if self.index is not None else {}
+        hnsw_bytes = 0
+        if self.remote_policy is None and self.index is not None:
+            max_neighbors = self.get_hnsw_config().get('max_neighbors') or 16
+            hnsw_bytes = len(self.index) * (EMBEDDING_DIM * 4 + max_neighbors * 2 * 4 + 64)
+        return {
+            'index_vectors': index_bytes.get('vectors', 0),
+            'index_ids': index_bytes.get('ids', 0),
+            'index_mapped': index_bytes.get('mapped', 0),
+            'hnsw': hnsw_bytes,
+            'embedding_cache': self.embedding_cache.bytes,
+            'colike_mapped': self.colike.get_stats()['bytes'] if self.colike is not None else 0
+        }
     
     def get_collection_stats(self) -> Dict:
         """
@@ -628,13 +1488,31 @@ class ChromaService:
             # Get collection count
             count = self.collection.count()
             
-            return {
+            stats = {
                 "collection_name": self.collection_name,
                 "total_paintings": count,
                 "persist_directory": self.persist_directory,
                 "status": "healthy" if count > 0 else "empty"
             }
             
+            if self.index is not None:
+                stats["index"] = self.index.get_stats()
+            
+            stats["embedding_cache"] = self.embedding_cache.get_stats()
+            stats["aliases"] = len(self.aliases)
+            if self.colike is not None:
+                stats["colike"] = {**self.colike.get_stats(), "weight": self.colike_weight}
+            if self.remote_policy is not None:
+                stats["remote"] = self.remote_policy.get_stats()
+            
+            if isinstance(self.collection, ShardedCollection):
+                stats["shard_by"] = self.shard_by
+                stats["shard_counts"] = self.collection.shard_counts()
+            
+            stats["hnsw"] = self.get_hnsw_config()
+            
+            return stats
+            
         except Exception as e:
             logger.error(f"Failed to get collection stats: {e}")
             return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Resilient access to a remote ChromaDB (Chroma Cloud or a Chroma server).
+
+Every call on a remote collection is a network round trip. RemotePolicy
+bounds each call with a timeout, retries transient failures with full
+jitter, and can hedge slow queries by sending a second copy after a delay
+and taking whichever answers first. ResilientCollection applies the policy
+to a collection; EmbeddingCache keeps painting embeddings (immutable once
+ingested) locally so aggregations never go remote twice for the same
+painting.
+
+Settings come from the environment:
+    CHROMA_TIMEOUT_S    per-attempt timeout in seconds (default 5)
+    CHROMA_RETRIES      retries after the first attempt (default 2)
+    CHROMA_BACKOFF_MS   base backoff in milliseconds (default 100)
+    CHROMA_HEDGE_MS     hedge queries slower than this (default 0 = off)
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Substrings of error messages worth retrying (rate limiting, gateway errors)
+RETRYABLE_MESSAGES = ('429', '502', '503', '504', 'timed out', 'timeout', 'connection')
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Decide whether a failed remote call is worth retrying.
+
+    Args:
+        error: Exception raised by the call
+
+    Returns:
+        bool: True for timeouts, connection failures and 429/5xx responses
+    """
+    if isinstance(error, (TimeoutError, FutureTimeoutError, ConnectionError)):
+        return True
+    if type(error).__module__.split('.')[0] in ('httpx', 'httpcore', 'urllib3', 'requests'):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RETRYABLE_MESSAGES)
+
+
+class RemotePolicy:
+    """
+    Timeout, retry-with-jitter and hedging for remote calls.
+    """
+
+    def __init__(self, timeout_s: float = 5.0, retries: int = 2, backoff_ms: float = 100.0,
+                 hedge_ms: float = 0.0, max_workers: int = 8):
+        """
+        Args:
+            timeout_s: Per-attempt timeout in seconds
+            retries: Retries after the first attempt
+            backoff_ms: Base backoff; attempt n sleeps up to backoff_ms * 2**n
+            hedge_ms: Send a duplicate of hedgeable calls slower than this (0 = off)
+            max_workers: Threads running remote calls
+        """
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.backoff_ms = backoff_ms
+        self.hedge_ms = hedge_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chroma-remote')
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'retries': 0, 'timeouts': 0, 'failures': 0, 'hedges': 0, 'hedge_wins': 0}
+
+    @classmethod
+    def from_env(cls) -> 'RemotePolicy':
+        """
+        Returns:
+            RemotePolicy configured from CHROMA_* environment variables
+        """
+        return cls(
+            timeout_s=float(os.getenv('CHROMA_TIMEOUT_S', '5')),
+            retries=int(os.getenv('CHROMA_RETRIES', '2')),
+            backoff_ms=float(os.getenv('CHROMA_BACKOFF_MS', '100')),
+            hedge_ms=float(os.getenv('CHROMA_HEDGE_MS', '0'))
+        )
+
+    def apply_transport_timeout(self, client) -> bool:
+        """
+        Give a chromadb HTTP client's connection the policy's timeout.
+
+        chromadb's HTTP clients send requests through an httpx session with
+        no timeout, so a call the policy gives up on would otherwise keep
+        its worker thread blocked on the socket indefinitely; with the same
+        timeout on the transport the abandoned attempt ends too.
+
+        Args:
+            client: chromadb.HttpClient or chromadb.CloudClient
+
+        Returns:
+            bool: True if the timeout was applied
+        """
+        session = getattr(getattr(client, '_server', None), '_session', None)
+        if session is None or not hasattr(session, 'timeout'):
+            logger.warning("Could not set a transport timeout on the Chroma client; "
+                           "timed-out calls may keep running in the background")
+            return False
+        session.timeout = self.timeout_s
+        return True
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _attempt(self, fn: Callable, args, kwargs, hedge: bool):
+        # Remote calls run on pool threads; carry the request's log context along
+        primary = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        if not hedge or self.hedge_ms <= 0:
+            try:
+                return primary.result(timeout=self.timeout_s)
+            except FutureTimeoutError:
+                raise TimeoutError(f"Remote call timed out after {self.timeout_s}s")
+
+        hedge_s = self.hedge_ms / 1000
+        done, _ = wait([primary], timeout=min(hedge_s, self.timeout_s))
+        if done:
+            return primary.result()
+
+        # Primary is slow: race a duplicate against it for the rest of the timeout
+        self._count('hedges')
+        backup = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        pending = {primary, backup}
+        deadline = time.monotonic() + max(0.0, self.timeout_s - hedge_s)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"Remote call timed out after {self.timeout_s}s")
+
+    def call(self, fn: Callable, *args, hedge: bool = False, **kwargs):
+        """
+        Run a remote call under the policy.
+
+        Args:
+            fn: Function to call
+            hedge: Whether the call is idempotent and may be hedged
+            *args, **kwargs: Arguments for ``fn``
+
+        Returns:
+            Result of ``fn``
+
+        Raises:
+            The last error once retries are exhausted or the error is not retryable
+        """
+        self._count('calls')
+        for attempt in range(self.retries + 1):
+            try:
+                return self._attempt(fn, args, kwargs, hedge)
+            except Exception as e:
+                if isinstance(e, (TimeoutError, FutureTimeoutError)):
+                    self._count('timeouts')
+                if attempt >= self.retries or not is_retryable(e):
+                    self._count('failures')
+                    raise
+                self._count('retries')
+                # Full jitter: sleep uniformly up to the exponential backoff
+                sleep_ms = random.uniform(0, self.backoff_ms * (2 ** attempt))
+                logger.warning(f"Remote call {getattr(fn, '__name__', fn)} failed ({e}); "
+                               f"retry {attempt + 1}/{self.retries} in {sleep_ms:.0f}ms")
+                time.sleep(sleep_ms / 1000)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self.stats,
+                'timeout_s': self.timeout_s,
+                'retries_allowed': self.retries,
+                'hedge_ms': self.hedge_ms
+            }
+
+
+class ResilientCollection:
+    """
+    Remote collection whose calls go through a RemotePolicy.
+
+    All calls are retried; reads (query, get) may also be hedged. Writes
+    carry explicit IDs, so repeating one after an ambiguous failure is harmless.
+    """
+
+    def __init__(self, collection, policy: RemotePolicy):
+        """
+        Args:
+            collection: ChromaDB collection to wrap
+            policy: Remote call policy
+        """
+        self._collection = collection
+        self.policy = policy
+
+    @property
+    def name(self) -> str:
+        return self._collection.name
+
+    @property
+    def configuration(self) -> Dict:
+        return self._collection.configuration
+
+    def query(self, **kwargs) -> Dict:
+        return self.policy.call(self._collection.query, hedge=True, **kwargs)
+
+    def get(self, **kwargs) -> Dict:
+        return self.policy.call(self._collection.get, hedge=True, **kwargs)
+
+    def count(self) -> int:
+        return self.policy.call(self._collection.count)
+
+    def add(self, **kwargs):
+        # Adds with explicit IDs are idempotent upserts of the same rows
+        return self.policy.call(self._collection.add, **kwargs)
+
+    def modify(self, **kwargs):
+        return self.policy.call(self._collection.modify, **kwargs)
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache of painting embeddings.
+
+    Embeddings never change once a painting is ingested, so entries never
+    go stale; the cache is bounded only to cap memory.
+    """
+
+    def __init__(self, max_entries: int = 50000):
+        """
+        Args:
+            max_entries: Maximum number of embeddings kept
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, painting_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._entries.get(painting_id)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(painting_id)
+            self.hits += 1
+            return embedding
+
+    def put(self, painting_id: str, embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            replaced = self._entries.pop(painting_id, None)
+            if replaced is not None:
+                self.bytes -= replaced.nbytes
+            self._entries[painting_id] = embedding
+            self.bytes += embedding.nbytes
+            while len(self._entries) > self.max_entries:
+                self.bytes -= self._entries.popitem(last=False)[1].nbytes
+        return embedding
+
+    def get_many(self, painting_ids: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns:
+            Cached embeddings for the given IDs (missing IDs are left out)
+        """
+        found = {}
+        for painting_id in painting_ids:
+            embedding = self.get(painting_id)
+            if embedding is not None:
+                found[painting_id] = embedding
+        return found
+
+    def clear(self) -> int:
+        """
+        Drop all cached embeddings.
+
+        Returns:
+            Bytes of embeddings released
+        """
+        with self._lock:
+            released = self.bytes
+            self._entries.clear()
+            self.bytes = 0
+        return released
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
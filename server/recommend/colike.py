@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Item-item co-like matrix for collaborative candidate generation.
+
+Recommendations otherwise come only from content embeddings. This offline
+job reads an export of the ``likedPaintings`` collection and counts, for
+every pair of paintings, how many users liked both. Counts are normalized
+by popularity (cosine: co-likes / sqrt(likes_a * likes_b)), each row is
+pruned to its top-N neighbours, and the result is stored as a CSR matrix
+in plain .npy files:
+
+    colike_ids.npy       painting IDs, one per row/column
+    colike_indptr.npy    row start offsets (len = rows + 1)
+    colike_indices.npy   neighbour column numbers
+    colike_scores.npy    neighbour scores
+    colike.json          build parameters and counts
+
+The recommendation service memory-maps these files, so collaborative
+candidates cost one row slice per liked painting instead of another
+vector query.
+
+Usage:
+    mongoexport --db=<db> --collection=likedPaintings --out=likes.json
+    python colike.py --likes likes.json --output ./chroma_db/colike --top-n 50
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FILES = ('ids', 'indptr', 'indices', 'scores')
+MANIFEST = 'colike.json'
+
+
+def build_colike(likes: Dict[str, List[str]], top_n: int = 50, min_colikes: int = 2,
+                 max_user_likes: int = 200) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build the pruned co-like matrix in CSR form.
+
+    Args:
+        likes: Map of user ID to liked painting IDs, most recent first
+        top_n: Neighbours kept per painting
+        min_colikes: Minimum number of users liking both paintings of a pair
+        max_user_likes: Most recent likes per user counted (bounds the
+            quadratic pair count for very active users)
+
+    Returns:
+        Tuple of (painting IDs, indptr, indices, scores)
+    """
+    row_of = {}
+    histories = []
+    for painting_ids in likes.values():
+        rows = []
+        for painting_id in list(dict.fromkeys(painting_ids))[:max_user_likes]:
+            if painting_id not in row_of:
+                row_of[painting_id] = len(row_of)
+            rows.append(row_of[painting_id])
+        if rows:
+            histories.append(rows)
+
+    ids = list(row_of)
+    popularity = np.zeros(len(ids), dtype=np.float64)
+    colikes = defaultdict(lambda: defaultdict(int))
+    for rows in histories:
+        popularity[rows] += 1
+        for i, a in enumerate(rows):
+            for b in rows[i + 1:]:
+                colikes[a][b] += 1
+                colikes[b][a] += 1
+
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    indices = []
+    scores = []
+    for row in range(len(ids)):
+        neighbours = [(col, count) for col, count in colikes.get(row, {}).items() if count >= min_colikes]
+        kept = 0
+        if neighbours:
+            cols = np.fromiter((col for col, _ in neighbours), dtype=np.int64, count=len(neighbours))
+            counts = np.fromiter((count for _, count in neighbours), dtype=np.float64, count=len(neighbours))
+            row_scores = counts / np.sqrt(popularity[row] * popularity[cols])
+            if len(cols) > top_n:
+                keep = np.argpartition(-row_scores, top_n)[:top_n]
+                cols, row_scores = cols[keep], row_scores[keep]
+            order = np.argsort(-row_scores, kind='stable')
+            indices.append(cols[order].astype(np.int32))
+            scores.append(row_scores[order].astype(np.float32))
+            kept = len(order)
+        indptr[row + 1] = indptr[row] + kept
+
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+    scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+    return ids, indptr, indices, scores
+
+
+def save_colike(directory: str, ids: List[str], indptr: np.ndarray, indices: np.ndarray,
+                scores: np.ndarray, **info):
+    """
+    Write a co-like matrix to ``directory``.
+
+    Args:
+        directory: Output directory
+        ids, indptr, indices, scores: Matrix from ``build_colike``
+        **info: Extra fields recorded in the manifest
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {'ids': np.array(ids, dtype=str), 'indptr': indptr, 'indices': indices, 'scores': scores}
+    for name in FILES:
+        tmp_path = os.path.join(directory, f'colike_{name}.npy.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, arrays[name])
+        os.replace(tmp_path, os.path.join(directory, f'colike_{name}.npy'))
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump({'paintings': len(ids), 'entries': int(len(indices)), 'built_at': time.time(), **info},
+                  f, indent=2)
+
+
+class CoLikeMatrix:
+    """
+    Read-only, memory-mapped co-like matrix.
+    """
+
+    def __init__(self, ids: List[str], indptr: np.ndarray, indices: np.ndarray, scores: np.ndarray,
+                 info: Optional[Dict] = None):
+        self.ids = ids
+        self.row_of = {painting_id: row for row, painting_id in enumerate(ids)}
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self.info = info or {}
+
+    @classmethod
+    def load(cls, directory: str) -> Optional['CoLikeMatrix']:
+        """
+        Open a matrix written by ``save_colike``.
+
+        Args:
+            directory: Directory holding the colike_*.npy files
+
+        Returns:
+            CoLikeMatrix, or None if the directory has no matrix
+        """
+        if not os.path.exists(os.path.join(directory, MANIFEST)):
+            return None
+        with open(os.path.join(directory, MANIFEST)) as f:
+            info = json.load(f)
+        ids = np.load(os.path.join(directory, 'colike_ids.npy')).tolist()
+        arrays = {name: np.load(os.path.join(directory, f'colike_{name}.npy'), mmap_mode='r')
+                  for name in FILES[1:]}
+        return cls(ids, arrays['indptr'], arrays['indices'], arrays['scores'], info)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def neighbours(self, painting_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            Tuple of (neighbour row numbers, scores) for one painting, best first
+        """
+        row = self.row_of.get(painting_id)
+        if row is None:
+            return self.indices[:0], self.scores[:0]
+        start, end = int(self.indptr[row]), int(self.indptr[row + 1])
+        return self.indices[start:end], self.scores[start:end]
+
+    def candidates(self, liked_painting_ids: List[str], k: int,
+                   exclude: Optional[Callable[[str], bool]] = None,
+                   recency_decay: float = 0.9) -> List[Tuple[str, float]]:
+        """
+        Score paintings co-liked with a user's likes.
+
+        Args:
+            liked_painting_ids: User's likes, most recent first
+            k: Number of candidates wanted
+            exclude: Predicate on painting ID; matching candidates are skipped
+            recency_decay: Weight multiplier per step back in the like history
+
+        Returns:
+            List of (painting ID, score), best first
+        """
+        totals = defaultdict(float)
+        weight = 1.0
+        for painting_id in liked_painting_ids:
+            cols, scores = self.neighbours(painting_id)
+            for col, score in zip(cols.tolist(), scores.tolist()):
+                totals[col] += weight * score
+            weight *= recency_decay
+
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for col, score in ranked:
+            painting_id = self.ids[col]
+            if exclude is not None and exclude(painting_id):
+                continue
+            results.append((painting_id, score))
+            if len(results) >= k:
+                break
+        return results
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.info,
+            'paintings': len(self.ids),
+            'entries': int(len(self.indices)),
+            'bytes': int(self.indptr.nbytes + self.indices.nbytes + self.scores.nbytes)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the co-like matrix from a likedPaintings export")
+    parser.add_argument('--likes', required=True, help='mongoexport of the likedPaintings collection')
+    parser.add_argument('--output', default='./chroma_db/colike', help='Output directory')
+    parser.add_argument('--top-n', type=int, default=50, help='Neighbours kept per painting')
+    parser.add_argument('--min-colikes', type=int, default=2, help='Minimum users liking both paintings')
+    parser.add_argument('--max-user-likes', type=int, default=200, help='Most recent likes counted per user')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Imported here: evaluate imports chroma_service, which imports this module
+    from evaluate import load_likes
+
+    start_time = time.time()
+    likes = load_likes(args.likes)
+    ids, indptr, indices, scores = build_colike(likes, top_n=args.top_n, min_colikes=args.min_colikes,
+                                                max_user_likes=args.max_user_likes)
+    save_colike(args.output, ids, indptr, indices, scores, users=len(likes), top_n=args.top_n,
+                min_colikes=args.min_colikes)
+    logger.info(f"Built co-like matrix for {len(ids)} paintings from {len(likes)} users: "
+                f"{len(indices)} entries in {time.time() - start_time:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
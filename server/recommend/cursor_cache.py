@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Cursor cache for paginated recommendation results.
+
+A recommend or diverse request with ``paginate`` set ranks a pool of
+candidates once; the first page is returned immediately and the rest is
+kept here under an opaque cursor with a TTL, so "next page" requests are a
+slice of a cached list instead of another aggregation and vector query.
+"""
+
+import time
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CursorCache:
+    """
+    TTL- and size-bounded map from cursor token to a ranked candidate list.
+    """
+
+    def __init__(self, ttl_seconds: float = 600.0, max_cursors: int = 10000):
+        """
+        Args:
+            ttl_seconds: Seconds a cursor stays valid after its last use
+            max_cursors: Maximum number of cursors kept in memory
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_cursors = max_cursors
+        self._cursors = OrderedDict()  # cursor -> entry dict
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self, now: float):
+        # Entries are kept in last-used order, so expired ones are at the front
+        while self._cursors:
+            entry = next(iter(self._cursors.values()))
+            if entry['expires_at'] > now and len(self._cursors) <= self.max_cursors:
+                break
+            self._cursors.popitem(last=False)
+
+    def create(self, items: List[Dict], metadata: Optional[Dict] = None,
+               owner: Optional[str] = None) -> Optional[str]:
+        """
+        Store a ranked candidate list and return a cursor to it.
+
+        Args:
+            items: Remaining ranked recommendations, in page order
+            metadata: Extra fields returned with every page (source, user_id, ...)
+            owner: User ID the cursor belongs to; only that user can page it
+
+        Returns:
+            Cursor token, or None if there is nothing left to page through
+        """
+        if not items:
+            return None
+
+        cursor = secrets.token_urlsafe(12)
+        now = time.time()
+        with self._lock:
+            self._cursors[cursor] = {
+                'items': items,
+                'offset': 0,
+                'metadata': metadata or {},
+                'owner': owner,
+                'expires_at': now + self.ttl_seconds
+            }
+            self._expire(now)
+        return cursor
+
+    def next_page(self, cursor: str, count: int, seen=None,
+                  user_id: Optional[str] = None) -> Tuple[Optional[List[Dict]], Optional[Dict], bool]:
+        """
+        Take the next page from a cursor.
+
+        Args:
+            cursor: Cursor token returned by ``create``
+            count: Number of recommendations to return
+            seen: Optional container of painting IDs to skip
+            user_id: User requesting the page; must match the cursor's owner
+
+        Returns:
+            Tuple of (page, metadata, has_more); page is None if the cursor
+            is unknown, expired or owned by another user
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._cursors.get(cursor)
+            # Another user's cursor looks the same as an unknown one
+            if entry is None or entry.get('owner') != user_id:
+                self.misses += 1
+                return None, None, False
+
+            items = entry['items']
+            offset = entry['offset']
+            page = []
+            while offset < len(items) and len(page) < count:
+                rec = items[offset]
+                offset += 1
+                if seen is None or rec['_id'] not in seen:
+                    page.append(rec)
+
+            entry['offset'] = offset
+            has_more = offset < len(items)
+            if has_more:
+                entry['expires_at'] = now + self.ttl_seconds
+                self._cursors.move_to_end(cursor)
+            else:
+                del self._cursors[cursor]
+
+            self.hits += 1
+            return page, entry['metadata'], has_more
+
+    def export(self) -> Dict:
+        """
+        Export live cursors for a snapshot.
+
+        Returns:
+            Dictionary of cursor token to remaining items and metadata
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            return {
+                cursor: {
+                    'items': entry['items'][entry['offset']:],
+                    'metadata': entry['metadata'],
+                    'owner': entry.get('owner'),
+                    'expires_at': entry['expires_at']
+                }
+                for cursor, entry in self._cursors.items()
+            }
+
+    def restore(self, exported: Dict) -> int:
+        """
+        Load cursors from a snapshot made by ``export``; expired ones are dropped.
+
+        Args:
+            exported: Exported cursors
+
+        Returns:
+            Number of cursors restored
+        """
+        now = time.time()
+        with self._lock:
+            for cursor, entry in exported.items():
+                if entry['expires_at'] > now:
+                    self._cursors[cursor] = {
+                        'items': entry['items'],
+                        'offset': 0,
+                        'metadata': entry['metadata'],
+                        'owner': entry.get('owner'),
+                        'expires_at': entry['expires_at']
+                    }
+            self._expire(now)
+            return len(self._cursors)
+
+    def clear(self):
+        """
+        Drop all cursors.
+        """
+        with self._lock:
+            self._cursors.clear()
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about the cursor cache.
+
+        Returns:
+            Dictionary with cursor cache statistics
+        """
+        with self._lock:
+            return {
+                'cursors': len(self._cursors),
+                'items': sum(len(entry['items']) for entry in self._cursors.values()),
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses
+            }
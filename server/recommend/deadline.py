@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Request deadlines for the recommendation service.
+
+Node.js stops waiting for a response after a fixed timeout. Requests carry
+that cut-off as an absolute ``deadline_ms`` (Unix epoch milliseconds) so the
+service can skip requests nobody is waiting for and abandon in-progress work
+at stage boundaries.
+"""
+
+import time
+from typing import Optional, Dict
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised at a stage boundary when the request's deadline has passed.
+    """
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Absolute point in time after which a request's result is useless.
+    """
+
+    def __init__(self, deadline_ms: Optional[float] = None):
+        """
+        Args:
+            deadline_ms: Deadline as Unix epoch milliseconds, or None for no deadline
+        """
+        self.deadline_ms = deadline_ms
+
+    @classmethod
+    def from_request(cls, request: Dict) -> 'Deadline':
+        """
+        Read the deadline from a request.
+
+        Args:
+            request: Decoded request, optionally containing ``deadline_ms``
+
+        Returns:
+            Deadline for the request
+        """
+        deadline_ms = request.get('deadline_ms')
+        return cls(float(deadline_ms) if deadline_ms is not None else None)
+
+    def remaining_ms(self) -> Optional[float]:
+        """
+        Returns:
+            Milliseconds left (negative once expired), or None without a deadline
+        """
+        if self.deadline_ms is None:
+            return None
+        return self.deadline_ms - time.time() * 1000
+
+    def expired(self) -> bool:
+        """
+        Returns:
+            bool: True if the deadline has passed
+        """
+        remaining = self.remaining_ms()
+        return remaining is not None and remaining <= 0
+
+    def check(self, stage: str):
+        """
+        Abort the request if its deadline has passed.
+
+        Args:
+            stage: Name of the stage about to start, reported in the error
+
+        Raises:
+            DeadlineExceeded: If the deadline has passed
+        """
+        if self.expired():
+            raise DeadlineExceeded(stage)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for painting embeddings.
+
+Scraped catalogs contain the same painting several times under slightly
+different titles (and so different artist_title IDs). This module finds
+groups of near-identical embeddings with random-hyperplane LSH, verifies
+candidate pairs with an exact cosine check, and collapses each group to one
+canonical painting plus an alias map from the dropped IDs to it.
+
+Run on the output of generate_embeddings.py:
+    python dedupe.py embeddings.json --output embeddings.json --aliases aliases.json
+"""
+
+import json
+import logging
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class UnionFind:
+    """
+    Disjoint sets over row numbers, with path halving.
+    """
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, row: int) -> int:
+        while self.parent[row] != row:
+            self.parent[row] = self.parent[self.parent[row]]
+            row = self.parent[row]
+        return row
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Keep the lower row as root so the first-seen painting stays canonical
+            if root_b < root_a:
+                root_a, root_b = root_b, root_a
+            self.parent[root_b] = root_a
+
+
+def _link_similar(unit: np.ndarray, rows: np.ndarray, threshold: float, uf: UnionFind,
+                  block_size: int = 2048):
+    # Blocked exact comparison, so a crowded bucket never needs a full n x n matrix
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        for other_start in range(start, len(rows), block_size):
+            other = rows[other_start:other_start + block_size]
+            left, right = np.nonzero(unit[block] @ unit[other].T >= threshold)
+            for i, j in zip(left.tolist(), right.tolist()):
+                if other_start + j > start + i:
+                    uf.union(int(block[i]), int(other[j]))
+
+
+def find_near_duplicates(vectors: np.ndarray, threshold: float = 0.97, num_bits: int = 16,
+                         num_tables: int = 8, seed: int = 0) -> List[List[int]]:
+    """
+    Find groups of rows whose embeddings are near-identical.
+
+    Each of ``num_tables`` hash tables buckets rows by the signs of
+    ``num_bits`` random projections; rows sharing a bucket in any table are
+    compared exactly, bucket by bucket, with blocked matrix products.
+
+    Args:
+        vectors: Embedding matrix, one row per painting
+        threshold: Minimum cosine similarity for two rows to be duplicates
+        num_bits: Hyperplanes per table (more bits = smaller buckets)
+        num_tables: Independent hash tables (more tables = higher recall)
+        seed: Random seed for the hyperplanes
+
+    Returns:
+        Groups of two or more row numbers, each sorted ascending
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) < 2:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+
+    rng = np.random.default_rng(seed)
+    weights = 1 << np.arange(num_bits, dtype=np.int64)
+    uf = UnionFind(len(unit))
+
+    for _ in range(num_tables):
+        planes = rng.standard_normal((unit.shape[1], num_bits)).astype(np.float32)
+        keys = ((unit @ planes) > 0).astype(np.int64) @ weights
+
+        buckets = defaultdict(list)
+        for row, key in enumerate(keys.tolist()):
+            buckets[key].append(row)
+
+        for rows in buckets.values():
+            if len(rows) < 2:
+                continue
+            _link_similar(unit, np.asarray(rows), threshold, uf)
+
+    groups = defaultdict(list)
+    for row in range(len(unit)):
+        groups[uf.find(row)].append(row)
+    return [rows for rows in groups.values() if len(rows) > 1]
+
+
+def collapse(ids: List[str], vectors: np.ndarray, threshold: float = 0.97,
+             **lsh_options) -> Tuple[List[int], Dict[str, str], Dict]:
+    """
+    Collapse near-duplicate groups to their first-seen member.
+
+    Args:
+        ids: Painting IDs, one per row of ``vectors``
+        vectors: Embedding matrix
+        threshold: Minimum cosine similarity for duplicates
+        **lsh_options: Passed to ``find_near_duplicates``
+
+    Returns:
+        Tuple of (rows to keep, alias map of dropped ID -> canonical ID, report)
+    """
+    groups = find_near_duplicates(vectors, threshold=threshold, **lsh_options)
+
+    aliases = {}
+    for rows in groups:
+        canonical = ids[rows[0]]
+        for row in rows[1:]:
+            aliases[ids[row]] = canonical
+
+    keep = [row for row, painting_id in enumerate(ids) if painting_id not in aliases]
+    bytes_per_row = int(np.asarray(vectors[:1], dtype=np.float32).nbytes) if len(ids) else 0
+    report = {
+        'paintings': len(ids),
+        'groups': len(groups),
+        'largest_group': max((len(rows) for rows in groups), default=0),
+        'removed': len(aliases),
+        'kept': len(keep),
+        'vector_bytes_saved': len(aliases) * bytes_per_row,
+        'threshold': threshold
+    }
+    return keep, aliases, report
+
+
+def dedupe_paintings(paintings: List[Dict], threshold: float = 0.97,
+                     embedding_key: str = 'openai_embedding') -> Tuple[List[Dict], Dict[str, str], Dict]:
+    """
+    Ingest stage: drop near-duplicate paintings from an embeddings list.
+
+    Each kept painting lists the IDs collapsed into it under ``aliases``.
+
+    Args:
+        paintings: Painting dictionaries with an ``id`` and an embedding
+        threshold: Minimum cosine similarity for duplicates
+        embedding_key: Key holding the embedding
+
+    Returns:
+        Tuple of (kept paintings, alias map, report)
+    """
+    ids = [str(painting['id']) for painting in paintings]
+    # An empty list still goes through collapse, so the report always has every field
+    vectors = np.asarray([painting[embedding_key] for painting in paintings], dtype=np.float32)
+    keep, aliases, report = collapse(ids, vectors, threshold=threshold)
+
+    members = defaultdict(list)
+    for alias, canonical in aliases.items():
+        members[canonical].append(alias)
+
+    kept = []
+    for row in keep:
+        painting = paintings[row]
+        if ids[row] in members:
+            painting = {**painting, 'aliases': members[ids[row]]}
+        kept.append(painting)
+
+    # Size of the JSON embeddings that no longer need storing or loading
+    row_of = {painting_id: row for row, painting_id in enumerate(ids)}
+    report['embedding_json_bytes_saved'] = sum(
+        len(json.dumps(paintings[row_of[alias]][embedding_key])) for alias in aliases
+    )
+    logger.info(f"Near-duplicate removal: {report}")
+    return kept, aliases, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collapse near-duplicate paintings in an embeddings file")
+    parser.add_argument('input', help='Embeddings JSON written by generate_embeddings.py')
+    parser.add_argument('--output', help='Deduplicated embeddings JSON (defaults to the input file)')
+    parser.add_argument('--aliases', default='aliases.json', help='Alias map output (dropped ID -> canonical ID)')
+    parser.add_argument('--threshold', type=float, default=0.97, help='Cosine similarity threshold')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the report')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.input) as f:
+        paintings = json.load(f)
+
+    kept, aliases, report = dedupe_paintings(paintings, threshold=args.threshold)
+    print(json.dumps(report, indent=2))
+    if args.dry_run:
+        return
+
+    with open(args.output or args.input, 'w') as f:
+        json.dump(kept, f, indent=2)
+    with open(args.aliases, 'w') as f:
+        json.dump(aliases, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of aggregation methods and HNSW settings.
+
+Replays an export of the ``likedPaintings`` collection: for every user the
+most recent likes are held out, the rest are aggregated with each
+aggregation method, and the held-out likes are looked for in the top-k
+results. Each method is scored against a grid of HNSW settings
+(M / max_neighbors, ef_construction, ef_search) plus exact search, measuring
+hit-rate@k, NDCG@k and query latency together.
+
+The grid collections are copies of the catalog in a separate local
+PersistentClient, so the production collection is untouched unless
+``--apply`` is given. The winner (best NDCG within the optional p95 latency
+budget) is written to ``--config-out`` and, with ``--apply``, applied to the
+production collection via ChromaService.apply_hnsw_config.
+
+Usage:
+    mongoexport --db=<db> --collection=likedPaintings --out=likes.json
+    python evaluate.py --likes likes.json --chroma-dir ./chroma_db \\
+        --m 16,32 --ef-construction 100,200 --ef-search 10,50,100 --max-p95-ms 20
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import itertools
+from collections import defaultdict
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+
+from chroma_service import ChromaService, HNSW_BUILD_PARAMS
+from painting_index import PaintingIndex
+
+logger = logging.getLogger('evaluate')
+
+METHODS = ['centroid', 'weighted_average', 'recent_focus']
+
+
+def _oid(value) -> Optional[str]:
+    # mongoexport writes ObjectIds as {"$oid": "..."} (extended JSON)
+    if isinstance(value, dict):
+        value = value.get('$oid', value.get('$numberLong'))
+    return str(value) if value is not None else None
+
+
+def _timestamp(value) -> float:
+    if isinstance(value, dict):
+        value = value.get('$numberLong', value.get('$date', 0))
+        if isinstance(value, dict):
+            value = value.get('$numberLong', 0)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def load_likes(path: str) -> Dict[str, List[str]]:
+    """
+    Load a likedPaintings export (JSON array or one document per line).
+
+    Args:
+        path: Export file written by mongoexport
+
+    Returns:
+        Map of user ID to liked painting IDs, most recent first
+    """
+    with open(path) as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        documents = json.loads(text)
+    else:
+        documents = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    likes = defaultdict(list)
+    for document in documents:
+        painting_id = _oid(document.get('originalArtworkId'))
+        user_id = document.get('userId')
+        if painting_id and user_id:
+            likes[user_id].append((_timestamp(document.get('likedTimestamp')), painting_id))
+
+    # Most recent first, matching the order the service weights likes in
+    return {
+        user_id: list(dict.fromkeys(pid for _, pid in sorted(entries, reverse=True)))
+        for user_id, entries in likes.items()
+    }
+
+
+def split_holdout(likes: Dict[str, List[str]], index: PaintingIndex, holdout: int,
+                  min_history: int) -> List[Dict]:
+    """
+    Hold out each user's most recent likes.
+
+    Args:
+        likes: Map of user ID to liked painting IDs, most recent first
+        index: Catalog index; likes of unknown paintings are dropped
+        holdout: Number of most recent likes to hold out
+        min_history: Minimum number of remaining likes for a user to be used
+
+    Returns:
+        List of dictionaries with ``user_id``, ``history`` and ``held_out``
+    """
+    cases = []
+    for user_id, painting_ids in likes.items():
+        painting_ids = [pid for pid in painting_ids if pid in index]
+        if len(painting_ids) < holdout + min_history:
+            continue
+        cases.append({
+            'user_id': user_id,
+            'held_out': painting_ids[:holdout],
+            'history': painting_ids[holdout:]
+        })
+    return cases
+
+
+def ranking_metrics(returned_ids: List[str], held_out: List[str], k: int) -> Tuple[float, float]:
+    """
+    Args:
+        returned_ids: Ranked recommendation IDs
+        held_out: Held-out liked painting IDs
+        k: Cut-off
+
+    Returns:
+        Tuple of (hit@k as 0/1, NDCG@k)
+    """
+    relevant = set(held_out)
+    gains = [1.0 / np.log2(rank + 2) for rank, pid in enumerate(returned_ids[:k]) if pid in relevant]
+    ideal = sum(1.0 / np.log2(rank + 2) for rank in range(min(len(relevant), k)))
+    return (1.0 if gains else 0.0), (sum(gains) / ideal if ideal else 0.0)
+
+
+def exact_search(index: PaintingIndex, query: List[float], k: int, exclude: set) -> List[str]:
+    scores = index.vectors @ np.asarray(query, dtype=np.float32)
+    top = np.argpartition(-scores, min(k + len(exclude), len(scores) - 1))[:k + len(exclude)]
+    ranked = top[np.argsort(-scores[top])]
+    return [index.ids[row] for row in ranked if index.ids[row] not in exclude][:k]
+
+
+def build_grid_collection(eval_service: ChromaService, index: PaintingIndex, m: int,
+                          ef_construction: int, batch_size: int = 5000) -> Tuple[str, Optional[float]]:
+    """
+    Copy the catalog into a collection built with the given HNSW settings.
+
+    Args:
+        eval_service: ChromaService on the evaluation PersistentClient
+        index: Catalog to copy
+        m: HNSW max_neighbors (M)
+        ef_construction: HNSW ef_construction
+        batch_size: Rows added per call
+
+    Returns:
+        Tuple of (collection name, build seconds or None if reused)
+    """
+    name = f"eval_m{m}_efc{ef_construction}"
+    try:
+        collection = eval_service.client.get_collection(name=name)
+        if collection.count() == len(index):
+            return name, None
+        eval_service.client.delete_collection(name)
+    except Exception:
+        pass
+
+    start_time = time.time()
+    eval_service.create_collection({'max_neighbors': m, 'ef_construction': ef_construction}, name=name)
+    for start in range(0, len(index), batch_size):
+        ids = index.ids[start:start + batch_size]
+        eval_service.collection.add(
+            ids=ids,
+            embeddings=index.vectors[start:start + batch_size],
+            metadatas=[{'mongodb_id': pid} for pid in ids]
+        )
+    return name, time.time() - start_time
+
+
+def score(search, cases: List[Dict], queries: Dict[str, List], k: int) -> Dict:
+    """
+    Run every case through a search function and aggregate the metrics.
+
+    Args:
+        search: Function (query, k, exclude) -> ranked painting IDs
+        cases: Held-out cases
+        queries: Precomputed query vector per user ID
+        k: Cut-off
+
+    Returns:
+        Dictionary with hit-rate, NDCG and latency percentiles
+    """
+    hits, ndcgs, latencies = [], [], []
+    for case in cases:
+        query = queries.get(case['user_id'])
+        if query is None:
+            continue
+        start = time.perf_counter()
+        returned = search(query, k, set(case['history']))
+        latencies.append((time.perf_counter() - start) * 1000)
+        hit, ndcg = ranking_metrics(returned, case['held_out'], k)
+        hits.append(hit)
+        ndcgs.append(ndcg)
+
+    if not latencies:
+        return {'users': 0}
+    return {
+        'users': len(latencies),
+        f'hit_rate_at_{k}': round(float(np.mean(hits)), 4),
+        f'ndcg_at_{k}': round(float(np.mean(ndcgs)), 4),
+        'latency_p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'latency_p95_ms': round(float(np.percentile(latencies, 95)), 3)
+    }
+
+
+def pick_winner(rows: List[Dict], k: int, max_p95_ms: Optional[float]) -> Optional[Dict]:
+    """
+    Best NDCG@k among HNSW configurations within the latency budget,
+    breaking ties by lower p95 latency.
+    """
+    candidates = [row for row in rows if row['hnsw'] is not None and row.get('users')]
+    if max_p95_ms is not None:
+        candidates = [row for row in candidates if row['latency_p95_ms'] <= max_p95_ms]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda row: (row[f'ndcg_at_{k}'], -row['latency_p95_ms']))
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline recommendation evaluation")
+    parser.add_argument('--likes', required=True, help='likedPaintings export (mongoexport JSON)')
+    parser.add_argument('--chroma-dir', default='./chroma_db', help='ChromaDB data directory of the catalog')
+    parser.add_argument('--work-dir', default='./eval_data', help='Directory for grid collections')
+    parser.add_argument('--methods', default=','.join(METHODS), help='Aggregation methods to score')
+    parser.add_argument('--m', default='16,32', help='HNSW max_neighbors (M) values')
+    parser.add_argument('--ef-construction', default='100,200', help='HNSW ef_construction values')
+    parser.add_argument('--ef-search', default='10,50,100,200', help='HNSW ef_search values')
+    parser.add_argument('--k', type=int, default=10, help='Recommendation list length')
+    parser.add_argument('--holdout', type=int, default=1, help='Most recent likes held out per user')
+    parser.add_argument('--min-history', type=int, default=2, help='Minimum remaining likes per user')
+    parser.add_argument('--max-p95-ms', type=float, help='Latency budget for picking the winner')
+    parser.add_argument('--output', default='eval_results.json', help='Full results JSON')
+    parser.add_argument('--config-out', default='hnsw_config.json', help='Winning HNSW config JSON')
+    parser.add_argument('--apply', action='store_true',
+                       help='Apply the winning HNSW config to the production collection')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('chroma_service').setLevel(logging.WARNING)
+
+    catalog = ChromaService(persist_directory=args.chroma_dir)
+    if not catalog.load_index():
+        raise SystemExit(f"Could not load the catalog from {args.chroma_dir}")
+    index = catalog.index
+
+    cases = split_holdout(load_likes(args.likes), index, args.holdout, args.min_history)
+    logger.info(f"Evaluating {len(cases)} users against {len(index)} paintings")
+    if not cases:
+        raise SystemExit("No users with enough likes of catalog paintings")
+
+    # Grid collections live in their own local client so production data is untouched
+    api_key = os.environ.pop('CHROMA_API_KEY', None)
+    try:
+        eval_service = ChromaService(collection_name='eval', persist_directory=args.work_dir)
+    finally:
+        if api_key is not None:
+            os.environ['CHROMA_API_KEY'] = api_key
+    eval_service.index = index
+
+    methods = [method for method in args.methods.split(',') if method]
+    queries = {
+        method: {case['user_id']: eval_service.aggregate_user_preferences(case['history'], method)
+                 for case in cases}
+        for method in methods
+    }
+
+    rows = []
+    for method in methods:
+        result = score(lambda q, k, exclude: exact_search(index, q, k, exclude), cases, queries[method], args.k)
+        rows.append({'method': method, 'hnsw': None, **result})
+        logger.info(f"{method} exact: {result}")
+
+    for m, ef_construction in itertools.product(_int_list(args.m), _int_list(args.ef_construction)):
+        name, build_s = build_grid_collection(eval_service, index, m, ef_construction)
+        eval_service.collection = eval_service.client.get_collection(name=name)
+
+        for ef_search in _int_list(args.ef_search):
+            eval_service.collection.modify(configuration={'hnsw': {'ef_search': ef_search}})
+            hnsw = {'max_neighbors': m, 'ef_construction': ef_construction, 'ef_search': ef_search}
+
+            def search(query, k, exclude):
+                return [rec['_id'] for rec in eval_service.get_similar_paintings(query, k, exclude_ids=exclude)]
+
+            for method in methods:
+                result = score(search, cases, queries[method], args.k)
+                rows.append({'method': method, 'hnsw': hnsw,
+                             'build_s': round(build_s, 1) if build_s else None, **result})
+                logger.info(f"{method} {hnsw}: {result}")
+
+    print(f"\n{'method':<18} {'M':>4} {'efC':>5} {'efS':>5} {'hit@k':>7} {'ndcg@k':>7} {'p50ms':>8} {'p95ms':>8}")
+    for row in rows:
+        hnsw = row['hnsw'] or {}
+        print(f"{row['method']:<18} {hnsw.get('max_neighbors', 'exact'):>4} "
+              f"{hnsw.get('ef_construction', '-'):>5} {hnsw.get('ef_search', '-'):>5} "
+              f"{row.get(f'hit_rate_at_{args.k}', 0):>7.4f} {row.get(f'ndcg_at_{args.k}', 0):>7.4f} "
+              f"{row.get('latency_p50_ms', 0):>8.3f} {row.get('latency_p95_ms', 0):>8.3f}")
+
+    winner = pick_winner(rows, args.k, args.max_p95_ms)
+    with open(args.output, 'w') as f:
+        json.dump({'args': vars(args), 'users': len(cases), 'results': rows, 'winner': winner}, f, indent=2)
+
+    if winner is None:
+        print("\nNo HNSW configuration met the latency budget")
+        return
+
+    print(f"\nWinner: {winner['method']} with {winner['hnsw']}")
+    with open(args.config_out, 'w') as f:
+        json.dump({'aggregation_method': winner['method'], 'hnsw': winner['hnsw']}, f, indent=2)
+
+    if args.apply:
+        rebuild = any(catalog.get_hnsw_config().get(key) != value
+                      for key, value in winner['hnsw'].items() if key in HNSW_BUILD_PARAMS)
+        logger.info(f"Applying {winner['hnsw']} to '{catalog.collection_name}'"
+                    f"{' (rebuild)' if rebuild else ''}")
+        if not catalog.apply_hnsw_config(winner['hnsw']):
+            raise SystemExit("Failed to apply the HNSW configuration")
+        print("Applied; send SIGHUP to the recommendation service to reload")
+        if catalog.previous_collection_name:
+            print(f"The old collection is kept as '{catalog.previous_collection_name}' for services "
+                  f"that haven't reloaded yet; delete it once they all have")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import time
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from dedupe import dedupe_paintings
+
 # It's a good practice to load environment variables from a .env file
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -26,10 +28,13 @@ def create_description(painting_info, artist_name):
     genre = painting_info.get("Genre", "Unknown Genre")
     return f'"{title}" by {artist_name}. Style: {movements}. Genre: {genre}.'
 
-def process_paintings(input_path, output_path):
+def process_paintings(input_path, output_path, dedupe_threshold=0.97):
     """
     Processes paintings from the input JSON file, generates embeddings,
-    and saves them to the output file.
+    collapses near-duplicates and saves them to the output file.
+
+    The alias map of dropped duplicate IDs is written next to the output
+    as <name>_aliases.json. Pass dedupe_threshold=None to keep duplicates.
     """
     try:
         with open(input_path, 'r') as f:
@@ -67,6 +72,13 @@ def process_paintings(input_path, output_path):
             # OpenAI API has rate limits, a small delay can help avoid them
             time.sleep(0.1) 
 
+    if dedupe_threshold is not None:
+        all_embeddings, aliases, report = dedupe_paintings(all_embeddings, threshold=dedupe_threshold)
+        print(f"Near-duplicates: removed {report['removed']} of {report['paintings']} paintings "
+              f"({report['groups']} groups, {report['vector_bytes_saved'] / 1e6:.1f} MB of vectors saved)")
+        with open(os.path.splitext(output_path)[0] + '_aliases.json', 'w') as f:
+            json.dump(aliases, f, indent=2)
+
     with open(output_path, 'w') as f:
         json.dump(all_embeddings, f, indent=2)
 
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Memory budget for the recommendation service.
+
+On a small instance (a t3.micro has 1 GiB) the vector matrix, chromadb's
+HNSW graph, the caches and per-user state compete for the same memory, and
+running out means the kernel kills the process and Node.js restarts it
+cold. This module watches RSS against a configured budget, reports what
+each component holds, and when RSS crosses the high-water mark applies
+relief steps in order, cheapest first, until it is back under:
+
+    caches     drop the embedding cache, prefetch queues and cursor pools
+    quantize   switch the in-memory index to float16 vectors (half the size)
+    mmap       move the index vectors to a memory-mapped file on disk
+
+Each step reports whether it freed anything, so steps that no longer
+apply (caches already empty, index already quantized) are skipped and the
+next one is tried. A step runs at most once per pressure episode: while
+RSS stays over the mark, later checks move on to the next step instead of
+clearing the caches again as they refill. The episode ends once RSS is
+back under the mark. With no budget configured the monitor only reports.
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import get_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudget:
+    """
+    Watches RSS against a budget and applies relief steps when it is exceeded.
+    """
+
+    def __init__(self, limit_bytes: int, usage_fn: Callable[[], Dict[str, int]],
+                 steps: List[Tuple[str, Callable[[], bool]]], high_water: float = 0.9,
+                 interval: float = 10.0):
+        """
+        Args:
+            limit_bytes: Memory budget in bytes (0 to only report usage)
+            usage_fn: Function returning estimated bytes per component;
+                components named ``*_mapped`` are file-backed and not counted
+                against the budget
+            steps: Ordered (name, function) relief steps; each function
+                returns True if it released memory
+            high_water: Fraction of the budget at which relief starts
+            interval: Seconds between checks
+        """
+        self.limit_bytes = limit_bytes
+        self.usage_fn = usage_fn
+        self.steps = steps
+        self.high_water = high_water
+        self.interval = interval
+        self.rss_bytes = None
+        self.pressure_events = 0
+        self.actions = {name: 0 for name, _ in steps}
+        self.last_pressure = None
+        self._episode_steps = set()  # steps applied since RSS went over the mark
+        self._check_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def threshold_bytes(self) -> Optional[int]:
+        return int(self.limit_bytes * self.high_water) if self.limit_bytes else None
+
+    def check(self) -> List[str]:
+        """
+        Measure RSS and apply relief steps while it is over the high-water mark.
+
+        Returns:
+            Names of the steps applied (empty if under budget)
+        """
+        with self._check_lock:
+            self.rss_bytes = rss_before = get_rss_bytes()
+            threshold = self.threshold_bytes
+            if threshold is None or rss_before < threshold:
+                self._episode_steps.clear()
+                return []
+
+            applied = []
+            for name, step in self.steps:
+                if name in self._episode_steps:
+                    continue
+                try:
+                    if not step():
+                        continue
+                except Exception as e:
+                    logger.error(f"Memory relief step {name} failed: {e}")
+                    continue
+                applied.append(name)
+                self._episode_steps.add(name)
+                self.actions[name] += 1
+                self.rss_bytes = get_rss_bytes()
+                if self.rss_bytes < threshold:
+                    break
+
+            self.pressure_events += 1
+            self.last_pressure = {
+                'at': time.time(),
+                'rss_before': rss_before,
+                'rss_after': self.rss_bytes,
+                'actions': applied
+            }
+            if self.rss_bytes >= threshold:
+                logger.warning(f"Memory still over budget after {applied or 'no relief'}: "
+                               f"RSS {self.rss_bytes / 2**20:.0f} MiB, budget {self.limit_bytes / 2**20:.0f} MiB")
+            else:
+                logger.warning(f"Memory over budget ({rss_before / 2**20:.0f} MiB), applied {applied}: "
+                               f"RSS now {self.rss_bytes / 2**20:.0f} MiB")
+            return applied
+
+    def _loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Memory check failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """
+        Start checking in the background.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='memory-budget', daemon=True)
+            self._thread.start()
+
+    def get_stats(self) -> Dict:
+        """
+        Get the budget, current RSS and per-component usage.
+
+        Returns:
+            Dictionary with memory statistics
+        """
+        try:
+            components = self.usage_fn()
+        except Exception as e:
+            logger.error(f"Failed to measure memory components: {e}")
+            components = {}
+        rss = get_rss_bytes()
+        return {
+            'limit_bytes': self.limit_bytes or None,
+            'threshold_bytes': self.threshold_bytes,
+            'rss_bytes': rss,
+            'utilization': round(rss / self.limit_bytes, 4) if self.limit_bytes else None,
+            'components': components,
+            'accounted_bytes': sum(size for name, size in components.items() if not name.endswith('_mapped')),
+            'pressure_events': self.pressure_events,
+            'actions': dict(self.actions),
+            'episode_steps': [name for name, _ in self.steps if name in self._episode_steps],
+            'last_pressure': self.last_pressure
+        }
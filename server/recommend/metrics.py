@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+In-process metrics for the recommendation service.
+
+Counts requests and errors per action, keeps latency histograms with
+p50/p95/p99 estimates, and collects counters (deadline drops, overload
+rejections) and gauges (queue depth, cache hit rates, RSS) from callbacks. A snapshot is cheap to build, so the ``stats`` action
+can return it on every call; it can also be rendered in Prometheus text
+exposition format.
+"""
+
+import os
+import time
+import bisect
+import logging
+import resource
+import threading
+from typing import Callable, Collection, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Latency bucket upper bounds in milliseconds (roughly x2 apart)
+DEFAULT_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+def get_rss_bytes() -> int:
+    """
+    Get the resident set size of this process.
+
+    Returns:
+        Current RSS in bytes on Linux, peak RSS elsewhere
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is KiB on Linux and bytes on macOS; only reached off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+    """
+
+    def __init__(self, buckets_ms: Optional[List[float]] = None):
+        self.buckets_ms = list(buckets_ms or DEFAULT_BUCKETS_MS)
+        self.counts = [0] * (len(self.buckets_ms) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, value_ms: float):
+        self.counts[bisect.bisect_left(self.buckets_ms, value_ms)] += 1
+        self.count += 1
+        self.sum_ms += value_ms
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Estimate a percentile by linear interpolation within its bucket.
+
+        Args:
+            q: Quantile between 0 and 1
+
+        Returns:
+            Estimated value in milliseconds, or None if nothing was observed
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count > 0:
+                lower = self.buckets_ms[i - 1] if i > 0 else 0.0
+                upper = self.buckets_ms[i] if i < len(self.buckets_ms) else self.buckets_ms[-1]
+                return round(lower + (upper - lower) * (rank - seen) / bucket_count, 2)
+            seen += bucket_count
+        return float(self.buckets_ms[-1])
+
+    def snapshot(self) -> Dict:
+        return {
+            'count': self.count,
+            'mean_ms': round(self.sum_ms / self.count, 2) if self.count else None,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99)
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of per-action counters, latency histograms, counters and gauges.
+    """
+
+    def __init__(self, prefix: str = 'recommendation', actions: Optional[Collection[str]] = None):
+        """
+        Args:
+            prefix: Prefix for Prometheus metric names
+            actions: Known request actions; others are recorded as "other" so
+                client-supplied names can't add label values (all kept if None)
+        """
+        self.prefix = prefix
+        self.actions = frozenset(actions) if actions is not None else None
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._requests = {}   # action -> count
+        self._errors = {}     # action -> count
+        self._latency = {}    # action -> Histogram
+        self._counters = {}   # name -> callback returning a monotonically increasing count
+        self._gauges = {}     # name -> callback returning a number
+
+    def observe_request(self, action: str, duration_ms: float, error: bool = False):
+        """
+        Record one handled request.
+
+        Args:
+            action: Request action
+            duration_ms: Time from dequeue to response, in milliseconds
+            error: Whether the response was an error
+        """
+        if self.actions is not None and action not in self.actions:
+            action = 'other'
+        with self._lock:
+            self._requests[action] = self._requests.get(action, 0) + 1
+            if error:
+                self._errors[action] = self._errors.get(action, 0) + 1
+            histogram = self._latency.get(action)
+            if histogram is None:
+                histogram = self._latency[action] = Histogram()
+            histogram.observe(duration_ms)
+
+    def register_counter(self, name: str, callback: Callable[[], int]):
+        """
+        Register a counter read from a callback at snapshot time.
+
+        Args:
+            name: Counter name (snake_case, exported with a ``_total`` suffix)
+            callback: Function returning the current count
+        """
+        with self._lock:
+            self._counters[name] = callback
+
+    def register_gauge(self, name: str, callback: Callable[[], Optional[float]]):
+        """
+        Register a gauge read from a callback at snapshot time.
+
+        Args:
+            name: Gauge name (snake_case)
+            callback: Function returning the current value
+        """
+        with self._lock:
+            self._gauges[name] = callback
+
+    def _read_callbacks(self, callbacks: Dict) -> Dict:
+        values = {}
+        for name, callback in list(callbacks.items()):
+            try:
+                values[name] = callback()
+            except Exception as e:
+                logger.debug(f"Metric {name} failed: {e}")
+                values[name] = None
+        return values
+
+    def snapshot(self) -> Dict:
+        """
+        Build a snapshot of all metrics.
+
+        Returns:
+            Dictionary with per-action counts and latency, plus counters and gauges
+        """
+        with self._lock:
+            actions = {
+                action: {
+                    'requests': count,
+                    'errors': self._errors.get(action, 0),
+                    'latency': self._latency[action].snapshot()
+                }
+                for action, count in self._requests.items()
+            }
+        return {
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'rss_bytes': get_rss_bytes(),
+            'actions': actions,
+            'counters': self._read_callbacks(self._counters),
+            'gauges': self._read_callbacks(self._gauges)
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Render all metrics in Prometheus text exposition format.
+
+        Returns:
+            Exposition text
+        """
+        p = self.prefix
+        lines = [
+            f'# TYPE {p}_requests_total counter',
+        ]
+        with self._lock:
+            for action, count in sorted(self._requests.items()):
+                lines.append(f'{p}_requests_total{{action="{action}"}} {count}')
+            lines.append(f'# TYPE {p}_errors_total counter')
+            for action, count in sorted(self._errors.items()):
+                lines.append(f'{p}_errors_total{{action="{action}"}} {count}')
+            lines.append(f'# TYPE {p}_request_duration_ms histogram')
+            for action, histogram in sorted(self._latency.items()):
+                cumulative = 0
+                for upper, bucket_count in zip(histogram.buckets_ms, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{p}_request_duration_ms_bucket{{action="{action}",le="{upper}"}} {cumulative}')
+                lines.append(f'{p}_request_duration_ms_bucket{{action="{action}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{p}_request_duration_ms_sum{{action="{action}"}} {round(histogram.sum_ms, 3)}')
+                lines.append(f'{p}_request_duration_ms_count{{action="{action}"}} {histogram.count}')
+
+        lines.append(f'# TYPE {p}_rss_bytes gauge')
+        lines.append(f'{p}_rss_bytes {get_rss_bytes()}')
+        for name, value in sorted(self._read_callbacks(self._counters).items()):
+            if value is None:
+                continue
+            lines.append(f'# TYPE {p}_{name}_total counter')
+            lines.append(f'{p}_{name}_total {int(value)}')
+        for name, value in sorted(self._read_callbacks(self._gauges).items()):
+            if value is None:
+                continue
+            lines.append(f'# TYPE {p}_{name} gauge')
+            lines.append(f'{p}_{name} {float(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class HealthMonitor:
+    """
+    Runs a health check on a background thread and caches the result.
+    """
+
+    def __init__(self, check_fn: Callable[[], Dict], interval: float = 30.0):
+        """
+        Args:
+            check_fn: Function returning a dictionary with at least ``healthy``
+            interval: Seconds between checks
+        """
+        self.check_fn = check_fn
+        self.interval = interval
+        self.last_result = {'healthy': None}
+        self.last_checked = None
+        self._thread = None
+
+    def refresh(self):
+        """
+        Run the health check now and cache the result.
+        """
+        try:
+            self.last_result = self.check_fn()
+        except Exception as e:
+            logger.error(f"Health check failed: {e}")
+            self.last_result = {'healthy': False, 'error': str(e)}
+        self.last_checked = time.time()
+
+    def _loop(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def start(self):
+        """
+        Start refreshing in the background.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='health-monitor', daemon=True)
+            self._thread.start()
+
+    def get_status(self) -> Dict:
+        """
+        Returns:
+            Cached health result and its age in seconds
+        """
+        status = dict(self.last_result)
+        status['age_s'] = round(time.time() - self.last_checked, 1) if self.last_checked else None
+        return status
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+In-memory painting index.
+
+Holds the painting ids and embedding matrix of a ChromaDB collection so
+embedding lookups and preference aggregation are served from memory instead
+of per-id collection queries. An index is built once and then treated as
+read-only, which lets the recommendation service load a new one in the
+background and swap it in atomically.
+
+Live ingest publishes a new index with rows appended (``extended``)
+instead of changing the published one. Existing rows keep their numbers,
+and the vector buffer is over-allocated and shared between versions: new
+rows are written past the end of the older versions' views, so only
+growth beyond the buffer's capacity copies the matrix.
+
+Under memory pressure an index can be swapped for a cheaper copy of
+itself: float16 vectors (half the memory) or vectors memory-mapped from
+disk, whose pages the kernel can drop instead of OOM-killing the process.
+Lookups always return float32.
+"""
+
+import os
+import sys
+import copy
+import time
+import logging
+import threading
+from typing import List, Dict, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 1536
+
+
+class _VectorBuffer:
+    """
+    Over-allocated vector storage shared by successive index versions.
+
+    Rows below ``used`` belong to published indexes and are never written
+    again; only the index that ends at ``used`` may append in place.
+    """
+
+    def __init__(self, array: np.ndarray, used: int):
+        self.array = array
+        self.used = used
+        self.lock = threading.Lock()
+
+
+class PaintingIndex:
+    """
+    Read-only snapshot of painting ids and their embeddings.
+
+    Rows of ``vectors`` line up with ``ids``; ``id_to_row`` maps a painting
+    id to its dense row number.
+    """
+
+    def __init__(self, ids: List[str], vectors: np.ndarray):
+        """
+        Build an index from parallel id and vector arrays.
+
+        Args:
+            ids: Painting IDs, one per row of ``vectors``
+            vectors: Embedding matrix of shape (len(ids), EMBEDDING_DIM)
+        """
+        self.ids = list(ids)
+        self.id_to_row = {painting_id: row for row, painting_id in enumerate(self.ids)}
+        self.vectors = vectors
+        self.loaded_at = time.time()
+        self._ids_bytes = None
+        self._buffer = _VectorBuffer(vectors, len(vectors))
+
+    @classmethod
+    def from_collection(cls, collection, batch_size: int = 1000) -> 'PaintingIndex':
+        """
+        Load every painting id and embedding from a ChromaDB collection.
+
+        Args:
+            collection: ChromaDB collection to read from
+            batch_size: Number of rows fetched per ``collection.get`` call
+
+        Returns:
+            PaintingIndex with all paintings in the collection
+        """
+        start_time = time.time()
+        ids = []
+        chunks = []
+        offset = 0
+
+        while True:
+            results = collection.get(
+                include=['embeddings'],
+                limit=batch_size,
+                offset=offset
+            )
+            batch_ids = results.get('ids') or []
+            if not batch_ids:
+                break
+
+            ids.extend(batch_ids)
+            chunks.append(np.asarray(results['embeddings'], dtype=np.float32))
+            offset += len(batch_ids)
+
+            if len(batch_ids) < batch_size:
+                break
+
+        if chunks:
+            vectors = np.vstack(chunks)
+        else:
+            vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+        index = cls(ids, vectors)
+        logger.info(f"Loaded {len(index)} paintings into memory in {time.time() - start_time:.2f}s")
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, painting_id: str) -> bool:
+        return painting_id in self.id_to_row
+
+    def get_embedding(self, painting_id: str) -> Optional[np.ndarray]:
+        """
+        Get the embedding for a painting.
+
+        Args:
+            painting_id: ID of the painting
+
+        Returns:
+            Embedding row or None if the painting is not indexed
+        """
+        row = self.id_to_row.get(painting_id)
+        if row is None:
+            return None
+        return np.asarray(self.vectors[row], dtype=np.float32)
+
+    def get_embeddings(self, painting_ids: List[str]) -> np.ndarray:
+        """
+        Get embeddings for several paintings, skipping unknown ids.
+
+        Args:
+            painting_ids: IDs of the paintings, in the order wanted
+
+        Returns:
+            Matrix with one row per known painting, in input order
+        """
+        rows = [self.id_to_row[pid] for pid in painting_ids if pid in self.id_to_row]
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+    def _with_vectors(self, vectors: np.ndarray) -> 'PaintingIndex':
+        # Shares ids and id_to_row; only the vector matrix is replaced
+        index = copy.copy(self)
+        index.vectors = vectors
+        index._buffer = _VectorBuffer(vectors, len(vectors))
+        return index
+
+    def extended(self, ids: List[str], vectors: np.ndarray) -> 'PaintingIndex':
+        """
+        Copy of this index with paintings appended (copy-on-write).
+
+        This index is left unchanged, so readers holding it are unaffected.
+        IDs already in the index are skipped.
+
+        Args:
+            ids: Painting IDs to append
+            vectors: Their embeddings, one row per ID
+
+        Returns:
+            New PaintingIndex (this one if nothing was new)
+        """
+        new_rows = []
+        seen = set()
+        for row, painting_id in enumerate(ids):
+            if painting_id not in self.id_to_row and painting_id not in seen:
+                seen.add(painting_id)
+                new_rows.append(row)
+        if not new_rows:
+            return self
+
+        count, added = len(self.ids), len(new_rows)
+        with self._buffer.lock:
+            buffer = self._buffer
+            # Append in place only at the tip of a writable buffer with room left
+            in_place = (buffer.used == count and len(buffer.array) >= count + added and
+                        not isinstance(buffer.array, np.memmap))
+            if in_place:
+                buffer.used = count + added
+        if not in_place:
+            capacity = max(count + added, count + count // 4)
+            array = np.empty((capacity, self.vectors.shape[1]), dtype=self.vectors.dtype)
+            array[:count] = self.vectors
+            buffer = _VectorBuffer(array, count + added)
+        buffer.array[count:count + added] = np.asarray(vectors)[new_rows]
+
+        index = copy.copy(self)
+        index.ids = self.ids + [ids[row] for row in new_rows]
+        index.id_to_row = dict(self.id_to_row)
+        index.id_to_row.update((painting_id, row) for row, painting_id in enumerate(index.ids[count:], count))
+        index.vectors = buffer.array[:count + added]
+        index._buffer = buffer
+        index._ids_bytes = None
+        index.loaded_at = time.time()
+        return index
+
+    @property
+    def mapped(self) -> bool:
+        return isinstance(self.vectors, np.memmap)
+
+    def quantized(self, batch_size: int = 10000) -> 'PaintingIndex':
+        """
+        Copy of this index with float16 vectors.
+
+        Args:
+            batch_size: Rows converted at a time
+
+        Returns:
+            New PaintingIndex sharing this one's ids
+        """
+        vectors = np.empty(self.vectors.shape, dtype=np.float16)
+        for start in range(0, len(vectors), batch_size):
+            vectors[start:start + batch_size] = self.vectors[start:start + batch_size]
+        return self._with_vectors(vectors)
+
+    def spilled(self, path: str, batch_size: int = 10000) -> 'PaintingIndex':
+        """
+        Copy of this index with its vectors memory-mapped from ``path``.
+
+        Keeps the current dtype; the file is replaced atomically, so an index
+        already mapping an older copy keeps working.
+
+        Args:
+            path: .npy file to write the vectors to
+            batch_size: Rows copied at a time
+
+        Returns:
+            New PaintingIndex sharing this one's ids
+        """
+        tmp_path = f'{path}.tmp'
+        vectors = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.vectors.dtype,
+                                            shape=self.vectors.shape)
+        for start in range(0, len(vectors), batch_size):
+            vectors[start:start + batch_size] = self.vectors[start:start + batch_size]
+        vectors.flush()
+        del vectors
+        os.replace(tmp_path, path)
+        return self._with_vectors(np.load(path, mmap_mode='r'))
+
+    def memory_bytes(self) -> Dict:
+        """
+        Estimate the memory held by this index.
+
+        Returns:
+            Dictionary with heap bytes for vectors and ids, and bytes of
+            vectors mapped from disk (resident only while paged in)
+        """
+        if self._ids_bytes is None:
+            # ids never change, so the (linear) estimate is computed once
+            self._ids_bytes = (sys.getsizeof(self.ids) + sys.getsizeof(self.id_to_row) +
+                               sum(sys.getsizeof(painting_id) for painting_id in self.ids))
+        # Heap vectors are counted with the buffer's spare capacity
+        vector_bytes = int(self.vectors.nbytes if self.mapped else self._buffer.array.nbytes)
+        return {
+            'vectors': 0 if self.mapped else vector_bytes,
+            'ids': self._ids_bytes,
+            'mapped': vector_bytes if self.mapped else 0
+        }
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about the in-memory index.
+
+        Returns:
+            Dictionary with index statistics
+        """
+        return {
+            'total_paintings': len(self.ids),
+            'vector_bytes': int(self.vectors.nbytes),
+            'dtype': str(self.vectors.dtype),
+            'mapped': self.mapped,
+            'loaded_at': self.loaded_at
+        }
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Per-user prefetched recommendation queues.
+
+Keeps a short ranked queue of upcoming recommendations for each user so a
+swipe only pops the next painting instead of running a full aggregation and
+vector query. Queues are refilled in the background when they run low and
+are rebuilt when the user's liked paintings change.
+"""
+
+import time
+import zlib
+import contextvars
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+
+from chroma_service import ExclusionUnion
+
+logger = logging.getLogger(__name__)
+
+
+class _UserQueue:
+    """
+    Queued recommendations for one user and the likes they were built from.
+    """
+
+    def __init__(self, signature: int):
+        self.signature = signature
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.refill_pending = False
+
+
+class PrefetchQueues:
+    """
+    LRU-bounded map from user ID to a queue of upcoming recommendations.
+    """
+
+    def __init__(self, fill_fn: Callable[[List[str], Collection[str], int], List[Dict]],
+                 depth: int = 20, low_water: int = 5, max_users: int = 10000,
+                 max_workers: int = 1):
+        """
+        Args:
+            fill_fn: Function (liked_ids, exclude_ids, k) -> ranked recommendations
+            depth: Number of recommendations kept queued per user
+            low_water: Queue length at which a background refill starts
+            max_users: Maximum number of user queues kept in memory
+            max_workers: Number of background refill threads
+        """
+        self.fill_fn = fill_fn
+        self.depth = depth
+        self.low_water = low_water
+        self.max_users = max_users
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+
+    @staticmethod
+    def signature(liked_painting_ids: List[str]) -> int:
+        """
+        Fingerprint a liked-paintings list so queue staleness is a single compare.
+
+        Stable across processes (unlike ``hash``), so restored queues still match.
+
+        Args:
+            liked_painting_ids: List of painting IDs the user has liked
+
+        Returns:
+            Hash of the list
+        """
+        return zlib.crc32('\x1f'.join(liked_painting_ids).encode('utf-8'))
+
+    def _get_queue(self, user_id: str, signature: int) -> _UserQueue:
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None or queue.signature != signature:
+                # New user or the likes changed: start a fresh queue
+                queue = _UserQueue(signature)
+                self._queues[user_id] = queue
+                while len(self._queues) > self.max_users:
+                    self._queues.popitem(last=False)
+            else:
+                self._queues.move_to_end(user_id)
+            return queue
+
+    def _is_current(self, user_id: str, queue: _UserQueue) -> bool:
+        with self._lock:
+            return self._queues.get(user_id) is queue
+
+    def _take(self, queue: _UserQueue, seen: Collection[str], count: int) -> List[Dict]:
+        items = []
+        while queue.items and len(items) < count:
+            rec = queue.items.popleft()
+            if rec['_id'] not in seen:
+                items.append(rec)
+        return items
+
+    def _refill(self, user_id: str, queue: _UserQueue, liked_painting_ids: List[str],
+                seen: Collection[str]):
+        # Caller holds queue.lock
+        missing = self.depth - len(queue.items)
+        if missing <= 0 or not self._is_current(user_id, queue):
+            return
+
+        queued_ids = {rec['_id'] for rec in queue.items}
+        recommendations = self.fill_fn(liked_painting_ids, ExclusionUnion(seen, queued_ids), missing)
+        queue.items.extend(recommendations)
+        self.refills += 1
+
+    def _refill_in_background(self, user_id: str, queue: _UserQueue,
+                              liked_painting_ids: List[str], seen: Collection[str]):
+        try:
+            start_time = time.time()
+            with queue.lock:
+                self._refill(user_id, queue, liked_painting_ids, seen)
+            logger.debug(f"Refilled prefetch queue in {time.time() - start_time:.3f}s")
+        except Exception as e:
+            logger.error(f"Failed to refill prefetch queue: {e}")
+        finally:
+            queue.refill_pending = False
+
+    def pop(self, user_id: str, liked_painting_ids: List[str], seen: Collection[str],
+            count: int = 1) -> Tuple[List[Dict], bool]:
+        """
+        Take the next recommendations for a user.
+
+        Served from the queue when possible; an empty or stale queue is filled
+        synchronously. A background refill is scheduled when the queue runs low.
+
+        Args:
+            user_id: ID of the user
+            liked_painting_ids: List of painting IDs the user has liked
+            seen: Paintings the user has already seen (skipped if queued)
+            count: Number of recommendations to take
+
+        Returns:
+            Tuple of (recommendations, True if served entirely from the queue)
+        """
+        queue = self._get_queue(user_id, self.signature(liked_painting_ids))
+
+        with queue.lock:
+            items = self._take(queue, seen, count)
+            hit = len(items) == count
+            if not hit:
+                self._refill(user_id, queue, liked_painting_ids, seen)
+                items.extend(self._take(queue, seen, count - len(items)))
+
+            refill = len(queue.items) <= self.low_water and not queue.refill_pending
+            if refill:
+                queue.refill_pending = True
+
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        if refill:
+            # Carry the request's log context so the refill's logs are sampled with it
+            self._executor.submit(contextvars.copy_context().run, self._refill_in_background,
+                                  user_id, queue, list(liked_painting_ids), seen)
+
+        return items, hit
+
+    def try_pop(self, user_id: str, liked_painting_ids: List[str], seen: Collection[str],
+                count: int = 1) -> Optional[List[Dict]]:
+        """
+        Take the next recommendations only if the queue can serve them right now.
+
+        Never blocks and never fills synchronously, so it is safe to call on
+        the request reader thread: a missing or stale queue, one being
+        refilled, or one with too few unseen items returns None and leaves
+        the queue as it was.
+
+        Args:
+            user_id: ID of the user
+            liked_painting_ids: List of painting IDs the user has liked
+            seen: Paintings the user has already seen (skipped if queued)
+            count: Number of recommendations to take
+
+        Returns:
+            List of recommendations, or None if the request needs a worker
+        """
+        signature = self.signature(liked_painting_ids)
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is None or queue.signature != signature:
+                return None
+            self._queues.move_to_end(user_id)
+
+        if not queue.lock.acquire(blocking=False):
+            return None
+        try:
+            items = self._take(queue, seen, count)
+            if len(items) < count:
+                queue.items.extendleft(reversed(items))
+                return None
+            refill = len(queue.items) <= self.low_water and not queue.refill_pending
+            if refill:
+                queue.refill_pending = True
+        finally:
+            queue.lock.release()
+
+        self.hits += 1
+        if refill:
+            self._executor.submit(contextvars.copy_context().run, self._refill_in_background,
+                                  user_id, queue, list(liked_painting_ids), seen)
+        return items
+
+    def export(self) -> Dict:
+        """
+        Export queued recommendations for a snapshot.
+
+        Returns:
+            Dictionary of user ID to queue signature and items, least recent first
+        """
+        with self._lock:
+            queues = list(self._queues.items())
+        exported = {}
+        for user_id, queue in queues:
+            with queue.lock:
+                if queue.items:
+                    exported[user_id] = {'signature': queue.signature, 'items': list(queue.items)}
+        return exported
+
+    def restore(self, exported: Dict) -> int:
+        """
+        Load queues from a snapshot made by ``export``.
+
+        Args:
+            exported: Exported queues
+
+        Returns:
+            Number of user queues restored
+        """
+        with self._lock:
+            for user_id, entry in exported.items():
+                queue = _UserQueue(entry['signature'])
+                queue.items.extend(entry['items'])
+                self._queues[user_id] = queue
+            while len(self._queues) > self.max_users:
+                self._queues.popitem(last=False)
+            return len(self._queues)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """
+        Drop queued recommendations.
+
+        Args:
+            user_id: User whose queue to drop, or None to drop all queues
+        """
+        with self._lock:
+            if user_id is None:
+                self._queues.clear()
+            else:
+                self._queues.pop(user_id, None)
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about the prefetch queues.
+
+        Returns:
+            Dictionary with queue statistics
+        """
+        with self._lock:
+            queued = sum(len(queue.items) for queue in self._queues.values())
+            users = len(self._queues)
+        return {
+            'users': users,
+            'queued_recommendations': queued,
+            'depth': self.depth,
+            'hits': self.hits,
+            'misses': self.misses,
+            'refills': self.refills
+        }
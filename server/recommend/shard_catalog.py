@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Split the single paintings collection into shard collections.
+
+Reads every painting from the existing collection and writes it to
+``<name>_shard00`` .. ``<name>_shardNN`` by hash of ID or by art movement.
+Start the recommendation service with ``--shards N --shard-by ...`` (or
+CHROMA_SHARDS / CHROMA_SHARD_BY) afterwards; the source collection is kept.
+
+Usage:
+    python shard_catalog.py --chroma-dir ./chroma_db --shards 4 --shard-by hash
+"""
+
+import time
+import logging
+import argparse
+
+from chroma_service import ChromaService
+from sharded_collection import SHARD_STRATEGIES, shard_collection_name
+
+logger = logging.getLogger('shard_catalog')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partition the paintings collection into shards")
+    parser.add_argument('--chroma-dir', default='./chroma_db', help='ChromaDB data directory')
+    parser.add_argument('--collection', default='paintings', help='Source collection name')
+    parser.add_argument('--shards', type=int, required=True, help='Number of shards (2 or more)')
+    parser.add_argument('--shard-by', choices=SHARD_STRATEGIES, default='hash',
+                       help='Partition by hash of painting ID or by art movement')
+    parser.add_argument('--replace', action='store_true', help='Drop existing shard collections first')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.shards < 2:
+        parser.error("--shards must be at least 2")
+
+    source = ChromaService(collection_name=args.collection, persist_directory=args.chroma_dir)
+    if not source.collection:
+        raise SystemExit(f"Collection '{args.collection}' not found in {args.chroma_dir}")
+
+    target = ChromaService(collection_name=args.collection, persist_directory=args.chroma_dir,
+                           num_shards=args.shards, shard_by=args.shard_by)
+    if target.collection is not None:
+        if not args.replace:
+            raise SystemExit("Shard collections already exist; pass --replace to rebuild them")
+        for shard in range(args.shards):
+            target.client.delete_collection(shard_collection_name(args.collection, shard))
+
+    if not target.create_collection(source.get_hnsw_config()):
+        raise SystemExit("Failed to create shard collections")
+
+    start_time = time.time()
+    copied = target.copy_from(source.collection)
+    logger.info(f"Copied {copied} paintings into {args.shards} shards in {time.time() - start_time:.1f}s "
+                f"(per shard: {target.collection.shard_counts()})")
+
+
+if __name__ == "__main__":
+    main()
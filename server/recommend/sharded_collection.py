@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Sharded painting collection.
+
+Partitions the catalog across several ChromaDB collections (one HNSW graph
+each) and presents them through the subset of the collection API that
+ChromaService uses. Queries fan out to every shard on a thread pool and the
+per-shard results, already sorted by distance, are merged with a heap, so
+exclusion filtering and similarity thresholds downstream are unchanged.
+"""
+
+import zlib
+import heapq
+import logging
+import itertools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ('hash', 'movement')
+
+
+def shard_collection_name(collection_name: str, shard: int) -> str:
+    """
+    Args:
+        collection_name: Base collection name
+        shard: Shard number
+
+    Returns:
+        Name of the shard's collection
+    """
+    return f"{collection_name}_shard{shard:02d}"
+
+
+class ShardedCollection:
+    """
+    Several collections queried as one.
+
+    Paintings are assigned to a shard by a stable hash of their ID or of
+    their art movement (``movement`` metadata, falling back to the ID).
+    Lookups by ID or ``where`` go to every shard, so both strategies stay
+    correct for reads.
+    """
+
+    def __init__(self, name: str, shards: List, shard_by: str = 'hash',
+                 max_workers: Optional[int] = None):
+        """
+        Args:
+            name: Base collection name
+            shards: Shard collections, in shard order
+            shard_by: Partitioning strategy ("hash" or "movement")
+            max_workers: Fan-out threads (defaults to one per shard)
+        """
+        if shard_by not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard strategy: {shard_by}")
+        self.name = name
+        self.shards = shards
+        self.shard_by = shard_by
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(shards),
+                                            thread_name_prefix='shard')
+
+    def shard_for(self, painting_id: str, metadata: Optional[Dict] = None) -> int:
+        """
+        Pick the shard a painting is stored in.
+
+        Args:
+            painting_id: ID of the painting
+            metadata: Painting metadata (``movement`` is used with shard_by="movement")
+
+        Returns:
+            Shard number
+        """
+        key = painting_id
+        if self.shard_by == 'movement' and metadata and metadata.get('movement'):
+            key = str(metadata['movement'])
+        return zlib.crc32(key.encode('utf-8')) % len(self.shards)
+
+    def _fan_out(self, method: str, **kwargs) -> List:
+        # Each shard call gets its own copy of the request's log context
+        futures = [self._executor.submit(contextvars.copy_context().run, getattr(shard, method), **kwargs)
+                   for shard in self.shards]
+        return [future.result() for future in futures]
+
+    @property
+    def configuration(self) -> Dict:
+        return self.shards[0].configuration
+
+    def count(self) -> int:
+        return sum(self._fan_out('count'))
+
+    def shard_counts(self) -> List[int]:
+        return self._fan_out('count')
+
+    def modify(self, name: Optional[str] = None, **kwargs):
+        """
+        Apply a modification (e.g. configuration) to every shard.
+        """
+        if name is not None:
+            raise ValueError("Renaming a sharded collection is not supported")
+        self._fan_out('modify', **kwargs)
+
+    def add(self, ids: List[str], embeddings, metadatas: Optional[List[Dict]] = None, **kwargs):
+        """
+        Route paintings to their shards and add them.
+        """
+        groups = {}
+        for i, painting_id in enumerate(ids):
+            metadata = metadatas[i] if metadatas else None
+            groups.setdefault(self.shard_for(painting_id, metadata), []).append(i)
+
+        for shard, rows in groups.items():
+            self.shards[shard].add(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows] if metadatas else None,
+                **kwargs
+            )
+
+    def query(self, query_embeddings: List, n_results: int = 10,
+              include: Optional[List[str]] = None, **kwargs) -> Dict:
+        """
+        Query every shard in parallel and merge the per-shard top-k.
+
+        Returns:
+            Result in the same shape as ``Collection.query``
+        """
+        include = include or ['metadatas', 'distances']
+        fields = ['distances'] + [field for field in include if field != 'distances']
+        shard_results = self._fan_out('query', query_embeddings=query_embeddings,
+                                      n_results=n_results, include=fields, **kwargs)
+
+        merged = {'ids': []}
+        merged.update({field: [] for field in include})
+        for q in range(len(query_embeddings)):
+            # Each shard's list is sorted by distance; heapq.merge keeps that order
+            streams = []
+            for result in shard_results:
+                if not result or not result.get('ids') or q >= len(result['ids']):
+                    continue
+                rows = [
+                    (result['distances'][q][i], result['ids'][q][i],
+                     {field: result[field][q][i] for field in include if result.get(field) is not None})
+                    for i in range(len(result['ids'][q]))
+                ]
+                streams.append(rows)
+
+            top = list(itertools.islice(heapq.merge(*streams, key=lambda row: row[0]), n_results))
+            merged['ids'].append([painting_id for _, painting_id, _ in top])
+            for field in include:
+                merged[field].append([values.get(field) for _, _, values in top])
+        return merged
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict:
+        """
+        Get paintings by ID, filter or page across all shards.
+
+        Pages (``limit``/``offset``) walk the shards in order, so paging
+        through the whole catalog visits every painting exactly once.
+
+        Returns:
+            Result in the same shape as ``Collection.get``
+        """
+        include = include or ['metadatas']
+        merged = {'ids': []}
+        merged.update({field: [] for field in include})
+
+        def extend(result: Dict):
+            merged['ids'].extend(result.get('ids') or [])
+            for field in include:
+                values = result.get(field)
+                merged[field].extend(list(values) if values is not None else [None] * len(result.get('ids') or []))
+
+        if ids is None and where is None:
+            skip = offset or 0
+            remaining = limit
+            for shard in self.shards:
+                if remaining is not None and remaining <= 0:
+                    break
+                shard_count = shard.count()
+                if skip >= shard_count:
+                    skip -= shard_count
+                    continue
+                result = shard.get(limit=remaining, offset=skip, include=include)
+                extend(result)
+                skip = 0
+                if remaining is not None:
+                    remaining -= len(result.get('ids') or [])
+            return merged
+
+        for result in self._fan_out('get', ids=ids, where=where, include=include):
+            extend(result)
+
+        if ids is not None:
+            # Return rows in the order they were asked for, like a single collection
+            position = {painting_id: i for i, painting_id in enumerate(merged['ids'])}
+            order = [position[painting_id] for painting_id in ids if painting_id in position]
+            merged = {key: [values[i] for i in order] for key, values in merged.items()}
+        if offset or limit is not None:
+            end = (offset or 0) + limit if limit is not None else None
+            merged = {key: values[offset or 0:end] for key, values in merged.items()}
+        return merged
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Stress check for live ingest: query throughput while paintings are added.
+
+Builds a synthetic catalog (see benchmark.py), runs reader threads issuing
+recommendation queries against one ChromaService, first on their own and
+then while a writer thread ingests more paintings through add_paintings in
+batches. Reports throughput and latency for both phases and checks that:
+
+- no query failed or came back empty,
+- every snapshot a reader saw was internally consistent (ids, id map and
+  vector matrix the same length) and versions only moved forward,
+- after the ingest the in-memory index matches the collection and holds
+  the exact vectors that were written,
+- throughput during the ingest stayed within --min-throughput-ratio of
+  the baseline.
+
+Exits non-zero if any check fails.
+
+Usage:
+    python stress_ingest.py --size 10000 --ingest 10000 --readers 4
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from typing import Dict, List
+import numpy as np
+
+from benchmark import build_catalog, generate_workload, painting_id, random_unit_vectors, summarize
+from chroma_service import ChromaService
+
+logger = logging.getLogger('stress_ingest')
+
+
+class ReaderStats:
+    """
+    Latencies and problems recorded by one reader thread.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.empty = 0
+        self.inconsistent = 0
+        self.versions_seen = set()
+
+
+def reader(service: ChromaService, workload: List[Dict], k: int, offset: int,
+           stop: threading.Event, stats: ReaderStats):
+    """
+    Issue recommendation queries until ``stop`` is set.
+    """
+    last_version = -1
+    i = offset
+    while not stop.is_set():
+        user = workload[i % len(workload)]
+        i += 1
+
+        snapshot = service.snapshot()
+        index = snapshot.index
+        if (snapshot.version < last_version or
+                not len(index.ids) == len(index.id_to_row) == len(index.vectors)):
+            stats.inconsistent += 1
+        last_version = snapshot.version
+        stats.versions_seen.add(snapshot.version)
+
+        start = time.perf_counter()
+        try:
+            recs = service.get_recommendations_for_user(user['liked'], user['excluded'], k)
+        except Exception as e:
+            logger.error(f"Query failed: {e}")
+            stats.errors += 1
+            continue
+        stats.latencies.append((time.perf_counter() - start) * 1000)
+        if not recs:
+            stats.empty += 1
+
+
+def run_phase(service: ChromaService, workload: List[Dict], k: int, readers: int,
+              until) -> Dict:
+    """
+    Run reader threads until ``until()`` returns.
+
+    Returns:
+        Latency/throughput summary plus problem counts
+    """
+    stop = threading.Event()
+    stats = [ReaderStats() for _ in range(readers)]
+    threads = [threading.Thread(target=reader, args=(service, workload, k, n * 97, stop, stats[n]),
+                                name=f'reader-{n}', daemon=True)
+               for n in range(readers)]
+
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    until()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - wall_start
+
+    latencies = [ms for reader_stats in stats for ms in reader_stats.latencies]
+    summary = summarize(latencies or [0.0], wall_s, [])
+    summary['wall_s'] = round(wall_s, 2)
+    summary['errors'] = sum(reader_stats.errors for reader_stats in stats)
+    summary['empty'] = sum(reader_stats.empty for reader_stats in stats)
+    summary['inconsistent_snapshots'] = sum(reader_stats.inconsistent for reader_stats in stats)
+    summary['snapshot_versions'] = len(set().union(*(reader_stats.versions_seen for reader_stats in stats)))
+    return summary
+
+
+def ingest(service: ChromaService, vectors: np.ndarray, first_row: int, batch_size: int) -> Dict:
+    """
+    Add ``vectors`` as new paintings in batches.
+
+    Returns:
+        Dictionary with counts and timing
+    """
+    start_time = time.time()
+    failed = 0
+    for start in range(0, len(vectors), batch_size):
+        batch = [{'id': painting_id(first_row + row), 'embedding': vectors[row].tolist(), 'style': 'stress'}
+                 for row in range(start, min(start + batch_size, len(vectors)))]
+        if not service.add_paintings(batch):
+            failed += len(batch)
+    return {'added': len(vectors) - failed, 'failed': failed, 'duration_s': round(time.time() - start_time, 2)}
+
+
+def check_final_state(service: ChromaService, vectors: np.ndarray, first_row: int, samples: int = 200) -> List[str]:
+    """
+    Compare the in-memory index with the collection after the ingest.
+
+    Returns:
+        Descriptions of any mismatches
+    """
+    problems = []
+    index = service.index
+    count = service.collection.count()
+    if len(index) != count:
+        problems.append(f"index has {len(index)} paintings, collection has {count}")
+
+    rows = np.linspace(0, len(vectors) - 1, num=min(samples, len(vectors)), dtype=int)
+    for row in rows:
+        embedding = index.get_embedding(painting_id(first_row + row))
+        if embedding is None:
+            problems.append(f"{painting_id(first_row + row)} missing from index")
+        elif not np.allclose(embedding, vectors[row], atol=1e-3):
+            problems.append(f"{painting_id(first_row + row)} has the wrong vector")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query throughput while ingesting into ChromaService")
+    parser.add_argument('--size', type=int, default=10000, help='Paintings in the catalog before ingest')
+    parser.add_argument('--ingest', type=int, default=10000, help='Paintings added during the run')
+    parser.add_argument('--ingest-batch', type=int, default=500, help='Paintings per add_paintings call')
+    parser.add_argument('--readers', type=int, default=4, help='Query threads')
+    parser.add_argument('--baseline-s', type=float, default=10.0, help='Seconds of queries without ingest')
+    parser.add_argument('--k', type=int, default=10, help='Recommendations per query')
+    parser.add_argument('--min-throughput-ratio', type=float, default=0.7,
+                       help='Fail if throughput during ingest drops below this fraction of baseline')
+    parser.add_argument('--data-dir', default='./benchmark_data', help='Directory for the synthetic catalog')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Also write the results JSON here')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    # The ingest grows the catalog, so build_catalog rebuilds it on the next run
+    catalog = build_catalog(args.data_dir, args.size, args.seed)
+    service = ChromaService(persist_directory=catalog['path'])
+    if not service.load_index():
+        raise RuntimeError(f"Could not load index for catalog at {catalog['path']}")
+    service.warm_up()
+
+    rng = np.random.default_rng(args.seed)
+    workload = generate_workload(rng, service.index.ids, 500, liked_median=8, excluded_median=50)
+    new_vectors = random_unit_vectors(rng, args.ingest)
+
+    logger.info(f"Baseline: {args.readers} readers for {args.baseline_s:.0f}s")
+    baseline = run_phase(service, workload, args.k, args.readers, lambda: time.sleep(args.baseline_s))
+
+    logger.info(f"Ingesting {args.ingest} paintings in batches of {args.ingest_batch} under load")
+    ingest_result = {}
+    during = run_phase(service, workload, args.k, args.readers,
+                       lambda: ingest_result.update(ingest(service, new_vectors, args.size, args.ingest_batch)))
+
+    problems = check_final_state(service, new_vectors, args.size)
+    ratio = (during['throughput_qps'] / baseline['throughput_qps']
+             if baseline['throughput_qps'] and during['throughput_qps'] else 0.0)
+    for name, phase in (('baseline', baseline), ('during ingest', during)):
+        if phase['errors'] or phase['empty']:
+            problems.append(f"{name}: {phase['errors']} failed and {phase['empty']} empty queries")
+        if phase['inconsistent_snapshots']:
+            problems.append(f"{name}: {phase['inconsistent_snapshots']} inconsistent snapshots")
+    if ingest_result.get('failed'):
+        problems.append(f"{ingest_result['failed']} paintings failed to ingest")
+    if ratio < args.min_throughput_ratio:
+        problems.append(f"throughput during ingest was {ratio:.2f}x baseline "
+                        f"(minimum {args.min_throughput_ratio:.2f}x)")
+
+    results = {
+        'catalog': {'size': args.size, 'path': catalog['path']},
+        'baseline': baseline,
+        'during_ingest': during,
+        'ingest': {**ingest_result, 'paintings_per_s': round(ingest_result['added'] / ingest_result['duration_s'], 1)
+                   if ingest_result.get('duration_s') else None},
+        'throughput_ratio': round(ratio, 3),
+        'final_index_size': len(service.index),
+        'problems': problems,
+        'passed': not problems
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(0 if not problems else 1)
+
+
+if __name__ == "__main__":
+    main()
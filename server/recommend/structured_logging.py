@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Non-blocking, sampled, structured logging for the recommendation service.
+
+Request threads only put log records on a bounded in-memory queue; a
+background listener thread formats them as one JSON object per line and
+writes them to stderr. Logging I/O never sits on the request latency path,
+and if stderr backs up records are dropped (and counted) instead of
+blocking requests.
+
+Info and debug records logged while handling a request are sampled per
+request: either all of a request's records are kept or none are, so a
+sampled request can be followed end to end. Warnings and errors are always
+kept, as is everything logged outside a request (startup, reloads). The
+level and sample rate can be changed at runtime.
+"""
+
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# Per-request logging context: None outside requests
+_request_context = contextvars.ContextVar('log_request_context', default=None)
+
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName
+        }
+        context = getattr(record, 'request', None)
+        if context:
+            entry.update(context)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != 'request':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Already rendered by DroppingQueueHandler.prepare
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps warnings and errors, and info logs of sampled requests only.
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        if context is not None:
+            record.request = context['fields']
+            if record.levelno < logging.WARNING and not context['sampled']:
+                self.sampled_out += 1
+                return False
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops records when the queue is full instead of blocking.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args into the message now (they may change after enqueueing),
+        # but leave JSON formatting to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_state = {'handler': None, 'filter': None, 'listener': None}
+
+
+def setup_logging(level: str = 'INFO', sample_rate: float = 0.01, fmt: str = 'json',
+                  queue_size: int = 10000) -> QueueListener:
+    """
+    Route all logging through a background queue listener.
+
+    Replaces any handlers already on the root logger (e.g. from
+    ``logging.basicConfig`` at import time).
+
+    Args:
+        level: Root log level name
+        sample_rate: Fraction of requests whose info/debug logs are kept
+        fmt: "json" for structured lines, "text" for plain lines
+        queue_size: Records buffered before new ones are dropped
+
+    Returns:
+        The running QueueListener (stopped automatically at exit)
+    """
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if fmt == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    sampling = SamplingFilter(sample_rate)
+    handler.addFilter(sampling)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    listener = QueueListener(handler.queue, stream_handler, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+
+    _state.update(handler=handler, filter=sampling, listener=listener)
+    return listener
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Mark the current thread as handling a request.
+
+    Decides once whether the request's info logs are sampled, and tags every
+    record logged inside the block with ``fields`` (request_id, action, ...).
+
+    Args:
+        **fields: Fields added to each record
+    """
+    sampling = _state['filter']
+    sampled = sampling is None or random.random() < sampling.sample_rate
+    token = _request_context.set({'sampled': sampled, 'fields': fields})
+    try:
+        yield sampled
+    finally:
+        _request_context.reset(token)
+
+
+def configure(level: Optional[str] = None, sample_rate: Optional[float] = None) -> Dict:
+    """
+    Change the log level and/or request sample rate at runtime.
+
+    Args:
+        level: New root level name (DEBUG, INFO, WARNING, ERROR)
+        sample_rate: New fraction of requests whose info logs are kept
+
+    Returns:
+        Current logging settings and counters
+
+    Raises:
+        ValueError: If the level name or sample rate is invalid
+    """
+    if level is not None:
+        if not isinstance(logging.getLevelName(str(level).upper()), int):
+            raise ValueError(f"Unknown log level: {level}")
+        logging.getLogger().setLevel(str(level).upper())
+    if sample_rate is not None:
+        sample_rate = float(sample_rate)
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        if _state['filter'] is not None:
+            _state['filter'].sample_rate = sample_rate
+    return get_stats()
+
+
+def get_stats() -> Dict:
+    """
+    Returns:
+        Current logging settings and counters
+    """
+    handler, sampling = _state['handler'], _state['filter']
+    return {
+        'level': logging.getLevelName(logging.getLogger().level),
+        'sample_rate': sampling.sample_rate if sampling else None,
+        'sampled_out': sampling.sampled_out if sampling else 0,
+        'dropped': handler.dropped if handler else 0,
+        'queued': handler.queue.qsize() if handler else 0,
+        'async': handler is not None
+    }
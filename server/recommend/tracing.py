@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Opt-in request tracing and profiling for the recommendation service.
+
+A request sent with ``"trace": true`` gets a per-stage timing breakdown
+(embedding fetch, aggregation, Chroma query, exclusion filtering,
+formatting) and counters such as IDs fetched and candidates excluded in its
+response. Separately, the ``profile`` action switches on a cProfile hook that
+keeps the profiles of the slowest N requests and writes them to disk.
+"""
+
+import os
+import io
+import re
+import time
+import heapq
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """
+    Per-request stage timings and counters.
+
+    A disabled trace records nothing, so it can be passed through the request
+    path unconditionally.
+    """
+
+    def __init__(self, enabled: bool = False):
+        """
+        Args:
+            enabled: Whether to record stages and counters
+        """
+        self.enabled = enabled
+        self.stages = {}    # stage -> milliseconds (summed over repeats)
+        self.counts = {}    # counter -> value (summed over repeats)
+        self._start = time.perf_counter()
+
+    @classmethod
+    def from_request(cls, request: Dict) -> 'Trace':
+        """
+        Create a trace for a request.
+
+        Args:
+            request: Decoded request, optionally containing ``trace: true``
+
+        Returns:
+            Trace, enabled if the request asked for it
+        """
+        return cls(enabled=bool(request.get('trace')))
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a block of work as the named stage.
+
+        Args:
+            name: Stage name
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, (time.perf_counter() - start) * 1000)
+
+    def add_time(self, name: str, elapsed_ms: float):
+        """
+        Add time measured by the caller to a stage.
+
+        Args:
+            name: Stage name
+            elapsed_ms: Milliseconds to add
+        """
+        if self.enabled:
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def count(self, name: str, value: int = 1):
+        """
+        Add to a counter.
+
+        Args:
+            name: Counter name
+            value: Amount to add
+        """
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self) -> Dict:
+        """
+        Returns:
+            Dictionary with stage timings, counters and total time
+        """
+        return {
+            'stages_ms': {name: round(ms, 3) for name, ms in self.stages.items()},
+            'counts': dict(self.counts),
+            'total_ms': round((time.perf_counter() - self._start) * 1000, 3)
+        }
+
+
+class RequestProfiler:
+    """
+    cProfile hook that keeps the profiles of the slowest N requests.
+
+    Only one request is profiled at a time (cProfile cannot run in several
+    threads at once on newer Pythons); requests arriving while another is
+    being profiled run unprofiled.
+    """
+
+    def __init__(self, top_n: int = 10, output_dir: str = './profiles'):
+        """
+        Args:
+            top_n: Number of slowest requests to keep
+            output_dir: Directory profiles are written to
+        """
+        self.top_n = top_n
+        self.output_dir = output_dir
+        self.enabled = False
+        self._slowest = []  # min-heap of (duration_ms, seq, info, profiler)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self.profiled = 0
+        self.skipped = 0
+
+    def start(self, top_n: Optional[int] = None):
+        """
+        Start profiling requests, discarding previously kept profiles.
+
+        Args:
+            top_n: Optional new number of slowest requests to keep
+        """
+        with self._lock:
+            if top_n:
+                self.top_n = top_n
+            self._slowest = []
+            self.profiled = 0
+            self.skipped = 0
+            self.enabled = True
+        logger.info(f"Request profiling enabled (keeping slowest {self.top_n})")
+
+    def stop(self):
+        """
+        Stop profiling requests. Kept profiles stay available for ``dump``.
+        """
+        self.enabled = False
+        logger.info("Request profiling disabled")
+
+    @contextmanager
+    def profile(self, info: Dict):
+        """
+        Profile a block of work if profiling is enabled.
+
+        Args:
+            info: Request details stored with the profile (action, request_id)
+        """
+        if not self.enabled or not self._active.acquire(blocking=False):
+            if self.enabled:
+                self.skipped += 1
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+        finally:
+            self._active.release()
+            self._record((time.perf_counter() - start) * 1000, info, profiler)
+
+    def _record(self, duration_ms: float, info: Dict, profiler: cProfile.Profile):
+        with self._lock:
+            self.profiled += 1
+            self._seq += 1
+            if len(self._slowest) >= self.top_n and duration_ms <= self._slowest[0][0]:
+                return
+            entry = (duration_ms, self._seq, info, profiler)
+            if len(self._slowest) >= self.top_n:
+                heapq.heapreplace(self._slowest, entry)
+            else:
+                heapq.heappush(self._slowest, entry)
+
+    def dump(self, limit: int = 30) -> List[Dict]:
+        """
+        Write the kept profiles to ``output_dir``, slowest first.
+
+        Each request gets a binary ``.prof`` file (for snakeviz / pstats) and
+        a ``.txt`` summary sorted by cumulative time.
+
+        Args:
+            limit: Number of functions in each text summary
+
+        Returns:
+            List of dictionaries describing the written profiles
+        """
+        with self._lock:
+            entries = sorted(self._slowest, key=lambda entry: entry[0], reverse=True)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        written = []
+        for rank, (duration_ms, _, info, profiler) in enumerate(entries, 1):
+            # The action comes from the request; keep it from steering the path
+            action = re.sub(r'[^A-Za-z0-9_]', '_', str(info.get('action', 'request')))[:32]
+            base = os.path.join(self.output_dir, f"{stamp}-{rank:02d}-{action}")
+            profiler.dump_stats(base + '.prof')
+
+            text = io.StringIO()
+            stats = pstats.Stats(profiler, stream=text)
+            stats.sort_stats('cumulative').print_stats(limit)
+            with open(base + '.txt', 'w') as f:
+                f.write(f"# {info} {duration_ms:.2f}ms\n")
+                f.write(text.getvalue())
+
+            written.append({**info, 'duration_ms': round(duration_ms, 2), 'path': base + '.prof'})
+
+        logger.info(f"Wrote {len(written)} request profiles to {self.output_dir}")
+        return written
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about the profiler.
+
+        Returns:
+            Dictionary with profiler state
+        """
+        with self._lock:
+            slowest_ms = [round(entry[0], 2) for entry in sorted(self._slowest, key=lambda entry: entry[0], reverse=True)]
+        return {
+            'enabled': self.enabled,
+            'top_n': self.top_n,
+            'profiled': self.profiled,
+            'skipped': self.skipped,
+            'slowest_ms': slowest_ms,
+            'output_dir': self.output_dir
+        }
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Per-user session state for the recommendation service.
+
+Keeps the set of paintings each user has already seen as a bitmap over the
+dense row numbers of the in-memory PaintingIndex, so requests can exclude a
+user's full history without it being sent over stdin on every call. State is
+bounded by LRU eviction and can optionally be persisted to disk.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SeenSet:
+    """
+    Read-only view of a user's seen paintings.
+
+    Supports ``in`` and ``len`` so it can be passed anywhere a set of excluded
+    painting IDs is expected. Membership is a single bit test.
+    """
+
+    def __init__(self, bits: bytearray, count: int, index):
+        """
+        Args:
+            bits: Bitmap over the rows of ``index``
+            count: Number of bits set in ``bits``
+            index: PaintingIndex the bitmap rows refer to
+        """
+        self.bits = bits
+        self.count = count
+        self.index = index
+
+    def __contains__(self, painting_id: str) -> bool:
+        row = self.index.id_to_row.get(painting_id)
+        # Rows appended by a live ingest after the bitmap was sized are unseen
+        if row is None or row >> 3 >= len(self.bits):
+            return False
+        return bool(self.bits[row >> 3] & (1 << (row & 7)))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class SeenStore:
+    """
+    LRU-bounded map from user ID to a seen-paintings bitmap.
+    """
+
+    def __init__(self, index, max_users: int = 10000, persist_path: Optional[str] = None):
+        """
+        Args:
+            index: PaintingIndex whose rows the bitmaps refer to
+            max_users: Maximum number of users kept in memory
+            persist_path: Optional .npz file to load from and save to
+        """
+        self.index = index
+        self.max_users = max_users
+        self.persist_path = persist_path
+        self._users = OrderedDict()  # user_id -> [bytearray, count]
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.evictions = 0
+
+        if persist_path and os.path.exists(persist_path):
+            self.load()
+
+    def _bitmap_size(self) -> int:
+        return (len(self.index) + 7) // 8
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            return user_id in self._users
+
+    def _get_or_create(self, user_id: str) -> List:
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = [bytearray(self._bitmap_size()), 0]
+            self._users[user_id] = entry
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._users.move_to_end(user_id)
+        return entry
+
+    def _set_seen(self, entry: List, painting_ids: Iterable[str]):
+        id_to_row = self.index.id_to_row
+        bits = entry[0]
+        for painting_id in painting_ids:
+            row = id_to_row.get(painting_id)
+            if row is None:
+                continue
+            if row >> 3 >= len(bits):
+                bits.extend(bytes(self._bitmap_size() - len(bits)))
+            mask = 1 << (row & 7)
+            if not bits[row >> 3] & mask:
+                bits[row >> 3] |= mask
+                entry[1] += 1
+
+    def mark_seen(self, user_id: str, painting_ids: Iterable[str], create: bool = True) -> Optional[int]:
+        """
+        Mark paintings as seen by a user.
+
+        Args:
+            user_id: ID of the user
+            painting_ids: IDs of the paintings seen; unknown IDs are ignored
+            create: Create the user if they have no state. Pass False for
+                incremental updates, so a new or evicted user stays a miss
+                and is seeded with their full history instead
+
+        Returns:
+            Number of paintings the user has now seen, or None if the user
+            has no state and ``create`` is False
+        """
+        with self._lock:
+            if not create and user_id not in self._users:
+                return None
+            entry = self._get_or_create(user_id)
+            self._set_seen(entry, painting_ids)
+            self._dirty = True
+            return entry[1]
+
+    def get_seen(self, user_id: str) -> Optional[SeenSet]:
+        """
+        Get a view of the paintings a user has seen.
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            SeenSet, or None if the user has no state (new or evicted)
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            self._users.move_to_end(user_id)
+            return SeenSet(entry[0], entry[1], self.index)
+
+    def forget(self, user_id: str) -> bool:
+        """
+        Drop a user's state.
+
+        Args:
+            user_id: ID of the user
+
+        Returns:
+            bool: True if the user had state
+        """
+        with self._lock:
+            self._dirty = True
+            return self._users.pop(user_id, None) is not None
+
+    @staticmethod
+    def _seen_ids(bitmap: np.ndarray, catalog_ids: List[str]) -> List[str]:
+        rows = np.flatnonzero(np.unpackbits(bitmap, bitorder='little'))
+        return [catalog_ids[row] for row in rows if row < len(catalog_ids)]
+
+    def remap(self, new_index):
+        """
+        Re-key every bitmap onto the rows of a new index.
+
+        Called when the catalog is reloaded; paintings missing from the new
+        index are dropped from the users' seen sets. When the new index only
+        appends rows (live ingest), bitmaps stay valid and grow on demand.
+
+        Args:
+            new_index: PaintingIndex to switch to
+        """
+        start_time = time.time()
+        with self._lock:
+            old_index = self.index
+            self.index = new_index
+            if new_index.ids[:len(old_index.ids)] == old_index.ids:
+                return
+
+            users = self._users
+            self._users = OrderedDict()
+            for user_id, (bits, _) in users.items():
+                entry = self._get_or_create(user_id)
+                bitmap = np.frombuffer(bytes(bits), dtype=np.uint8)
+                self._set_seen(entry, self._seen_ids(bitmap, old_index.ids))
+            self._dirty = True
+
+        logger.info(f"Remapped seen state for {len(self._users)} users in {time.time() - start_time:.2f}s")
+
+    def save(self) -> bool:
+        """
+        Write all user state to ``persist_path`` if it changed.
+
+        Returns:
+            bool: True if saved (or nothing to save), False on error
+        """
+        if not self.persist_path:
+            return True
+
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return True
+                user_ids = list(self._users.keys())
+                size = self._bitmap_size()
+                bitmaps = np.zeros((len(user_ids), size), dtype=np.uint8)
+                for i, user_id in enumerate(user_ids):
+                    bitmap = np.frombuffer(bytes(self._users[user_id][0]), dtype=np.uint8)
+                    bitmaps[i, :len(bitmap)] = bitmap
+                catalog_ids = np.array(self.index.ids, dtype=str)
+                self._dirty = False
+
+            tmp_path = self.persist_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, user_ids=np.array(user_ids, dtype=str),
+                         bitmaps=bitmaps, catalog_ids=catalog_ids)
+            os.replace(tmp_path, self.persist_path)
+
+            logger.info(f"Saved seen state for {len(user_ids)} users to {self.persist_path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to save user state: {e}")
+            return False
+
+    def load(self) -> bool:
+        """
+        Load user state from ``persist_path``.
+
+        Bitmaps saved against a different catalog are remapped by painting ID.
+
+        Returns:
+            bool: True if loaded successfully, False otherwise
+        """
+        try:
+            with np.load(self.persist_path) as data:
+                user_ids = data['user_ids'].tolist()
+                bitmaps = data['bitmaps']
+                catalog_ids = data['catalog_ids'].tolist()
+
+            same_catalog = catalog_ids == self.index.ids
+            with self._lock:
+                self._users = OrderedDict()
+                for user_id, bitmap in zip(user_ids, bitmaps):
+                    if same_catalog:
+                        count = int(np.unpackbits(bitmap).sum())
+                        self._users[user_id] = [bytearray(bitmap.tobytes()), count]
+                    else:
+                        entry = self._get_or_create(user_id)
+                        self._set_seen(entry, self._seen_ids(bitmap, catalog_ids))
+                self._dirty = not same_catalog
+
+            logger.info(f"Loaded seen state for {len(user_ids)} users from {self.persist_path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to load user state: {e}")
+            return False
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about the stored user state.
+
+        Returns:
+            Dictionary with user state statistics
+        """
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'max_users': self.max_users,
+                'bitmap_bytes': self._bitmap_size() * len(self._users),
+                'evictions': self.evictions,
+                'persist_path': self.persist_path
+            }
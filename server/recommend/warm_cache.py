@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+On-disk snapshots of the recommendation service's warm state.
+
+When server.js respawns the service, everything derived from the catalog is
+rebuilt from scratch: the in-memory painting index, per-user prefetch
+queues and the candidate pools behind page cursors. This store snapshots
+that state to a directory and restores it at startup:
+
+    manifest.json       catalog version stamp and snapshot times
+    index_ids.npy       painting IDs, in row order
+    index_vectors.npy   embedding matrix, opened memory-mapped on restore
+    state_<name>.json   prefetch queues and cursor pools
+
+Everything is tagged with the catalog version it was built from and is
+ignored when the catalog has changed since.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional
+import numpy as np
+
+from painting_index import PaintingIndex
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+
+class WarmCacheStore:
+    """
+    Directory of version-stamped snapshots.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: Directory snapshots are written to
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self._path(MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update_manifest(self, **entries):
+        manifest = self._read_manifest()
+        manifest.update(entries)
+        tmp_path = self._path(MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._path(MANIFEST))
+
+    def _replace(self, name: str, write_fn):
+        # Write to a temporary file and rename so readers never see a partial file
+        tmp_path = self._path(name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_path, self._path(name))
+
+    def save_index(self, index: PaintingIndex, version: str) -> bool:
+        """
+        Snapshot the painting index.
+
+        Args:
+            index: Index to snapshot
+            version: Catalog version stamp the index was loaded from
+
+        Returns:
+            bool: True if saved, False on error
+        """
+        try:
+            start_time = time.time()
+            with self._lock:
+                # Invalidate first so a crash mid-write can't pair old stamp with new files
+                self._update_manifest(index=None)
+                self._replace('index_ids.npy', lambda f: np.save(f, np.array(index.ids, dtype=str)))
+                self._replace('index_vectors.npy',
+                              lambda f: np.save(f, np.ascontiguousarray(index.vectors, dtype=np.float32)))
+                self._update_manifest(index={'version': version, 'paintings': len(index),
+                                             'saved_at': time.time()})
+            logger.info(f"Saved index snapshot of {len(index)} paintings in {time.time() - start_time:.2f}s")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to save index snapshot: {e}")
+            return False
+
+    def load_index(self, version: str) -> Optional[PaintingIndex]:
+        """
+        Restore the painting index if it was saved from this catalog version.
+
+        The embedding matrix is memory-mapped, so restore time does not grow
+        with catalog size and pages are shared with the OS page cache.
+
+        Args:
+            version: Current catalog version stamp
+
+        Returns:
+            PaintingIndex, or None if there is no snapshot for this version
+        """
+        try:
+            entry = self._read_manifest().get('index')
+            if not entry or entry.get('version') != version:
+                if entry:
+                    logger.info("Index snapshot is from another catalog version, ignoring it")
+                return None
+
+            start_time = time.time()
+            ids = np.load(self._path('index_ids.npy')).tolist()
+            vectors = np.load(self._path('index_vectors.npy'), mmap_mode='r')
+            if len(ids) != entry['paintings'] or vectors.shape[0] != len(ids):
+                logger.warning("Index snapshot is incomplete, ignoring it")
+                return None
+
+            index = PaintingIndex(ids, vectors)
+            logger.info(f"Restored index snapshot of {len(index)} paintings in {time.time() - start_time:.2f}s")
+            return index
+
+        except Exception as e:
+            logger.error(f"Failed to load index snapshot: {e}")
+            return None
+
+    def save_state(self, name: str, state: Dict, version: str) -> bool:
+        """
+        Snapshot a JSON-serializable cache.
+
+        Args:
+            name: Cache name ("prefetch", "cursors", ...)
+            state: Exported cache contents
+            version: Catalog version stamp the cache was built from
+
+        Returns:
+            bool: True if saved, False on error
+        """
+        try:
+            payload = json.dumps({'version': version, 'saved_at': time.time(), 'state': state},
+                                 separators=(',', ':')).encode('utf-8')
+            with self._lock:
+                self._replace(f'state_{name}.json', lambda f: f.write(payload))
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to save {name} snapshot: {e}")
+            return False
+
+    def load_state(self, name: str, version: str) -> Optional[Dict]:
+        """
+        Restore a cache if it was saved from this catalog version.
+
+        Args:
+            name: Cache name
+            version: Current catalog version stamp
+
+        Returns:
+            Exported cache contents, or None if missing or stale
+        """
+        try:
+            path = self._path(f'state_{name}.json')
+            if not os.path.exists(path):
+                return None
+            with open(path) as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != version:
+                logger.info(f"{name} snapshot is from another catalog version, ignoring it")
+                return None
+            return snapshot.get('state')
+
+        except Exception as e:
+            logger.error(f"Failed to load {name} snapshot: {e}")
+            return None
+
+    def get_stats(self) -> Dict:
+        """
+        Get statistics about the snapshots on disk.
+
+        Returns:
+            Dictionary with snapshot statistics
+        """
+        files = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.tmp'):
+                files[name] = os.path.getsize(self._path(name))
+        return {
+            'directory': self.directory,
+            'index': self._read_manifest().get('index'),
+            'file_bytes': files
+        }
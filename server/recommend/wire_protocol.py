@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Wire protocol codecs for the Node.js <-> Python recommendation channel.
+
+The service always starts in JSON-lines mode. If msgpack is installed it
+advertises the "msgpack" protocol in its ready message, and the client can
+switch to it with a ``set_protocol`` request. In msgpack mode every message
+is a 4-byte big-endian length followed by a msgpack map, and painting id
+lists may be sent as packed arrays instead of arrays of strings:
+
+    ext type 1: concatenated 12-byte MongoDB ObjectIds
+    ext type 2: little-endian uint32 numeric ids
+"""
+
+import json
+import struct
+import logging
+from typing import Dict, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON lines always work
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+EXT_OBJECT_IDS = 1
+EXT_UINT32_IDS = 2
+
+_FRAME_HEADER = struct.Struct('>I')
+
+
+def available_protocols() -> List[str]:
+    """
+    List the protocols this process can speak, in order of preference.
+
+    Returns:
+        Protocol names, always including "json"
+    """
+    protocols = ['json']
+    if msgpack is not None:
+        protocols.append('msgpack')
+    return protocols
+
+
+def unpack_ids(code: int, data: bytes):
+    """
+    Decode a packed id array into painting id strings.
+
+    Args:
+        code: msgpack extension type code
+        data: Packed id bytes
+
+    Returns:
+        List of painting ids, or the raw ExtType for unknown codes
+    """
+    if code == EXT_OBJECT_IDS:
+        hex_ids = data.hex()
+        return [hex_ids[i:i + 24] for i in range(0, len(hex_ids), 24)]
+    if code == EXT_UINT32_IDS:
+        count = len(data) // 4
+        return [str(painting_id) for painting_id in struct.unpack(f'<{count}I', data)]
+    return msgpack.ExtType(code, data)
+
+
+class JsonLinesCodec:
+    """
+    One JSON object per line.
+    """
+
+    name = 'json'
+
+    def read_message(self, stream) -> Optional[Dict]:
+        """
+        Read the next message, skipping blank lines.
+
+        Args:
+            stream: Binary input stream
+
+        Returns:
+            Decoded message or None at EOF
+
+        Raises:
+            json.JSONDecodeError: If a line is not valid JSON
+        """
+        while True:
+            line = stream.readline()
+            if not line:  # EOF
+                return None
+            line = line.strip()
+            if line:
+                return json.loads(line)
+
+    def write_message(self, stream, message: Dict):
+        """
+        Write one message and flush.
+
+        Args:
+            stream: Binary output stream
+            message: Message to send
+        """
+        stream.write(json.dumps(message).encode('utf-8') + b'\n')
+        stream.flush()
+
+
+class MsgpackCodec:
+    """
+    Length-prefixed msgpack frames with packed id arrays.
+    """
+
+    name = 'msgpack'
+
+    def read_message(self, stream) -> Optional[Dict]:
+        """
+        Read the next frame.
+
+        Args:
+            stream: Binary input stream
+
+        Returns:
+            Decoded message or None at EOF
+
+        Raises:
+            ValueError: If the stream ends in the middle of a frame
+        """
+        header = stream.read(_FRAME_HEADER.size)
+        if not header:  # EOF
+            return None
+        if len(header) < _FRAME_HEADER.size:
+            raise ValueError("Truncated frame header")
+
+        (length,) = _FRAME_HEADER.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise ValueError("Truncated frame payload")
+
+        return msgpack.unpackb(payload, raw=False, ext_hook=unpack_ids)
+
+    def write_message(self, stream, message: Dict):
+        """
+        Write one frame and flush.
+
+        Args:
+            stream: Binary output stream
+            message: Message to send
+        """
+        payload = msgpack.packb(message, use_bin_type=True)
+        stream.write(_FRAME_HEADER.pack(len(payload)) + payload)
+        stream.flush()
+
+
+def get_codec(protocol: str):
+    """
+    Get the codec for a protocol name.
+
+    Args:
+        protocol: "json" or "msgpack"
+
+    Returns:
+        Codec instance or None if the protocol is not available
+    """
+    if protocol == 'json':
+        return JsonLinesCodec()
+    if protocol == 'msgpack' and msgpack is not None:
+        return MsgpackCodec()
+    return None
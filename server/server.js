@@ -6,6 +6,7 @@ import { v4 as uuidv4 } from "uuid";
 import cookieParser from "cookie-parser";
 import records from "./routes/record.js";
 import { spawn } from 'child_process';
+import { createHash, timingSafeEqual } from 'crypto';
 import db from "./db/connection.js";
 import { ObjectId } from "mongodb";
 
@@ -63,75 +64,42 @@ app.use((req, res, next) => {
 });
 
 // Helper function to get ChromaDB recommendation
-async function getChromaRecommendation(userId, savedPaintings, visitedIds) {
-  return new Promise((resolve) => {
-    if (!isChromaServiceReady) {
-      resolve(null);
-      return;
-    }
-
-    const chromaRequest = {
-      action: 'recommend',
-      liked_paintings: savedPaintings.map(p => p._id.toString()),
-      exclude_paintings: visitedIds,
-      count: 1
-    };
+async function getChromaRecommendation(userId, savedPaintings) {
+  // Pops from the user's prefetched queue; the service refills it in the background
+  const response = await sendChromaUserRequest({
+    action: 'next',
+    liked_paintings: savedPaintings.map(p => p._id.toString()),
+    count: 1
+  }, userId, 5000);
+
+  if (!response || response.error || !response.recommendations || response.recommendations.length === 0) {
+    return null;
+  }
 
-    let responseData = '';
-    
-    const timeout = setTimeout(() => {
-      resolve(null);
-    }, 5000);
+  // Get the painting details from MongoDB
+  const collection = db.collection("artworks");
+  const paintingId = response.recommendations[0].mongodb_id || response.recommendations[0]._id;
 
-    const responseHandler = async (data) => {
-      responseData += data.toString();
-      
-      try {
-        const response = JSON.parse(responseData);
-        clearTimeout(timeout);
-        chromaRecommendationService.stdout.removeListener('data', responseHandler);
-        
-        if (response.error || !response.recommendations || response.recommendations.length === 0) {
-          resolve(null);
-        } else {
-          // Get the painting details from MongoDB
-          const collection = db.collection("artworks");
-          const paintingId = response.recommendations[0].mongodb_id || response.recommendations[0]._id;
-          
-          try {
-            let painting;
-            if (ObjectId.isValid(paintingId)) {
-              // paintingId is a valid ObjectId hex string
-              painting = await collection.findOne({ _id: new ObjectId(paintingId) });
-            } else {
-              // paintingId is likely an integer, search by _id as integer
-              const numericId = parseInt(paintingId);
-              if (!isNaN(numericId)) {
-                painting = await collection.findOne({ _id: numericId });
-              } else {
-                // If it's neither ObjectId nor integer, try as string
-                painting = await collection.findOne({ _id: paintingId });
-              }
-            }
-            
-            if (painting) {
-              resolve(painting);
-            } else {
-              resolve(null);
-            }
-          } catch (e) {
-            resolve(null);
-          }
-        }
-      } catch (e) {
-        clearTimeout(timeout);
-        resolve(null);
+  try {
+    let painting;
+    if (ObjectId.isValid(paintingId)) {
+      // paintingId is a valid ObjectId hex string
+      painting = await collection.findOne({ _id: new ObjectId(paintingId) });
+    } else {
+      // paintingId is likely an integer, search by _id as integer
+      const numericId = parseInt(paintingId);
+      if (!isNaN(numericId)) {
+        painting = await collection.findOne({ _id: numericId });
+      } else {
+        // If it's neither ObjectId nor integer, try as string
+        painting = await collection.findOne({ _id: paintingId });
       }
-    };
+    }
 
-    chromaRecommendationService.stdout.on('data', responseHandler);
-    chromaRecommendationService.stdin.write(JSON.stringify(chromaRequest) + '\n');
-  });
+    return painting || null;
+  } catch (e) {
+    return null;
+  }
 }
 
 // Random unviewed painting route with ChromaDB integration
@@ -147,28 +115,6 @@ app.post('/random-unviewed', async (req, res) => {
     const hasSavedPaintings = savedPaintings && savedPaintings.length > 0;
 
     const collection = db.collection("artworks");
-    
-    // Get visited painting IDs for this user from Redis
-    const visitedIds = await redisClient.sMembers(`visited:${userId}`);
-    
-    // Convert visited IDs to appropriate format for MongoDB query
-    const visitedObjectIds = visitedIds
-      .filter(id => id && id.length > 0) // Filter out empty strings
-      .map(id => {
-        try {
-          // Try to create ObjectId if it's a valid hex string
-          if (ObjectId.isValid(id)) {
-            return new ObjectId(id);
-          } else {
-            // If it's a number, convert to number for comparison
-            const numId = parseInt(id);
-            return isNaN(numId) ? null : numId;
-          }
-        } catch (error) {
-          return null;
-        }
-      })
-      .filter(id => id !== null); // Remove invalid IDs
 
     let painting = null;
     let source = 'random';
@@ -179,7 +125,7 @@ app.post('/random-unviewed', async (req, res) => {
       console.log(useRecommendation);
       if (useRecommendation) {
         // Try to get ChromaDB recommendation
-        painting = await getChromaRecommendation(userId, savedPaintings, visitedIds);
+        painting = await getChromaRecommendation(userId, savedPaintings);
         if (painting) {
           source = 'chromadb';
         }
@@ -189,6 +135,28 @@ app.post('/random-unviewed', async (req, res) => {
     
     // If no painting from ChromaDB or user has no saved paintings, get random painting
     if (!painting) {
+      // Get visited painting IDs for this user from Redis
+      const visitedIds = await redisClient.sMembers(`visited:${userId}`);
+
+      // Convert visited IDs to appropriate format for MongoDB query
+      const visitedObjectIds = visitedIds
+        .filter(id => id && id.length > 0) // Filter out empty strings
+        .map(id => {
+          try {
+            // Try to create ObjectId if it's a valid hex string
+            if (ObjectId.isValid(id)) {
+              return new ObjectId(id);
+            } else {
+              // If it's a number, convert to number for comparison
+              const numId = parseInt(id);
+              return isNaN(numId) ? null : numId;
+            }
+          } catch (error) {
+            return null;
+          }
+        })
+        .filter(id => id !== null); // Remove invalid IDs
+
       const randomPaintings = await collection.aggregate([
         { $match: { _id: { $nin: visitedObjectIds } } },
         { $sample: { size: 1 } }
@@ -232,6 +200,13 @@ app.post('/viewed', async (req, res) => {
 
     // Add the paintingId to the set of viewed paintings for this user
     await redisClient.sAdd(`visited:${userId}`, paintingId.toString());
+
+    // Keep the recommendation service's session seen set in sync (fire and forget)
+    sendChromaRequest({
+      action: 'mark_seen',
+      user_id: userId,
+      painting_ids: [paintingId.toString()]
+    }, 1000);
     
     res.status(200).json({ success: true });
   } catch (error) {
@@ -247,6 +222,201 @@ app.use("/record", records);
 // Start persistent ChromaDB recommendation service
 let chromaRecommendationService = null;
 let isChromaServiceReady = false;
+let chromaProtocol = 'json';
+let chromaStdoutBuffer = Buffer.alloc(0);
+let chromaStderrBuffer = '';
+let nextChromaRequestId = 1;
+const pendingChromaRequests = new Map();
+
+// Optional compact wire format: set CHROMA_WIRE_PROTOCOL=msgpack and install
+// @msgpack/msgpack. Falls back to JSON lines if either side lacks support.
+const msgpack = process.env.CHROMA_WIRE_PROTOCOL === 'msgpack'
+  ? await import('@msgpack/msgpack').catch(() => {
+      console.warn('@msgpack/msgpack not installed, using JSON lines for ChromaDB');
+      return null;
+    })
+  : null;
+
+const OBJECT_ID_PATTERN = /^[0-9a-f]{24}$/i;
+const UINT32_ID_PATTERN = /^\d{1,9}$/;
+
+// Pack a painting id list for msgpack (see recommend/wire_protocol.py):
+// ext 1 = concatenated 12-byte ObjectIds, ext 2 = little-endian uint32 ids
+function packIds(ids) {
+  if (ids.length === 0) return ids;
+  if (ids.every(id => OBJECT_ID_PATTERN.test(id))) {
+    return new msgpack.ExtData(1, Buffer.from(ids.join(''), 'hex'));
+  }
+  if (ids.every(id => UINT32_ID_PATTERN.test(id))) {
+    const packed = Buffer.alloc(ids.length * 4);
+    ids.forEach((id, i) => packed.writeUInt32LE(Number(id), i * 4));
+    return new msgpack.ExtData(2, packed);
+  }
+  return ids;
+}
+
+function writeChromaMessage(message) {
+  if (chromaProtocol === 'msgpack') {
+    const packedMessage = { ...message };
+    for (const key of ['liked_paintings', 'exclude_paintings']) {
+      if (Array.isArray(packedMessage[key])) {
+        packedMessage[key] = packIds(packedMessage[key]);
+      }
+    }
+    const payload = msgpack.encode(packedMessage);
+    const header = Buffer.alloc(4);
+    header.writeUInt32BE(payload.length);
+    chromaRecommendationService.stdin.write(Buffer.concat([header, payload]));
+  } else {
+    chromaRecommendationService.stdin.write(JSON.stringify(message) + '\n');
+  }
+}
+
+// The service logs one JSON object per stderr line (see recommend/structured_logging.py).
+// Only warnings and errors are echoed unless CHROMA_LOG_ECHO=all; non-JSON lines
+// (library output, tracebacks) are always echoed.
+const CHROMA_LOG_ECHO_ALL = process.env.CHROMA_LOG_ECHO === 'all';
+const CHROMA_LOG_ECHO_LEVELS = new Set(['WARNING', 'ERROR', 'CRITICAL']);
+
+function readChromaLogs(data) {
+  chromaStderrBuffer += data.toString();
+  const lines = chromaStderrBuffer.split('\n');
+  chromaStderrBuffer = lines.pop();
+  for (const line of lines) {
+    if (!line.trim()) continue;
+    let entry;
+    try {
+      entry = JSON.parse(line);
+    } catch (e) {
+      console.log('🐍 ChromaDB stderr:', line);
+      continue;
+    }
+    if (!CHROMA_LOG_ECHO_ALL && !CHROMA_LOG_ECHO_LEVELS.has(entry.level)) continue;
+    const context = entry.request_id !== undefined ? ` [${entry.action} #${entry.request_id}]` : '';
+    const output = entry.level === 'ERROR' || entry.level === 'CRITICAL' ? console.error : console.log;
+    output(`🐍 ChromaDB ${entry.level}${context} ${entry.logger}: ${entry.msg}`);
+    if (entry.exc) output(entry.exc);
+  }
+}
+
+// Decode every complete message in the stdout buffer. The protocol is checked
+// per message because a set_protocol ack switches it mid-buffer.
+function readChromaMessages(data) {
+  chromaStdoutBuffer = Buffer.concat([chromaStdoutBuffer, data]);
+  while (true) {
+    let message;
+    try {
+      if (chromaProtocol === 'msgpack') {
+        if (chromaStdoutBuffer.length < 4) return;
+        const length = chromaStdoutBuffer.readUInt32BE(0);
+        if (chromaStdoutBuffer.length < 4 + length) return;
+        const payload = chromaStdoutBuffer.subarray(4, 4 + length);
+        chromaStdoutBuffer = chromaStdoutBuffer.subarray(4 + length);
+        message = msgpack.decode(payload);
+      } else {
+        const newline = chromaStdoutBuffer.indexOf(10);
+        if (newline === -1) return;
+        const line = chromaStdoutBuffer.subarray(0, newline).toString().trim();
+        chromaStdoutBuffer = chromaStdoutBuffer.subarray(newline + 1);
+        if (!line) continue;
+        message = JSON.parse(line);
+      }
+    } catch (e) {
+      console.error('Error parsing ChromaDB message:', e);
+      continue;
+    }
+    handleChromaMessage(message);
+  }
+}
+
+// Send a request to the ChromaDB service. Resolves with the response,
+// or null if the service isn't ready or doesn't answer within timeoutMs.
+// The timeout is sent as an absolute deadline so the service can drop work
+// nobody is waiting for any more.
+function sendChromaRequest(request, timeoutMs) {
+  return new Promise((resolve) => {
+    if (!chromaRecommendationService || !isChromaServiceReady) {
+      resolve(null);
+      return;
+    }
+
+    const requestId = nextChromaRequestId++;
+    const timeout = setTimeout(() => {
+      pendingChromaRequests.delete(requestId);
+      resolve(null);
+    }, timeoutMs);
+
+    pendingChromaRequests.set(requestId, { resolve, timeout });
+    writeChromaMessage({ ...request, request_id: requestId, deadline_ms: Date.now() + timeoutMs });
+  });
+}
+
+function markChromaServiceReady(readyMessage) {
+  isChromaServiceReady = true;
+  console.log(`✅ ChromaDB service is now ready in ${readyMessage.time_to_ready_ms}ms (${chromaProtocol})`, readyMessage.phases);
+}
+
+// Ask the service to switch to msgpack before any other request is sent
+function negotiateChromaProtocol(readyMessage) {
+  const requestId = nextChromaRequestId++;
+  const timeout = setTimeout(() => {
+    pendingChromaRequests.delete(requestId);
+    markChromaServiceReady(readyMessage);
+  }, 5000);
+
+  pendingChromaRequests.set(requestId, {
+    timeout,
+    // Called synchronously by the reader, so bytes after the ack are decoded as msgpack
+    resolve: (ack) => {
+      if (!ack) return;
+      if (ack.protocol === 'msgpack') {
+        chromaProtocol = 'msgpack';
+      }
+      markChromaServiceReady(readyMessage);
+    }
+  });
+  writeChromaMessage({ action: 'set_protocol', protocol: 'msgpack', request_id: requestId });
+}
+
+// Send a request keyed by user_id so the service excludes the user's session
+// seen set instead of receiving the full viewed history on every call. On a
+// session miss (new user, LRU eviction or service restart) the session is
+// seeded once with the viewed history from Redis.
+async function sendChromaUserRequest(request, userId, timeoutMs) {
+  const response = await sendChromaRequest({ ...request, user_id: userId }, timeoutMs);
+  if (!response || response.source !== 'session_miss') {
+    return response;
+  }
+
+  const viewedIds = await getUserViewedPaintings(userId);
+  return sendChromaRequest({ ...request, user_id: userId, exclude_paintings: viewedIds }, timeoutMs);
+}
+
+// Route one message from the ChromaDB service: protocol messages carry a
+// `type`, responses echo the `request_id` they answer.
+function handleChromaMessage(message) {
+  if (message.type === 'ready') {
+    if (msgpack && chromaProtocol === 'json' && (message.protocols || []).includes('msgpack')) {
+      negotiateChromaProtocol(message);
+    } else {
+      markChromaServiceReady(message);
+    }
+    return;
+  }
+  if (message.type === 'startup_failed') {
+    console.error('ChromaDB service failed to start', message.phases);
+    return;
+  }
+
+  const pending = pendingChromaRequests.get(message.request_id);
+  if (!pending) {
+    // Response to a request that already timed out
+    return;
+  }
+  clearTimeout(pending.timeout);
+  pendingChromaRequests.delete(message.request_id);
+  pending.resolve(message);
+}
 
 function startChromaRecommendationService() {
   // Use virtual environment if available, otherwise system python
@@ -260,18 +430,22 @@ function startChromaRecommendationService() {
     stdio: ['pipe', 'pipe', 'pipe'],
     cwd: process.cwd()
   });
+  chromaProtocol = 'json';
+  chromaStdoutBuffer = Buffer.alloc(0);
 
-  chromaRecommendationService.stderr.on('data', (data) => {
-    const message = data.toString();
-    console.log('🐍 ChromaDB stderr:', message);
-    if (message.includes('ready. Waiting for requests')) {
-      isChromaServiceReady = true;
-      console.log('✅ ChromaDB service is now ready');
-    }
-  });
+  chromaRecommendationService.stdout.on('data', readChromaMessages);
+
+  chromaStderrBuffer = '';
+  chromaRecommendationService.stderr.on('data', readChromaLogs);
 
   chromaRecommendationService.on('close', (code) => {
     isChromaServiceReady = false;
+    // Fail pending requests now instead of waiting for their timeouts
+    for (const pending of pendingChromaRequests.values()) {
+      clearTimeout(pending.timeout);
+      pending.resolve(null);
+    }
+    pendingChromaRequests.clear();
     setTimeout(() => {
       if (!isChromaServiceReady) {
         startChromaRecommendationService();
@@ -283,6 +457,16 @@ function startChromaRecommendationService() {
 // Start ChromaDB service
 startChromaRecommendationService();
 
+// Hot-reload the vector index after a re-ingest: `kill -HUP <node pid>`.
+// The Python service builds the new index in the background and keeps
+// serving from the old one until it swaps, so recommendations stay available.
+process.on('SIGHUP', () => {
+  if (chromaRecommendationService && isChromaServiceReady) {
+    console.log('Reloading ChromaDB index...');
+    chromaRecommendationService.kill('SIGHUP');
+  }
+});
+
 // Graceful shutdown
 process.on('SIGINT', () => {
   console.log('Shutting down...');
@@ -336,11 +520,23 @@ app.post('/recommend', async (req, res) => {
   }
 });
 
+// Actions clients may request through the recommendation routes; everything
+// else the service understands is internal and never forwarded from a request
+// body. Admin actions go through /admin/recommendation (or SIGHUP for reload).
+const PUBLIC_RECOMMENDATION_ACTIONS = new Set(['recommend', 'diverse']);
+
 // ChromaDB recommendation handler
 async function handleChromaRecommendation(req, res) {
-  const { liked_paintings, count = 10, action = 'recommend' } = req.body;
+  const { liked_paintings, count = 10, action = 'recommend', trace = false, paginate = false } = req.body;
   const userId = req.userId;
   
+  if (!PUBLIC_RECOMMENDATION_ACTIONS.has(action)) {
+    return res.status(400).json({
+      error: `Unsupported action: ${action}`,
+      actions: [...PUBLIC_RECOMMENDATION_ACTIONS]
+    });
+  }
+  
   try {
     // Get user's liked paintings if not provided
     let likedPaintingIds = liked_paintings;
@@ -358,51 +554,38 @@ async function handleChromaRecommendation(req, res) {
       });
     }
     
-    // Get user's viewed paintings to exclude
-    const viewedPaintingIds = await getUserViewedPaintings(userId);
-    
-    // Prepare ChromaDB request
-    const chromaRequest = {
+    // Send ChromaDB request; the service excludes the user's viewed paintings
+    const response = await sendChromaUserRequest({
       action: action,
       liked_paintings: likedPaintingIds,
-      exclude_paintings: viewedPaintingIds,
-      count: count
-    };
-    
-    let responseData = '';
-    
-    const timeout = setTimeout(() => {
-      res.status(500).json({ error: 'ChromaDB recommendation timeout' });
-    }, 10000); // Longer timeout for ChromaDB
-    
-    // Set up response handler
-    const responseHandler = async (data) => {
-      responseData += data.toString();
-      
-      try {
-        const response = JSON.parse(responseData);
-        clearTimeout(timeout);
-        chromaRecommendationService.stdout.removeListener('data', responseHandler);
-        
-        if (response.error) {
-          return res.status(500).json({ 
-            error: response.error,
-            source: 'chromadb_error'
-          });
-        } else {
-          // Enhance response with painting details from MongoDB
-          await enhanceRecommendationsWithDetails(response);
-          res.json(response);
-        }
-      } catch (e) {
-        console.error('Error parsing ChromaDB response:', e);
-        clearTimeout(timeout);
-        res.status(500).json({ error: 'Failed to parse ChromaDB response' });
-      }
-    };
-    
-    chromaRecommendationService.stdout.on('data', responseHandler);
-    chromaRecommendationService.stdin.write(JSON.stringify(chromaRequest) + '\n');
+      count: count,
+      trace: Boolean(trace), // Per-stage timing breakdown in the response
+      paginate: Boolean(paginate) // Rank a larger pool and return a cursor for /recommend/page
+    }, userId, 10000); // Longer timeout for ChromaDB
+
+    if (!response) {
+      return res.status(500).json({ error: 'ChromaDB recommendation timeout' });
+    }
+
+    if (response.source === 'overloaded') {
+      // The service shed this request; tell the client to back off
+      return res.status(503).json({
+        error: response.error,
+        source: 'chromadb_overloaded'
+      });
+    }
+
+    if (response.error) {
+      return res.status(500).json({ 
+        error: response.error,
+        source: 'chromadb_error'
+      });
+    }
+
+    // Enhance response with painting details from MongoDB
+    delete response.request_id;
+    await enhanceRecommendationsWithDetails(response);
+    res.json(response);
     
   } catch (error) {
     console.error('Error in ChromaDB recommendation:', error);
@@ -473,6 +656,112 @@ app.post('/recommend/chroma', async (req, res) => {
 });
 
 
+// Next page of a /recommend response, served from the service's cursor cache
+// instead of re-ranking. Expired cursors return 410 so the client can start over.
+app.post('/recommend/page', async (req, res) => {
+  const { cursor, count = 10 } = req.body;
+
+  if (!cursor) {
+    return res.status(400).json({ error: 'cursor is required' });
+  }
+  if (!isChromaServiceReady) {
+    return res.status(503).json({ 
+      error: 'ChromaDB recommendation service not ready',
+      source: 'chromadb_unavailable'
+    });
+  }
+
+  try {
+    const response = await sendChromaRequest({
+      action: 'page',
+      cursor: cursor,
+      count: count,
+      user_id: req.userId
+    }, 10000);
+
+    if (!response) {
+      return res.status(500).json({ error: 'ChromaDB recommendation timeout' });
+    }
+
+    if (response.error) {
+      return res.status(response.source === 'cursor_expired' ? 410 : 500).json({
+        error: response.error,
+        source: response.source
+      });
+    }
+
+    delete response.request_id;
+    await enhanceRecommendationsWithDetails(response);
+    res.json(response);
+  } catch (error) {
+    console.error('Error in recommendation page endpoint:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Operator actions on the recommendation service, with the fields each may carry.
+// Only served when RECOMMENDATION_ADMIN_TOKEN is set, and only with that bearer token.
+const ADMIN_RECOMMENDATION_ACTIONS = {
+  reload: ['chroma_dir'],
+  ingest: ['path', 'batch_size'],
+  profile: ['command', 'top_n'],
+  log_level: ['level', 'sample_rate']
+};
+
+function isRecommendationAdmin(req) {
+  const token = process.env.RECOMMENDATION_ADMIN_TOKEN;
+  const header = req.headers.authorization || '';
+  if (!token || !header.startsWith('Bearer ')) {
+    return false;
+  }
+  // Compare digests so the comparison takes the same time whatever the length
+  const digest = (value) => createHash('sha256').update(value).digest();
+  return timingSafeEqual(digest(header.slice('Bearer '.length)), digest(token));
+}
+
+app.post('/admin/recommendation', async (req, res) => {
+  if (!process.env.RECOMMENDATION_ADMIN_TOKEN) {
+    return res.status(404).json({ error: 'Not found' });
+  }
+  if (!isRecommendationAdmin(req)) {
+    return res.status(401).json({ error: 'Unauthorized' });
+  }
+
+  const { action } = req.body;
+  if (!Object.hasOwn(ADMIN_RECOMMENDATION_ACTIONS, action)) {
+    return res.status(400).json({
+      error: `Unsupported action: ${action}`,
+      actions: Object.keys(ADMIN_RECOMMENDATION_ACTIONS)
+    });
+  }
+
+  const request = { action };
+  for (const field of ADMIN_RECOMMENDATION_ACTIONS[action]) {
+    if (req.body[field] !== undefined) {
+      request[field] = req.body[field];
+    }
+  }
+
+  const response = await sendChromaRequest(request, 10000);
+  if (!response) {
+    return res.status(503).json({ error: 'ChromaDB recommendation service unavailable' });
+  }
+  delete response.request_id;
+  // A reload or ingest refused because the other is running is a conflict; other errors are bad input
+  res.status(response.error ? (response.status ? 409 : 400) : 200).json(response);
+});
+
+// Recommendation service metrics in Prometheus text format
+app.get('/metrics/recommendation', async (req, res) => {
+  const response = await sendChromaRequest({ action: 'metrics', format: 'prometheus' }, 2000);
+
+  if (!response || response.error) {
+    return res.status(503).type('text/plain').send('# recommendation service unavailable\n');
+  }
+
+  res.type('text/plain; version=0.0.4').send(response.text);
+});
+
 // Start server
 app.listen(PORT, () => {
   console.log(`Server listening on port ${PORT}`);